@@ -12,14 +12,183 @@
 from redis import StrictRedis
 import aioredis as aiords
 import asyncio
+import heapq
+import logging
+import math
+import random
+import time
+import uuid
+from bisect import bisect_right, insort
+from functools import reduce, wraps
+from hashlib import sha1
+from operator import itemgetter
 
 from .config import DefaultConf as dfconf, RedisConf as rdconf
-from .helpers import packb, unpackb, decode
+from .helpers import (packb, unpackb, decode, str2num, find_eq, find_ge,
+                      find_lt)
+from .stats import stats
+
+
+errlog = logging.getLogger('errors')
+
+
+# KEYS[1]: the hash key of the IncreaseCollection item
+# ARGV[1]: the itype of the collection, ARGV[2:]: the field, value pairs
+INC_HASH_UPDATE_SCRIPT = """
+local itype = ARGV[1]
+for i = 2, #ARGV, 2 do
+    local field, value = ARGV[i], tonumber(ARGV[i + 1])
+    if itype == 'inc' then
+        redis.call('HINCRBY', KEYS[1], field, value)
+    else
+        local base = tonumber(redis.call('HGET', KEYS[1], field))
+        if base then
+            if itype == 'max' then
+                value = math.max(base, value)
+            elseif itype == 'min' then
+                value = math.min(base, value)
+            elseif itype == 'avg' then
+                value = (base + value) / 2
+            end
+        end
+        redis.call('HSET', KEYS[1], field, value)
+    end
+end
+return (#ARGV - 1) / 2
+"""
+
+# KEYS[1]: the IncreaseCollection cache
+# ARGV[1]: the itype of the collection, ARGV[2:]: the field, packed value pairs
+INC_BLOB_UPDATE_SCRIPT = """
+local itype = ARGV[1]
+for i = 2, #ARGV, 2 do
+    local packed = redis.call('HGET', KEYS[1], ARGV[i])
+    if not packed then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    else
+        local base, changed = cmsgpack.unpack(packed), false
+        for field, value in pairs(cmsgpack.unpack(ARGV[i + 1])) do
+            value = tonumber(value)
+            local v = base[field]
+            if v then
+                if itype == 'inc' then
+                    value = v + value
+                elseif itype == 'max' then
+                    value = math.max(v, value)
+                elseif itype == 'min' then
+                    value = math.min(v, value)
+                elseif itype == 'avg' then
+                    value = (v + value) / 2
+                end
+            end
+            base[field], changed = value, true
+        end
+        -- the empty table is packed as an array, keep the stored value then
+        if changed then
+            redis.call('HSET', KEYS[1], ARGV[i], cmsgpack.pack(base))
+        end
+    end
+end
+return (#ARGV - 1) / 2
+"""
+
+# KEYS[1]: the expire index key of the tagging, KEYS[2]: the metadata timeline,
+# KEYS[3:]: the value key of each item, or only the IncreaseCollection cache of
+# the `hfield` mode
+# ARGV[1]: the tagging, ARGV[2]: the mode that takes away the values,
+# ARGV[3]: the topN of the `zset` mode, ARGV[4:]: the expire index member and
+# the cache field (of the `hfield` mode) pairs of the items to claim
+CLAIM_EXPIRED_SCRIPT = """
+local mode, topN = ARGV[2], tonumber(ARGV[3])
+local function take(key, field)
+    local rv = nil
+    if mode == 'hfield' then
+        rv = redis.call('HGET', key, field)
+        redis.call('HDEL', key, field)
+        return rv
+    elseif mode == 'hash' then
+        rv = redis.call('HGETALL', key)
+    elseif mode == 'zset' then
+        rv = redis.call('ZRANGE', key, topN > 0 and -topN or 0, -1,
+                        'WITHSCORES')
+    elseif mode == 'set' then
+        rv = redis.call('SMEMBERS', key)
+    elseif mode == 'scard' then
+        rv = redis.call('SCARD', key)
+    elseif mode == 'pfcount' then
+        rv = redis.call('PFCOUNT', key)
+    end
+    redis.call('DEL', key)
+    return rv
+end
+
+local items, values = {}, {}
+for i = 4, #ARGV, 2 do
+    -- skip the item that claimed by another consumer in the meantime
+    if redis.call('ZREM', KEYS[1], ARGV[i]) == 1 then
+        local ts = cmsgpack.unpack(ARGV[i])[1]
+        local infos = redis.call('ZRANGEBYSCORE', KEYS[2], ts, ts)
+        if #infos > 0 then
+            local info = cmsgpack.unpack(infos[1])
+            info[ARGV[1]] = nil
+            redis.call('ZREMRANGEBYSCORE', KEYS[2], ts, ts)
+            if next(info) ~= nil then
+                redis.call('ZADD', KEYS[2], ts, cmsgpack.pack(info))
+            end
+        end
+        items[#items + 1] = ARGV[i]
+        if mode == 'hfield' then
+            values[#items] = take(KEYS[3], ARGV[i + 1])
+        elseif mode ~= 'none' then
+            values[#items] = take(KEYS[2 + (i - 2) / 2])
+        end
+    end
+end
+return {items, values}
+"""
+
+# KEYS: the UniqueCountCollection cache keys, ARGV[1]: the number to pop
+UNIQ_POP_SCRIPT = """
+local rv = {}
+for i, key in ipairs(KEYS) do
+    local members = redis.call('SRANDMEMBER', key, ARGV[1])
+    for j = 1, #members, 1000 do
+        redis.call('SREM', key, unpack(members, j, math.min(j + 999, #members)))
+    end
+    rv[i] = members
+end
+return rv
+"""
+
+# KEYS[1]: the metadata timeline, KEYS[2]: the expire index key of the tagging,
+# KEYS[3]: the taggings index
+# ARGV[1]: ts, ARGV[2]: tagging, ARGV[3]: the packed tagging info,
+# ARGV[4]: the expired timestamp, ARGV[5]: the expire index member
+METADATA_UPSERT_SCRIPT = """
+if redis.call('ZSCORE', KEYS[2], ARGV[5]) then
+    return 0
+end
+local info = {}
+local infos = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1])
+if #infos > 0 then
+    info = cmsgpack.unpack(infos[1])
+    if info[ARGV[2]] ~= nil then
+        return 0
+    end
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1])
+end
+info[ARGV[2]] = cmsgpack.unpack(ARGV[3])
+redis.call('ZADD', KEYS[1], ARGV[1], cmsgpack.pack(info))
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[5])
+redis.call('SADD', KEYS[3], ARGV[2])
+return 1
+"""
 
 
 class RedisBackend:
 
     colls_index_fmt = 'plumbca:' + dfconf['mark_version'] + ':collections:index'
+    colls_params_fmt = 'plumbca:' + dfconf['mark_version'] + ':collections:params'
     metadata_fmt = 'plumbca:' + dfconf['mark_version'] + ':metadata:timeline:{name}'
     inc_coll_cache_fmt = 'plumbca:' + dfconf['mark_version'] + ':cache:{name}'
     sorted_count_coll_cache_fmt = 'plumbca:' + dfconf['mark_version'] + \
@@ -55,6 +224,19 @@ class RedisBackend:
             return {name.decode("utf-8"): unpackb(info)
                         for name, info in rv.items()}
 
+    def set_collection_params(self, name, params):
+        """ Set the arguments that construct the collection instance.
+        """
+        key = self.colls_params_fmt
+        self.rdb.hset(key, name, packb(params))
+
+    def get_collection_params(self, name):
+        """ Get the arguments that construct the collection instance.
+        """
+        key = self.colls_params_fmt
+        rv = self.rdb.hget(key, name)
+        return unpackb(rv) if rv else None
+
     def delete_collection_keys(self, coll, klass=''):
         """ Danger! This method will erasing all values store in the key that
         should be only use it when you really known what are you doing.
@@ -355,20 +537,258 @@ class RedisBackend:
         return keys
 
 
+def _is_noscript(reply):
+    return isinstance(reply, aiords.ReplyError) and \
+        str(reply).startswith('NOSCRIPT')
+
+
+def _timed(name, func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            stats.backend_method(name, time.monotonic() - start)
+    return wrapper
+
+
+def _instrumented(cls):
+    """Record the latency of the public coroutine methods of the backend
+    class in the stats.
+    """
+    for name, func in list(vars(cls).items()):
+        if name.startswith('_') or name == 'init_connection' or \
+                not asyncio.iscoroutinefunction(func):
+            continue
+        setattr(cls, name, _timed(name, func))
+    return cls
+
+
+class RedisPool:
+    """A pool of exclusive aioredis connections.
+
+    The commands are called on the pool as on a single connection, each of
+    them acquires a free connection for its own round trip, so the concurrent
+    requests overlap their backend I/O instead of queueing on one socket. The
+    `multi_exec` and `pipeline` batches record the commands and send them on
+    one connection when executing. The connection closed by a socket error
+    is replaced by a new one when it is acquired again.
+    """
+
+    def __init__(self, address, db, size):
+        self.address = address
+        self.db = db
+        self.size = size
+        self._conns = []
+        self._free = None
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.reconnects = 0
+
+    async def connect(self):
+        self._free = asyncio.Queue()
+        for _ in range(self.size):
+            conn = await aiords.create_redis(self.address, db=self.db)
+            self._conns.append(conn)
+            self._free.put_nowait(conn)
+
+    async def _reconnect(self, conn):
+        try:
+            new = await aiords.create_redis(self.address, db=self.db)
+        except Exception:
+            # keep the pool size, the next acquire retries the connection
+            self._free.put_nowait(conn)
+            raise
+        self._conns[self._conns.index(conn)] = new
+        self.reconnects += 1
+        errlog.warning('Replaced the closed redis connection of the pool.')
+        return new
+
+    def close(self):
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+
+    async def acquire(self):
+        start = time.monotonic()
+        conn = await self._free.get()
+        elapsed = time.monotonic() - start
+        self.waits += 1
+        self.wait_time += elapsed
+        self.max_wait_time = max(self.max_wait_time, elapsed)
+        if conn.closed:
+            conn = await self._reconnect(conn)
+        return conn
+
+    def release(self, conn):
+        self._free.put_nowait(conn)
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'free': self._free.qsize() if self._free else 0,
+            'waits': self.waits,
+            'wait_time': self.wait_time,
+            'max_wait_time': self.max_wait_time,
+            'reconnects': self.reconnects,
+        }
+
+    def multi_exec(self):
+        return _PooledBatch(self, 'multi_exec')
+
+    def pipeline(self):
+        return _PooledBatch(self, 'pipeline')
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        async def command(*args, **kwargs):
+            conn = await self.acquire()
+            start = time.monotonic()
+            try:
+                return await getattr(conn, name)(*args, **kwargs)
+            finally:
+                stats.backend_call(time.monotonic() - start)
+                self.release(conn)
+        return command
+
+
+class _PooledBatch:
+
+    def __init__(self, pool, kind):
+        self._pool = pool
+        self._kind = kind
+        self._calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+        return record
+
+    async def execute(self, return_exceptions=False):
+        conn = await self._pool.acquire()
+        start = time.monotonic()
+        try:
+            batch = getattr(conn, self._kind)()
+            for name, args, kwargs in self._calls:
+                getattr(batch, name)(*args, **kwargs)
+            return await batch.execute(return_exceptions=return_exceptions)
+        finally:
+            stats.backend_call(time.monotonic() - start)
+            self._pool.release(conn)
+
+
+@_instrumented
 class AioRedisBackend(RedisBackend):
     """Redis Backend logic that constructed by asyncio-redis.
     """
 
-    def __init__(self, poolsize=10, loop=None):
+    inc_coll_hash_fmt = 'plumbca:' + dfconf['mark_version'] + \
+                        ':inc:hash:{name}:{field}'
+    expire_index_fmt = 'plumbca:' + dfconf['mark_version'] + \
+                       ':metadata:expire:{name}:{tagging}'
+    taggings_index_fmt = 'plumbca:' + dfconf['mark_version'] + \
+                         ':metadata:taggings:{name}'
+    unique_count_hll_fmt = 'plumbca:' + dfconf['mark_version'] + \
+                           ':unique:count:hll:{name}:{tagging}:{ts}'
+    tmp_key_fmt = 'plumbca:' + dfconf['mark_version'] + ':tmp:{name}:{uid}'
+
+    scripts = {
+        'inc_hash_update': INC_HASH_UPDATE_SCRIPT,
+        'inc_blob_update': INC_BLOB_UPDATE_SCRIPT,
+        'claim_expired': CLAIM_EXPIRED_SCRIPT,
+        'uniq_pop': UNIQ_POP_SCRIPT,
+        'metadata_upsert': METADATA_UPSERT_SCRIPT,
+    }
+
+    def __init__(self, poolsize=None, read_poolsize=None, loop=None):
         self.version = dfconf['mark_version']
         self._loop = loop if loop else asyncio.get_event_loop()
-        self.poolsize = poolsize
+        self.poolsize = int(poolsize or rdconf['poolsize'])
+        self.read_poolsize = int(read_poolsize or rdconf['read_poolsize'])
+        self.chunksize = int(rdconf['pipeline_chunksize'])
+        self.rdb = self.rdb_read = None
+        self._script_shas = {}
 
     async def init_connection(self):
-        self.rdb = await aiords.create_redis(
-            (rdconf['host'], rdconf['port']),
-            db=int(rdconf['db'])
-        )
+        # the writes and the reads use the separate pools, so that the slow
+        # reads never hold the connections that the stores are waiting for
+        self.close_connection()
+
+        address = (rdconf['host'], rdconf['port'])
+        self.rdb = RedisPool(address, int(rdconf['db']), self.poolsize)
+        self.rdb_read = RedisPool(address, int(rdconf['db']),
+                                  self.read_poolsize)
+        await self.rdb.connect()
+        await self.rdb_read.connect()
+
+        for name, script in self.scripts.items():
+            self._script_shas[name] = await self.rdb.script_load(script)
+
+    def close_connection(self):
+        for pool in (self.rdb, self.rdb_read):
+            if pool:
+                pool.close()
+        self.rdb = self.rdb_read = None
+
+    async def _run_script(self, name, calls, atomic=False):
+        """Run the lua script once for each of the `(keys, args)` calls in
+        one pipeline. The scripts are gone after the redis server restarts
+        or SCRIPT FLUSH, so the script is loaded again and the calls that
+        failed with NOSCRIPT are retried.
+
+        :param atomic: run the calls in one MULTI/EXEC, so they are applied
+                       all or none. The script is loaded in the transaction,
+                       and the error of a call is returned in place of its
+                       result since the others are applied already.
+        :ret: the list of the script results in the order of the calls
+        """
+        if not calls:
+            return []
+
+        if atomic:
+            tr = self.rdb.multi_exec()
+            tr.script_load(self.scripts[name])
+            for keys, args in calls:
+                tr.evalsha(self._script_shas[name], keys=keys, args=args)
+            return (await tr.execute(return_exceptions=True))[1:]
+
+        rv = [None] * len(calls)
+        pending = list(range(len(calls)))
+        for retry in (False, True):
+            if retry:
+                self._script_shas[name] = await self.rdb.script_load(
+                    self.scripts[name])
+            pipe = self.rdb.pipeline()
+            for i in pending:
+                keys, args = calls[i]
+                pipe.evalsha(self._script_shas[name], keys=keys, args=args)
+            results = await pipe.execute(return_exceptions=True)
+            for i, r in zip(pending, results):
+                rv[i] = r
+            pending = [i for i in pending if _is_noscript(rv[i])]
+            if not pending:
+                break
+
+        for r in rv:
+            if isinstance(r, Exception):
+                raise r
+        return rv
+
+    def pool_stats(self):
+        """ The statistics of the connection pools, include the times and
+        seconds that the commands waited for a free connection.
+        """
+        return {
+            'write': self.rdb.stats(),
+            'read': self.rdb_read.stats(),
+        }
 
     async def set_collection_index(self, name, instance):
         """ Set the collection info of instance to the backend.
@@ -381,17 +801,30 @@ class AioRedisBackend(RedisBackend):
         """ Get the collection info from backend by name.
         """
         key = self.colls_index_fmt
-        rv = await self.rdb.hget(key, name)
+        rv = await self.rdb_read.hget(key, name)
         return [name, decode(rv)] if rv else None
 
     async def get_collection_indexes(self):
         """ Get all of the collections info from backend.
         """
         key = self.colls_index_fmt
-        rv = await self.rdb.hgetall(key)
+        rv = await self.rdb_read.hgetall(key)
         if rv:
             return {decode(name): decode(info) for name, info in rv.items()}
 
+    async def set_collection_params(self, name, params):
+        """ Set the arguments that construct the collection instance.
+        """
+        key = self.colls_params_fmt
+        return await self.rdb.hset(key, name, packb(params))
+
+    async def get_collection_params(self, name):
+        """ Get the arguments that construct the collection instance.
+        """
+        key = self.colls_params_fmt
+        rv = await self.rdb_read.hget(key, name)
+        return unpackb(rv) if rv else None
+
     async def delete_collection_keys(self, coll, klass=''):
         """ Danger! This method will erasing all values store in the key that
         should be only use it when you really known what are you doing.
@@ -401,6 +834,12 @@ class AioRedisBackend(RedisBackend):
         md_key = self.metadata_fmt.format(name=coll.name)
         await self.rdb.delete(md_key)
 
+        taggings_key = self.taggings_index_fmt.format(name=coll.name)
+        taggings = await self.rdb.smembers(taggings_key)
+        await self.rdb.delete(taggings_key, *[
+            self.expire_index_fmt.format(name=coll.name, tagging=decode(t))
+            for t in taggings])
+
         if klass == 'IncreaseCollection':
             cache_key = self.inc_coll_cache_fmt.format(name=coll.name)
             await self.rdb.delete(cache_key)
@@ -411,13 +850,13 @@ class AioRedisBackend(RedisBackend):
 
         rv = []
         md_key = self.metadata_fmt.format(name=coll.name)
-        md_len = await self.rdb.zcard(md_key)
+        md_len = await self.rdb_read.zcard(md_key)
         rv.append(md_len)
         # print('** TL -', self.rdb.zrange(md_key, 0, -1, withscores=True))
 
         if klass == 'IncreaseCollection':
             cache_key = self.inc_coll_cache_fmt.format(name=coll.name)
-            cache_len = await self.rdb.hlen(cache_key)
+            cache_len = await self.rdb_read.hlen(cache_key)
             # notice that the cache_len is the length of all the items in cache_key
             rv.append(cache_len)
 
@@ -428,34 +867,225 @@ class AioRedisBackend(RedisBackend):
         exists. Note that the metadata structure include two types, timeline
         and expire.
 
+        The check and merge are done by a lua script in one round trip, so
+        the stores of different taggings at the same ts never drop each
+        other, and the tagging already registered only costs a ZSCORE.
+
         :param coll: collection class
         :param tagging: specific tagging string
         :param ts: the timestamp of the data
         :param expts: the expired timestamp of the data
         """
+        await self._run_script('metadata_upsert', [
+            self._metadata_upsert_params(coll, tagging, expts, ts, args)])
+
+    async def mset_collection_metadata(self, coll, entries):
+        """ Batch version of the `set_collection_metadata`, the upserts of
+        all the entries are sent by one pipelined round trip.
+
+        :param coll: collection class
+        :param entries: list of `(tagging, expts, ts, *args)` tuples
+        """
+        if not entries:
+            return
+
+        await self._run_script('metadata_upsert', [
+            self._metadata_upsert_params(coll, tagging, expts, ts, args)
+            for tagging, expts, ts, *args in entries])
+
+    def _metadata_upsert_params(self, coll, tagging, expts, ts, args=()):
+        keys = [
+            self.metadata_fmt.format(name=coll.name),
+            self.expire_index_fmt.format(name=coll.name, tagging=tagging),
+            self.taggings_index_fmt.format(name=coll.name),
+        ]
+        argv = [ts, tagging, packb([expts] + list(args)), expts,
+                self._expire_index_member(ts, args)]
+        return keys, argv
+
+    def _expire_index_member(self, ts, args):
+        return packb([int(ts)] + list(args))
+
+    def _add_expire_index(self, tr, name, tagging, expts, ts, args=()):
+        """Add the commands that index the metadata item by expire time to
+        the transaction.
+        """
+        key = self.expire_index_fmt.format(name=name, tagging=tagging)
+        tr.zadd(key, expts, self._expire_index_member(ts, args))
+        tr.sadd(self.taggings_index_fmt.format(name=name), tagging)
+
+    async def rebuild_collection_expire_index(self, coll):
+        """Build the expire index for the whole metadata timeline, that make
+        the metadata written before the index existing can be fetched.
+        """
         md_key = self.metadata_fmt.format(name=coll.name)
-        # Ensure the item of the specific `ts` whether it's exists or not,
-        element = await self.rdb.zrangebyscore(md_key, ts, ts)
+        elements = await self.rdb.zrange(md_key, 0, -1, withscores=True)
+        if not elements:
+            return
 
-        if element:
-            info = unpackb(element[0])
-            if tagging in info:
-                # the tagging info already exists then do nothings
-                return
-            info[tagging] = [expts] + list(args)
-            # remove the md_key and update new value atomically
-            tr = self.rdb.multi_exec()
-            tr.zremrangebyscore(md_key, ts, ts)
-            tr.zadd(md_key, ts, packb(info))
-            await tr.execute()
+        tr = self.rdb.multi_exec()
+        for i in range(0, len(elements), 2):
+            info, ts = unpackb(elements[i]), elements[i+1]
+            for tagging, tinfo in info.items():
+                self._add_expire_index(tr, coll.name, tagging, tinfo[0], ts,
+                                       tinfo[1:])
+        await tr.execute()
 
-        else:
-            info = {tagging: [expts] + list(args)}
-            await self.rdb.zadd(md_key, ts, packb(info))
-        # print('-'*10)
-        # print(tagging)
-        # print(self.rdb.zrange(md_key, 0, -1, withscores=True))
-        # print('+'*10)
+    async def query_collection_expired(self, coll, tagging, sentinel):
+        """ Query the expired items by the expire index, only the items that
+        actually expired are touched.
+
+        :param coll: the collection class use to fetch name
+        :param tagging: the tagging for query, or '__all__' for all taggings
+        :param sentinel: the items expire before the sentinel are expired
+
+        :ret: return {} if no items expired. Normal structure is:
+                  # tagging: expired items sorted by timestamp
+                  {
+                      tagging1: [(ts1, args1), (ts2, args2), ...],
+                      ...
+                      taggingN: [(ts1, args1), (ts2, args2), ...],
+                  }
+        """
+        taggings = await self._figure_index_taggings(coll, tagging)
+        if not taggings:
+            return {}
+
+        pipe = self.rdb_read.pipeline()
+        for t in taggings:
+            key = self.expire_index_fmt.format(name=coll.name, tagging=t)
+            pipe.zrangebyscore(key, max=sentinel,
+                               exclude=aiords.Redis.ZSET_EXCLUDE_MAX)
+        return self._figure_expired_items(taggings, await pipe.execute())
+
+    async def claim_collection_expired(self, coll, tagging, sentinel,
+                                       value_type=None, option=None):
+        """ Pop the expired items from the expire index and remove them from
+        the metadata timeline atomically, so that each expired item is claimed
+        by exactly one caller even there are several consumers.
+
+        The values of the claimed items are taken away by the same script
+        when the `value_type` is given, so a concurrent store that registers
+        the same item again never has its value deleted by the claim.
+
+        The expired items are read first and claimed by the batches of
+        `pipeline_chunksize` items, each script call declares the value keys
+        it touches and a long backlog never blocks redis in one call.
+
+        :param value_type: one of `inc_blob`, `inc_hash`, `sorted_count`,
+                           `unique_count` and `unique_hll`
+        :param option: the topN of `sorted_count`, or the count_only of
+                       `unique_count`
+
+        The other parameters and the return value are the same as the
+        `query_collection_expired` method, except that each item is a
+        `(ts, args, value)` triple when the `value_type` is given.
+        """
+        taggings = await self._figure_index_taggings(coll, tagging)
+        if not taggings:
+            return {}
+
+        md_key = self.metadata_fmt.format(name=coll.name)
+        index_keys = [self.expire_index_fmt.format(name=coll.name, tagging=t)
+                      for t in taggings]
+        params = [self._claim_value_params(coll, t, value_type, option)
+                  for t in taggings]
+        members = [[] for _ in taggings]
+        values = [[] for _ in taggings]
+        pending = list(range(len(taggings)))
+        while pending:
+            # the claimed items leave the index, so always read the first ones
+            pipe = self.rdb_read.pipeline()
+            for i in pending:
+                pipe.zrangebyscore(index_keys[i], max=sentinel,
+                                   exclude=aiords.Redis.ZSET_EXCLUDE_MAX,
+                                   offset=0, count=self.chunksize)
+            batches = dict(zip(pending, await pipe.execute()))
+            pending = [i for i in pending if batches[i]]
+
+            calls = []
+            for i in pending:
+                mode, template = params[i]
+                keys, argv = [index_keys[i], md_key], [taggings[i], mode,
+                                                       int(option or 0)]
+                if mode == 'hfield':
+                    keys.append(self.inc_coll_cache_fmt.format(name=coll.name))
+                for member in batches[i]:
+                    ts = str(unpackb(member)[0])
+                    argv += [member, template.replace('{ts}', ts)
+                             if mode == 'hfield' else '']
+                    if mode not in ('none', 'hfield'):
+                        keys.append(template.replace('{ts}', ts))
+                calls.append((keys, argv))
+            for i, (claimed, taken) in zip(
+                    pending, await self._run_script('claim_expired', calls)):
+                members[i] += claimed
+                values[i] += [self._decode_claimed_value(value_type, option, v)
+                              for v in taken]
+            # the batch that not full is the last one
+            pending = [i for i in pending
+                       if len(batches[i]) == self.chunksize]
+
+        if value_type is None:
+            return self._figure_expired_items(taggings, members)
+        return self._figure_expired_items(taggings, members, values)
+
+    def _claim_value_params(self, coll, tagging, value_type, option):
+        """Figure the mode and the key (or field) template with the `{ts}`
+        placeholder that the claim script takes away the values by.
+        """
+        if value_type is None:
+            return 'none', ''
+        elif value_type == 'inc_blob':
+            return 'hfield', coll.gen_key_name('{ts}', tagging)
+        elif value_type == 'inc_hash':
+            return 'hash', self.inc_coll_hash_fmt.format(
+                name=coll.name, field=coll.gen_key_name('{ts}', tagging))
+        elif value_type == 'sorted_count':
+            return 'zset', self.sorted_count_coll_cache_fmt.format(
+                name=coll.name, tagging=tagging, ts='{ts}')
+        elif value_type == 'unique_count':
+            return 'scard' if option else 'set', \
+                self.unique_count_coll_cache_fmt.format(
+                    name=coll.name, tagging=tagging, ts='{ts}')
+        elif value_type == 'unique_hll':
+            return 'pfcount', self.unique_count_hll_fmt.format(
+                name=coll.name, tagging=tagging, ts='{ts}')
+        raise ValueError('Unknown value type: {}'.format(value_type))
+
+    def _decode_claimed_value(self, value_type, option, value):
+        if value_type == 'inc_blob':
+            return unpackb(value) if value else None
+        elif value_type == 'inc_hash':
+            return self._decode_hash(
+                dict(zip(value[::2], value[1::2])) if value else None)
+        elif value_type == 'sorted_count':
+            # know that there is `(member, score) pair`
+            return [(unpackb(value[i]), str2num(value[i+1]))
+                    for i in range(0, len(value), 2)]
+        elif value_type == 'unique_count' and not option:
+            return {unpackb(m) for m in value}
+        return value
+
+    async def _figure_index_taggings(self, coll, tagging):
+        if tagging == '__all__':
+            key = self.taggings_index_fmt.format(name=coll.name)
+            return [decode(t) for t in await self.rdb_read.smembers(key)]
+        return [tagging]
+
+    def _figure_expired_items(self, taggings, results, values=None):
+        rv = {}
+        for i, (t, members) in enumerate(zip(taggings, results)):
+            if not members:
+                continue
+            items = [unpackb(m) for m in members]
+            if values is None:
+                items = ((item[0], item[1:]) for item in items)
+            else:
+                items = ((item[0], item[1:], v)
+                         for item, v in zip(items, values[i]))
+            rv[t] = sorted(items, key=lambda x: x[0])
+        return rv
 
     async def del_collection_metadata_by_items(self, coll, tagging, items):
         """Delete the items of the metadata with the privided timestamp list.
@@ -465,8 +1095,25 @@ class AioRedisBackend(RedisBackend):
 
         :TODO: add unittest case for the method!
         """
+        await self._del_collection_metadata(coll, tagging, items)
+
+    async def del_collection_metadata_by_ts(self, coll, tagging, timestamps):
+        """Delete the tagging of the metadata with the privided timestamp list.
+        """
+        if not timestamps:
+            return
+
         md_key = self.metadata_fmt.format(name=coll.name)
-        await self._del_collection_metadata(md_key, tagging, items)
+        pipe = self.rdb.pipeline()
+        for ts in timestamps:
+            pipe.zrangebyscore(md_key, ts, ts)
+
+        # know that there is `(member, score) pair`
+        elements = []
+        for ts, element in zip(timestamps, await pipe.execute()):
+            if element:
+                elements += [element[0], ts]
+        await self._del_collection_metadata(coll, tagging, elements)
 
     async def del_collection_metadata_by_range(self, coll, tagging, start, end):
         """Delete the items of the metadata with the privided start time and
@@ -478,11 +1125,15 @@ class AioRedisBackend(RedisBackend):
         if not elements:
             return
 
-        await self._del_collection_metadata(md_key, tagging, elements)
+        await self._del_collection_metadata(coll, tagging, elements)
 
-    async def _del_collection_metadata(self, key, tagging, elements):
+    async def _del_collection_metadata(self, coll, tagging, elements):
+        key = self.metadata_fmt.format(name=coll.name)
+        index_key = self.expire_index_fmt.format(name=coll.name,
+                                                 tagging=tagging)
         del_info_todos = []
         del_key_todos = []
+        del_index_todos = []
         # know that there is `(member, score) pair`
         elements = [(elements[i], elements[i+1])
                     for i in range(0, len(elements), 2)]
@@ -493,7 +1144,8 @@ class AioRedisBackend(RedisBackend):
                 info = unpackb(info)
             if tagging not in info:
                 continue
-            info.pop(tagging)
+            tinfo = info.pop(tagging)
+            del_index_todos.append(self._expire_index_member(ts, tinfo[1:]))
             # when info has not element then should remove the ts key,
             # otherwise should update new value to it.
             if info:
@@ -501,17 +1153,17 @@ class AioRedisBackend(RedisBackend):
             else:
                 del_key_todos.append(ts)
 
-        # doing the operations that update keys one by one atomically
+        if not del_index_todos:
+            return
+
+        # doing the operations that update and remove the keys atomically
+        tr = self.rdb.multi_exec()
         for info, ts in del_info_todos:
-            tr = self.rdb.multi_exec()
             tr.zremrangebyscore(key, ts, ts)
             tr.zadd(key, ts, packb(info))
-            await tr.execute()
-
-        # doing the operations that remove all keys atomically
-        tr = self.rdb.multi_exec()
         for ts in del_key_todos:
             tr.zremrangebyscore(key, ts, ts)
+        tr.zrem(index_key, *del_index_todos)
         await tr.execute()
 
     async def query_collection_metadata(self, coll, tagging, start, end, ret_whold=False):
@@ -522,11 +1174,15 @@ class AioRedisBackend(RedisBackend):
         return await self._query_collection_metadata(coll, start,
                                                      end, '__taggings__')
 
-    async def query_collection_metadata_all(self, coll, start, end):
-        return await self._query_collection_metadata(coll, start,
-                                                     end, '__all__')
+    async def query_collection_metadata_all(self, coll, start, end,
+                                            offset=None, count=None):
+        return await self._query_collection_metadata(coll, start, end,
+                                                     '__all__', False,
+                                                     offset, count)
 
-    async def _query_collection_metadata(self, coll, start, end, tagging='', ret_whold=False):
+    async def _query_collection_metadata(self, coll, start, end, tagging='',
+                                         ret_whold=False, offset=None,
+                                         count=None):
         """ Do the real operations for query metadata from the redis.
 
         :param coll: the collection class use to fetch name
@@ -534,6 +1190,9 @@ class AioRedisBackend(RedisBackend):
         :param end: the end time of the query
         :param tagging: the tagging for query
         :param ret_whold: whether return all the info when specified a tagging
+        :param offset: skip the number of timestamps in the range
+        :param count: return the number of timestamps at most, it must be
+                      specified with the offset
 
         :ret: return None if no data exists.
               If tagging is specified '__taggings__', return value only contain the taggings:
@@ -564,8 +1223,10 @@ class AioRedisBackend(RedisBackend):
                   ]
         """
         md_key = self.metadata_fmt.format(name=coll.name)
-        elements = await self.rdb.zrangebyscore(md_key, start,
-                                                end, withscores=True)
+        elements = await self.rdb_read.zrangebyscore(md_key, start, end,
+                                                     withscores=True,
+                                                     offset=offset,
+                                                     count=count)
         if not elements:
             return
         else:
@@ -606,15 +1267,178 @@ class AioRedisBackend(RedisBackend):
             return []
 
         key = self.inc_coll_cache_fmt.format(name=coll.name)
-        rv = await self.rdb.hmget(key, *fields)
+        rv = await self.rdb_read.hmget(key, *fields)
         # print('inc_coll_caches_get - ', rv)
         # print('inc_coll_caches_get After - ', [unpackb(r) for r in rv if r])
         return [unpackb(r) for r in rv if r]
 
+    async def inc_coll_caches_set(self, coll, mapping):
+        """
+        :param mapping: should be a dict of <field: value> pair
+        """
+        if not mapping:
+            return
+
+        key = self.inc_coll_cache_fmt.format(name=coll.name)
+        pairs = []
+        for field, value in mapping.items():
+            pairs.append(field)
+            pairs.append(packb(value))
+        await self.rdb.hmset(key, *pairs)
+
+    async def inc_coll_caches_update(self, coll, itype, entries, atomic=False):
+        """Update the values of the blob storage items server-side, so the
+        concurrent updates from the worker processes never lose increments.
+        The entries are sent by the chunks of `pipeline_chunksize`.
+
+        :param itype: the increase type of the collection
+        :param entries: list of `(field, value)` pairs, the value should be
+                        a dict of <key: number> pair
+        :param atomic: the same as the `_run_script` method
+        """
+        key = self.inc_coll_cache_fmt.format(name=coll.name)
+        calls = []
+        for chunk in self._chunks(entries):
+            args = [itype]
+            for field, value in chunk:
+                args.append(field)
+                args.append(packb(value))
+            calls.append(([key], args))
+        return await self._run_script('inc_blob_update', calls, atomic)
+
+    async def inc_coll_caches_map(self, coll, fields):
+        """
+        :ret: return {} if no data exists. Normal structure is the dict of
+              <field: value> pair for the fields that exists.
+        """
+        if not fields:
+            return {}
+
+        key = self.inc_coll_cache_fmt.format(name=coll.name)
+        rv = await self.rdb.hmget(key, *fields)
+        return {field: unpackb(r) for field, r in zip(fields, rv) if r}
+
     async def inc_coll_caches_del(self, coll, *fields):
         key = self.inc_coll_cache_fmt.format(name=coll.name)
         return await self.rdb.hdel(key, *fields)
 
+    async def inc_coll_caches_getdel(self, coll, *fields):
+        """Get and delete the fields in one transaction.
+
+        :ret: the same as the `inc_coll_caches_get` method.
+        """
+        if not fields:
+            return []
+
+        key = self.inc_coll_cache_fmt.format(name=coll.name)
+        tr = self.rdb.multi_exec()
+        tr.hmget(key, *fields)
+        tr.hdel(key, *fields)
+        rv, _ = await tr.execute()
+        return [unpackb(r) for r in rv if r]
+
+    async def inc_coll_hashes_update(self, coll, itype, entries, atomic=False):
+        """Update the values of the hash storage items server-side, each item
+        is updated atomically and the entries are sent in one pipeline.
+
+        :param itype: the increase type of the collection
+        :param entries: list of `(field, value)` pairs, the value should be
+                        a dict of <key: number> pair
+        :param atomic: the same as the `_run_script` method
+        """
+        calls = []
+        for field, value in entries:
+            if not value:
+                continue
+            key = self.inc_coll_hash_fmt.format(name=coll.name, field=field)
+            args = [itype]
+            for k, v in value.items():
+                args.append(k)
+                args.append(int(v))
+            calls.append(([key], args))
+        return await self._run_script('inc_hash_update', calls, atomic)
+
+    async def inc_coll_hashes_set(self, coll, mapping):
+        """Overwrite the values of the hash storage items in one transaction.
+
+        :param mapping: should be a dict of <field: value> pair
+        """
+        if not mapping:
+            return
+
+        tr = self.rdb.multi_exec()
+        for field, value in mapping.items():
+            key = self.inc_coll_hash_fmt.format(name=coll.name, field=field)
+            tr.delete(key)
+            if value:
+                pairs = []
+                for k, v in value.items():
+                    pairs.append(k)
+                    pairs.append(int(v))
+                tr.hmset(key, *pairs)
+        await tr.execute()
+
+    async def inc_coll_hashes_getdel(self, coll, *fields):
+        """Get and delete the hash storage items in one transaction.
+
+        :ret: the same as the `inc_coll_hashes_get` method.
+        """
+        if not fields:
+            return []
+
+        tr = self.rdb.multi_exec()
+        keys = [self.inc_coll_hash_fmt.format(name=coll.name, field=field)
+                for field in fields]
+        for key in keys:
+            tr.hgetall(key)
+        tr.delete(*keys)
+        rv = (await tr.execute())[:-1]
+        return [self._decode_hash(r) for r in rv]
+
+    async def inc_coll_hashes_get(self, coll, *fields):
+        """
+        :ret: return [] if no fields given. Normal structure is the values in
+              the order of the fields, None for the missing items:
+                [value1, value2, ..., valueN]
+        """
+        if not fields:
+            return []
+
+        pipe = self.rdb_read.pipeline()
+        for field in fields:
+            pipe.hgetall(self.inc_coll_hash_fmt.format(name=coll.name,
+                                                       field=field))
+        rv = await pipe.execute()
+        return [self._decode_hash(r) for r in rv]
+
+    def _decode_hash(self, r):
+        # the item that stored an empty dict never has the hash
+        return {decode(k): str2num(v) for k, v in r.items()} if r else None
+
+    async def inc_coll_hashes_map(self, coll, fields):
+        """
+        :ret: return {} if no data exists. Normal structure is the dict of
+              <field: value> pair for the fields that exists.
+        """
+        if not fields:
+            return {}
+
+        pipe = self.rdb_read.pipeline()
+        for field in fields:
+            pipe.hgetall(self.inc_coll_hash_fmt.format(name=coll.name,
+                                                       field=field))
+        rv = await pipe.execute()
+        return {field: {decode(k): str2num(v) for k, v in r.items()}
+                for field, r in zip(fields, rv) if r}
+
+    async def inc_coll_hashes_del(self, coll, *fields):
+        if not fields:
+            return 0
+
+        keys = [self.inc_coll_hash_fmt.format(name=coll.name, field=field)
+                for field in fields]
+        return await self.rdb.delete(*keys)
+
     async def uniq_count_coll_cache_set(self, coll, ts, tagging, values):
         """
         :param values: should be a iterable object contain members
@@ -624,18 +1448,76 @@ class AioRedisBackend(RedisBackend):
         key = key_fmt.format(name=coll.name, tagging=tagging, ts=ts)
         return await self.rdb.sadd(key, *values)
 
-    async def uniq_count_coll_cache_get(self, coll, tagging, timestamps, count_only=False):
+    async def uniq_count_coll_caches_set(self, coll, entries):
+        """Pipelined version of the `uniq_count_coll_cache_set`.
+
+        :param entries: list of `(ts, tagging, values)` tuples
+        """
         key_fmt = self.unique_count_coll_cache_fmt
-        rv = []
-        for ts in timestamps:
+        pipe = self.rdb.pipeline()
+        for ts, tagging, values in entries:
+            if not values:
+                continue
             key = key_fmt.format(name=coll.name, tagging=tagging, ts=ts)
+            pipe.sadd(key, *{packb(v) for v in values})
+        return await pipe.execute()
+
+    async def uniq_count_coll_cache_get(self, coll, tagging, timestamps, count_only=False):
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_count', timestamps)
+        rv = []
+        for chunk in self._chunks(keys):
+            pipe = self.rdb_read.pipeline()
+            for key in chunk:
+                if count_only:
+                    pipe.scard(key)
+                else:
+                    pipe.smembers(key)
+            rv += await pipe.execute()
+
+        if count_only:
+            return rv
+        return [{unpackb(m) for m in members} for members in rv]
+
+    async def uniq_count_coll_cache_getdel(self, coll, tagging, timestamps,
+                                           count_only=False):
+        """Get all the members, or the counts when `count_only` is True, and
+        delete the caches in one transaction.
+        """
+        if not timestamps:
+            return []
+
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_count', timestamps)
+        tr = self.rdb.multi_exec()
+        for key in keys:
             if count_only:
-                count = await self.rdb.scard(key)
-                rv.append(count)
+                tr.scard(key)
             else:
-                members = await self.rdb.smembers(key)
-                rv.append({unpackb(m) for m in members})
-        return rv
+                tr.smembers(key)
+        tr.delete(*keys)
+        rv = (await tr.execute())[:-1]
+        if count_only:
+            return rv
+        return [{unpackb(m) for m in members} for members in rv]
+
+    async def uniq_count_coll_cache_union_count(self, coll, tagging,
+                                                timestamps):
+        """Count the union of the members of all the items server-side, by
+        SUNIONSTORE into a temporary key in one transaction.
+        """
+        if not timestamps:
+            return 0
+
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_count', timestamps)
+        tmp_key = self.tmp_key_fmt.format(name=coll.name,
+                                          uid=uuid.uuid4().hex)
+        tr = self.rdb.multi_exec()
+        tr.sunionstore(tmp_key, *keys)
+        tr.delete(tmp_key)
+        count, _ = await tr.execute()
+        return count
 
     async def uniq_count_coll_cache_pop(self, coll, tagging, timestamps, number):
         """
@@ -643,23 +1525,103 @@ class AioRedisBackend(RedisBackend):
                available in a later version and is not available
                in 2.6, 2.8, 3.0.
                Now use SRANDMEMBER and SREM commands to mimic the effect of
-               SPOP count.
+               SPOP count, a lua script runs them for a chunk of timestamps
+               in one round trip.
         """
-        key_fmt = self.unique_count_coll_cache_fmt
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_count', timestamps)
         rv = []
-        for ts in timestamps:
-            key = key_fmt.format(name=coll.name, tagging=tagging, ts=ts)
-            # :: srandmember + srem == spop(key, number)
-            members = await self.rdb.srandmember(key, number)
-            await self.rdb.srem(key, *members)
-            rv.append({unpackb(m) for m in members})
-        return rv
+        for chunk in self._chunks(keys):
+            rv += (await self._run_script('uniq_pop', [(chunk, [number])]))[0]
+        return [{unpackb(m) for m in members} for members in rv]
 
     async def uniq_count_coll_cache_del(self, coll, tagging, timestamps):
         keys = self._gen_count_keys(coll.name, tagging,
                                     'unique_count', timestamps)
         return await self.rdb.delete(*keys)
 
+    async def uniq_count_coll_hlls_add(self, coll, entries):
+        """Add the members to the HyperLogLog of each item, the memory of an
+        item is fixed whatever how many members are added.
+
+        :param entries: list of `(ts, tagging, values)` tuples
+        """
+        pipe = self.rdb.pipeline()
+        for ts, tagging, values in entries:
+            if not values:
+                continue
+            key = self.unique_count_hll_fmt.format(name=coll.name,
+                                                   tagging=tagging, ts=ts)
+            pipe.pfadd(key, *{packb(v) for v in values})
+        return await pipe.execute()
+
+    async def uniq_count_coll_hll_count(self, coll, tagging, timestamps,
+                                        merge=False):
+        """Count the approximate cardinalities of the items.
+
+        :param merge: count the union of all the items by the server-side
+                      merged PFCOUNT instead of each of them
+        :ret: list of counts, or one count when `merge` is True
+        """
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_hll', timestamps)
+        if merge:
+            return await self.rdb_read.pfcount(*keys) if keys else 0
+
+        rv = []
+        for chunk in self._chunks(keys):
+            pipe = self.rdb_read.pipeline()
+            for key in chunk:
+                pipe.pfcount(key)
+            rv += await pipe.execute()
+        return rv
+
+    async def uniq_count_coll_hll_getdel(self, coll, tagging, timestamps):
+        """Count and delete the HyperLogLogs in one transaction.
+        """
+        if not timestamps:
+            return []
+
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_hll', timestamps)
+        tr = self.rdb.multi_exec()
+        for key in keys:
+            tr.pfcount(key)
+        tr.delete(*keys)
+        return (await tr.execute())[:-1]
+
+    async def uniq_count_coll_hll_dump(self, coll, tagging, timestamps):
+        """Get the serialized HyperLogLogs of the items, None for the missing
+        items.
+        """
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_hll', timestamps)
+        rv = []
+        for chunk in self._chunks(keys):
+            pipe = self.rdb_read.pipeline()
+            for key in chunk:
+                pipe.get(key)
+            rv += await pipe.execute()
+        return rv
+
+    async def uniq_count_coll_hll_restore(self, coll, entries):
+        """Restore the HyperLogLogs that serialized by the
+        `uniq_count_coll_hll_dump` method.
+
+        :param entries: list of `(ts, tagging, value)` tuples
+        """
+        pipe = self.rdb.pipeline()
+        for ts, tagging, value in entries:
+            key = self.unique_count_hll_fmt.format(name=coll.name,
+                                                   tagging=tagging, ts=ts)
+            pipe.set(key, value)
+        return await pipe.execute()
+
+    async def uniq_count_coll_hll_del(self, coll, tagging, timestamps):
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_hll', timestamps)
+        return await self.rdb.delete(*keys)
+
     async def sorted_count_coll_cache_set(self, coll, ts, tagging, values):
         """
         :param values: should be a dict of <member: score> pair
@@ -672,31 +1634,122 @@ class AioRedisBackend(RedisBackend):
             add_val.append(packb(member))
         return await self.rdb.zadd(key, *add_val)
 
-    async def sorted_count_coll_cache_get(self, coll, tagging, timestamps, topN=None):
+    async def sorted_count_coll_caches_set(self, coll, entries,
+                                           accumulate=False):
+        """Pipelined version of the `sorted_count_coll_cache_set`.
+
+        :param entries: list of `(ts, tagging, values)` tuples
+        :param accumulate: add the scores to the members by ZINCRBY instead
+                           of overwriting them
+        """
         key_fmt = self.sorted_count_coll_cache_fmt
-        rv = []
-        for ts in timestamps:
+        pipe = self.rdb.pipeline()
+        for ts, tagging, values in entries:
+            if not values:
+                continue
             key = key_fmt.format(name=coll.name, tagging=tagging, ts=ts)
+            if accumulate:
+                for member, score in values.items():
+                    pipe.zincrby(key, score, packb(member))
+                continue
+            add_val = []
+            for member, score in values.items():
+                add_val.append(score)
+                add_val.append(packb(member))
+            pipe.zadd(key, *add_val)
+        return await pipe.execute()
+
+    async def sorted_count_coll_cache_get(self, coll, tagging, timestamps, topN=None):
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'sorted_count', timestamps)
+        rv = []
+        for chunk in self._chunks(keys):
+            pipe = self.rdb_read.pipeline()
+            for key in chunk:
+                if topN:
+                    pipe.zrange(key, -topN, -1, withscores=True)
+                else:
+                    pipe.zrange(key, 0, -1, withscores=True)
+            for elements in await pipe.execute():
+                # know that there is `(member, score) pair`
+                rv.append([(unpackb(elements[i]), elements[i+1])
+                           for i in range(0, len(elements), 2)])
+        return rv
+
+    async def sorted_count_coll_cache_getdel(self, coll, tagging, timestamps,
+                                             topN=None):
+        """Get the members and delete the caches in one transaction.
+        """
+        if not timestamps:
+            return []
+
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'sorted_count', timestamps)
+        tr = self.rdb.multi_exec()
+        for key in keys:
             if topN:
-                elements = await self.rdb.zrange(key, -topN, -1, withscores=True)
+                tr.zrange(key, -topN, -1, withscores=True)
             else:
-                elements = await self.rdb.zrange(key, 0, -1, withscores=True)
+                tr.zrange(key, 0, -1, withscores=True)
+        tr.delete(*keys)
+        rv = []
+        for elements in (await tr.execute())[:-1]:
             # know that there is `(member, score) pair`
-            elements = [(unpackb(elements[i]), elements[i+1])
-                        for i in range(0, len(elements), 2)]
-            rv.append(elements)
-        # import pprint
-        # pprint.pprint(rv)
+            rv.append([(unpackb(elements[i]), elements[i+1])
+                       for i in range(0, len(elements), 2)])
         return rv
 
+    async def sorted_count_coll_cache_union(self, coll, tagging, timestamps,
+                                            topN=None, weights=None):
+        """Merge the items server-side by ZUNIONSTORE into a temporary key,
+        and get the topN members of the union in one transaction.
+
+        :param weights: the dict of `<ts: weight>` pairs that multiplies the
+                        scores of the items, 1 for the missing ts
+        :ret: list of the `(member, score)` pairs in ascending order
+        """
+        if not timestamps:
+            return []
+
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'sorted_count', timestamps)
+        tmp_key = self.tmp_key_fmt.format(name=coll.name,
+                                          uid=uuid.uuid4().hex)
+        tr = self.rdb.multi_exec()
+        if weights:
+            tr.zunionstore(tmp_key, *[(key, weights.get(ts, 1)) for key, ts
+                                      in zip(keys, timestamps)],
+                           with_weights=True)
+        else:
+            tr.zunionstore(tmp_key, *keys)
+        if topN:
+            tr.zrange(tmp_key, -topN, -1, withscores=True)
+        else:
+            tr.zrange(tmp_key, 0, -1, withscores=True)
+        tr.delete(tmp_key)
+        _, elements, _ = await tr.execute()
+        # know that there is `(member, score) pair`
+        return [(unpackb(elements[i]), elements[i+1])
+                for i in range(0, len(elements), 2)]
+
     async def sorted_count_coll_cache_del(self, coll, tagging, timestamps):
         keys = self._gen_count_keys(coll.name, tagging,
                                     'sorted_count', timestamps)
         return await self.rdb.delete(*keys)
 
+    def _chunks(self, items):
+        """Split the per-timestamp commands into the batches of
+        `pipeline_chunksize`, so that a long range never builds one huge
+        request or reply.
+        """
+        for i in range(0, len(items), self.chunksize):
+            yield items[i:i + self.chunksize]
+
     def _gen_count_keys(self, name, tagging, cachetype, timestamps):
         if cachetype == 'unique_count':
             key_fmt = self.unique_count_coll_cache_fmt
+        elif cachetype == 'unique_hll':
+            key_fmt = self.unique_count_hll_fmt
         elif cachetype == 'sorted_count':
             key_fmt = self.sorted_count_coll_cache_fmt
 
@@ -708,9 +1761,771 @@ class AioRedisBackend(RedisBackend):
         return keys
 
 
+class _SortedSet:
+    """The members sorted by score, a native counterpart of the redis zset
+    which is used by the expire index.
+    """
+
+    def __init__(self):
+        self.scores = {}
+        # the `(score, member)` pairs in ascending order
+        self.items = []
+
+    def __len__(self):
+        return len(self.scores)
+
+    def score(self, member):
+        return self.scores.get(member)
+
+    def add(self, member, score):
+        self.remove(member)
+        self.scores[member] = score
+        insort(self.items, (score, member))
+
+    def remove(self, member):
+        score = self.scores.pop(member, None)
+        if score is None:
+            return False
+        del self.items[find_eq(self.items, (score, member), ret_index=True)]
+        return True
+
+    def range_lt(self, sentinel):
+        """The members that score less than the sentinel."""
+        if not self.items:
+            return []
+        try:
+            i = find_lt(self.items, (sentinel,), ret_index=True)
+        except ValueError:
+            return []
+        return [member for _, member in self.items[:i + 1]]
+
+
+class _Timeline:
+    """The metadata timeline, the `{tagging: info}` dicts sorted by timestamp.
+    """
+
+    def __init__(self):
+        self.tslist = []
+        self.infos = {}
+
+    def __len__(self):
+        return len(self.tslist)
+
+    def get(self, ts):
+        return self.infos.get(ts)
+
+    def set(self, ts, info):
+        if ts not in self.infos:
+            insort(self.tslist, ts)
+        self.infos[ts] = info
+
+    def remove(self, ts):
+        if self.infos.pop(ts, None) is not None:
+            del self.tslist[find_eq(self.tslist, ts, ret_index=True)]
+
+    def range(self, start, end):
+        if not self.tslist:
+            return []
+        try:
+            i = find_ge(self.tslist, float(start), ret_index=True)
+        except ValueError:
+            return []
+        return self.tslist[i:bisect_right(self.tslist, float(end))]
+
+
+class _HyperLogLog:
+    """HyperLogLog with 2**14 registers of the same standard error as the
+    redis one, the memory is fixed whatever how many members are added.
+    """
+
+    p = 14
+    m = 1 << p
+    alpha = 0.7213 / (1 + 1.079 / m)
+
+    def __init__(self, registers=None):
+        self.registers = registers or bytearray(self.m)
+
+    def add(self, member):
+        x = int.from_bytes(sha1(packb(member)).digest()[:8], 'big')
+        index, w = x & (self.m - 1), x >> self.p
+        rank = 64 - self.p - w.bit_length() + 1
+        if rank <= self.registers[index]:
+            return False
+        self.registers[index] = rank
+        return True
+
+    def merge(self, other):
+        return _HyperLogLog(bytearray(map(max, self.registers,
+                                          other.registers)))
+
+    def count(self):
+        estimate = self.alpha * self.m * self.m / \
+            sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # small range correction by the linear counting
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+@_instrumented
+class InMemoryBackend:
+    """Backend logic that keeps all the data in the native structures of the
+    process memory, it has the same interface as the AioRedisBackend.
+
+    The operations never await, so each of them is atomic in the event loop.
+    Notice that the data is not shared between the worker processes.
+    """
+
+    inc_coll_cache_fmt = RedisBackend.inc_coll_cache_fmt
+    sorted_count_coll_cache_fmt = RedisBackend.sorted_count_coll_cache_fmt
+    unique_count_coll_cache_fmt = RedisBackend.unique_count_coll_cache_fmt
+    unique_count_hll_fmt = AioRedisBackend.unique_count_hll_fmt
+
+    hash_opes = {
+        'inc': lambda x, y: x + y,
+        'avg': lambda x, y: (x + y) / 2,
+        'max': max,
+        'min': min,
+    }
+
+    def __init__(self):
+        self.version = dfconf['mark_version']
+        self.flushall()
+
+    def flushall(self):
+        """ Danger! Erase all of the data, it is good for the testing.
+        """
+        self.colls_index = {}
+        self.colls_params = {}
+        # name: _Timeline
+        self.timelines = {}
+        # (name, tagging): _SortedSet of the metadata by expire time
+        self.expire_indexes = {}
+        # name: the set of taggings
+        self.taggings_indexes = {}
+        # name: {field: value}
+        self.inc_caches = {}
+        # (name, field): {key: number}
+        self.inc_hashes = {}
+        # key: the set of members, _HyperLogLog or {member: score} dict
+        self.uniq_caches = {}
+        self.uniq_hlls = {}
+        self.sorted_caches = {}
+
+    async def init_connection(self):
+        pass
+
+    def close_connection(self):
+        pass
+
+    def pool_stats(self):
+        return {}
+
+    async def set_collection_index(self, name, instance):
+        """ Set the collection info of instance to the backend.
+        """
+        rv = 0 if name in self.colls_index else 1
+        self.colls_index[name] = instance.__class__.__name__
+        return rv
+
+    async def get_collection_index(self, name):
+        """ Get the collection info from backend by name.
+        """
+        rv = self.colls_index.get(name)
+        return [name, rv] if rv else None
+
+    async def get_collection_indexes(self):
+        """ Get all of the collections info from backend.
+        """
+        if self.colls_index:
+            return dict(self.colls_index)
+
+    async def set_collection_params(self, name, params):
+        """ Set the arguments that construct the collection instance.
+        """
+        self.colls_params[name] = packb(params)
+
+    async def get_collection_params(self, name):
+        """ Get the arguments that construct the collection instance.
+        """
+        rv = self.colls_params.get(name)
+        return unpackb(rv) if rv else None
+
+    async def delete_collection_keys(self, coll, klass=''):
+        """ Danger! This method will erasing all values store in the key that
+        should be only use it when you really known what are you doing.
+
+        It is good for the testing to clean up the environment.
+        """
+        self.timelines.pop(coll.name, None)
+        for tagging in self.taggings_indexes.pop(coll.name, ()):
+            self.expire_indexes.pop((coll.name, tagging), None)
+
+        if klass == 'IncreaseCollection':
+            self.inc_caches.pop(coll.name, None)
+
+    async def get_collection_length(self, coll, klass=''):
+        if not klass:
+            klass = coll.__class__.__name__
+
+        rv = [len(self.timelines.get(coll.name, ()))]
+        if klass == 'IncreaseCollection':
+            rv.append(len(self.inc_caches.get(coll.name, ())))
+        return rv
+
+    async def set_collection_metadata(self, coll, tagging, expts, ts, *args):
+        """ Insert data to the metadata structure if timestamp data do not
+        exists. Note that the metadata structure include two types, timeline
+        and expire.
+        """
+        self._upsert_metadata(coll.name, tagging, expts, ts, args)
+
+    async def mset_collection_metadata(self, coll, entries):
+        """ Batch version of the `set_collection_metadata`.
+
+        :param entries: list of `(tagging, expts, ts, *args)` tuples
+        """
+        for tagging, expts, ts, *args in entries:
+            self._upsert_metadata(coll.name, tagging, expts, ts, args)
+
+    def _upsert_metadata(self, name, tagging, expts, ts, args=()):
+        member = self._expire_index_member(ts, args)
+        index = self.expire_indexes.get((name, tagging))
+        if index is not None and index.score(member) is not None:
+            return
+
+        timeline = self.timelines.setdefault(name, _Timeline())
+        info = timeline.get(ts) or {}
+        if tagging in info:
+            # the tagging info already exists then do nothings
+            return
+        info[tagging] = [expts] + list(args)
+        timeline.set(ts, info)
+        self._add_expire_index(name, tagging, expts, member)
+
+    def _expire_index_member(self, ts, args):
+        return packb([int(ts)] + list(args))
+
+    def _add_expire_index(self, name, tagging, expts, member):
+        self.expire_indexes.setdefault((name, tagging), _SortedSet()) \
+            .add(member, expts)
+        self.taggings_indexes.setdefault(name, set()).add(tagging)
+
+    async def rebuild_collection_expire_index(self, coll):
+        """Build the expire index for the whole metadata timeline.
+        """
+        timeline = self.timelines.get(coll.name)
+        if not timeline:
+            return
+
+        for ts in timeline.tslist:
+            for tagging, tinfo in timeline.get(ts).items():
+                self._add_expire_index(
+                    coll.name, tagging, tinfo[0],
+                    self._expire_index_member(ts, tinfo[1:]))
+
+    async def query_collection_expired(self, coll, tagging, sentinel):
+        """ Query the expired items by the expire index, the parameters and
+        return value are the same as the AioRedisBackend.
+        """
+        rv = {}
+        for t in self._figure_index_taggings(coll, tagging):
+            index = self.expire_indexes.get((coll.name, t))
+            if index:
+                rv[t] = index.range_lt(sentinel)
+        return self._figure_expired_items(rv)
+
+    async def claim_collection_expired(self, coll, tagging, sentinel,
+                                       value_type=None, option=None):
+        """ Pop the expired items from the expire index and remove them from
+        the metadata timeline, and take away the values of them when the
+        `value_type` is given. The parameters and return value are the same
+        as the AioRedisBackend.
+        """
+        timeline = self.timelines.get(coll.name)
+        rv = {}
+        for t in self._figure_index_taggings(coll, tagging):
+            index = self.expire_indexes.get((coll.name, t))
+            if not index:
+                continue
+            rv[t] = index.range_lt(sentinel)
+            for member in rv[t]:
+                index.remove(member)
+                self._remove_metadata_tagging(timeline, unpackb(member)[0], t)
+
+        rv = self._figure_expired_items(rv)
+        if value_type is not None:
+            for t, items in rv.items():
+                rv[t] = [(ts, args, self._take_value(coll, t, ts, value_type,
+                                                     option))
+                         for ts, args in items]
+        return rv
+
+    def _take_value(self, coll, tagging, ts, value_type, option):
+        if value_type == 'inc_blob':
+            return self.inc_caches.get(coll.name, {}).pop(
+                coll.gen_key_name(ts, tagging), None)
+        elif value_type == 'inc_hash':
+            return self.inc_hashes.pop(
+                (coll.name, coll.gen_key_name(ts, tagging)), None)
+
+        key = self._gen_count_keys(coll.name, tagging, value_type, [ts])[0]
+        if value_type == 'sorted_count':
+            return self._sorted_members(self.sorted_caches.pop(key, {}),
+                                        option)
+        elif value_type == 'unique_count':
+            members = self.uniq_caches.pop(key, set())
+            return len(members) if option else members
+        elif value_type == 'unique_hll':
+            hll = self.uniq_hlls.pop(key, None)
+            return hll.count() if hll else 0
+        raise ValueError('Unknown value type: {}'.format(value_type))
+
+    def _figure_index_taggings(self, coll, tagging):
+        if tagging == '__all__':
+            return list(self.taggings_indexes.get(coll.name, ()))
+        return [tagging]
+
+    def _figure_expired_items(self, members):
+        rv = {}
+        for t, items in members.items():
+            if not items:
+                continue
+            items = [unpackb(m) for m in items]
+            rv[t] = sorted(((item[0], item[1:]) for item in items),
+                           key=lambda x: x[0])
+        return rv
+
+    def _remove_metadata_tagging(self, timeline, ts, tagging):
+        info = timeline.get(ts) if timeline else None
+        if not info or tagging not in info:
+            return
+        tinfo = info.pop(tagging)
+        if not info:
+            timeline.remove(ts)
+        return tinfo
+
+    async def del_collection_metadata_by_items(self, coll, tagging, items):
+        """Delete the items of the metadata with the privided timestamp list.
+
+        :param items: the items query from metadata, structure should be equal
+                      to the format of the metadata query that specified tagging.
+        """
+        # know that there is `(member, score) pair`
+        self._del_collection_metadata(coll, tagging, items[1::2])
+
+    async def del_collection_metadata_by_ts(self, coll, tagging, timestamps):
+        """Delete the tagging of the metadata with the privided timestamp list.
+        """
+        self._del_collection_metadata(coll, tagging, timestamps)
+
+    async def del_collection_metadata_by_range(self, coll, tagging, start, end):
+        """Delete the items of the metadata with the privided start time and
+        end time arguments.
+        """
+        timeline = self.timelines.get(coll.name)
+        if timeline:
+            self._del_collection_metadata(coll, tagging,
+                                          timeline.range(start, end))
+
+    def _del_collection_metadata(self, coll, tagging, timestamps):
+        timeline = self.timelines.get(coll.name)
+        index = self.expire_indexes.get((coll.name, tagging))
+        for ts in timestamps:
+            tinfo = self._remove_metadata_tagging(timeline, ts, tagging)
+            if tinfo is not None and index is not None:
+                index.remove(self._expire_index_member(ts, tinfo[1:]))
+
+    async def query_collection_metadata(self, coll, tagging, start, end, ret_whold=False):
+        return self._query_collection_metadata(coll, start, end,
+                                               tagging, ret_whold)
+
+    async def query_collection_metadata_tagging(self, coll, start, end):
+        return self._query_collection_metadata(coll, start,
+                                               end, '__taggings__')
+
+    async def query_collection_metadata_all(self, coll, start, end,
+                                            offset=None, count=None):
+        return self._query_collection_metadata(coll, start, end, '__all__',
+                                               False, offset, count)
+
+    def _query_collection_metadata(self, coll, start, end, tagging='',
+                                   ret_whold=False, offset=None, count=None):
+        """ Do the real operations for query metadata from the timeline, the
+        return value is the same as the AioRedisBackend.
+        """
+        timeline = self.timelines.get(coll.name)
+        tslist = timeline.range(start, end) if timeline else []
+        if offset is not None:
+            tslist = tslist[offset:offset + count]
+        if not tslist:
+            return
+
+        if tagging == '__taggings__' or tagging == '__all__':
+            rv = {}
+        else:
+            rv = []
+
+        # searching what elements should be match
+        for ts in tslist:
+            info = {t: list(tinfo) for t, tinfo in timeline.get(ts).items()}
+            if tagging == '__taggings__':
+                rv[ts] = list(info.keys())
+            elif tagging == '__all__':
+                rv[ts] = info
+            elif tagging in info:
+                if ret_whold:
+                    rv.append((info, ts))
+                else:
+                    rv.append((info[tagging], ts))
+
+        return rv
+
+    async def inc_coll_cache_set(self, coll, field, value):
+        self.inc_caches.setdefault(coll.name, {})[field] = dict(value)
+
+    async def inc_coll_caches_get(self, coll, *fields):
+        """
+        :ret: return [] if no data exists. Normal structure is:
+                [value1, value2, ..., valueN]
+        """
+        cache = self.inc_caches.get(coll.name, {})
+        return [dict(cache[f]) for f in fields if cache.get(f)]
+
+    async def inc_coll_caches_set(self, coll, mapping):
+        """
+        :param mapping: should be a dict of <field: value> pair
+        """
+        cache = self.inc_caches.setdefault(coll.name, {})
+        for field, value in mapping.items():
+            cache[field] = dict(value)
+
+    async def inc_coll_caches_update(self, coll, itype, entries, atomic=False):
+        """Update the values of the blob storage items, the updates never
+        interleave with the others so the `atomic` option is ignored.
+
+        :param itype: the increase type of the collection
+        :param entries: list of `(field, value)` pairs, the value should be
+                        a dict of <key: number> pair
+        """
+        ifunc = self.hash_opes[itype]
+        cache = self.inc_caches.setdefault(coll.name, {})
+        for field, value in entries:
+            base = cache.get(field)
+            if base is None:
+                cache[field] = dict(value)
+                continue
+            for k, v in value.items():
+                v = int(v)
+                base[k] = ifunc(base[k], v) if k in base else v
+        return [len(value) for _, value in entries]
+
+    async def inc_coll_caches_map(self, coll, fields):
+        """
+        :ret: return {} if no data exists. Normal structure is the dict of
+              <field: value> pair for the fields that exists.
+        """
+        cache = self.inc_caches.get(coll.name, {})
+        return {f: dict(cache[f]) for f in fields if cache.get(f)}
+
+    async def inc_coll_caches_del(self, coll, *fields):
+        cache = self.inc_caches.get(coll.name, {})
+        return len([cache.pop(f) for f in fields if f in cache])
+
+    async def inc_coll_caches_getdel(self, coll, *fields):
+        """Get and delete the fields.
+        """
+        cache = self.inc_caches.get(coll.name, {})
+        rv = [cache.pop(f, None) for f in fields]
+        return [r for r in rv if r]
+
+    async def inc_coll_hashes_update(self, coll, itype, entries, atomic=False):
+        """Update the values of the hash storage items, the updates never
+        interleave with the others so the `atomic` option is ignored.
+
+        :param itype: the increase type of the collection
+        :param entries: list of `(field, value)` pairs, the value should be
+                        a dict of <key: number> pair
+        """
+        ifunc = self.hash_opes[itype]
+        rv = []
+        for field, value in entries:
+            if not value:
+                continue
+            h = self.inc_hashes.setdefault((coll.name, field), {})
+            for k, v in value.items():
+                v = int(v)
+                h[k] = ifunc(h[k], v) if k in h else v
+            rv.append(len(value))
+        return rv
+
+    async def inc_coll_hashes_set(self, coll, mapping):
+        """Overwrite the values of the hash storage items.
+
+        :param mapping: should be a dict of <field: value> pair
+        """
+        for field, value in mapping.items():
+            if value:
+                self.inc_hashes[coll.name, field] = {k: int(v) for k, v
+                                                     in value.items()}
+            else:
+                self.inc_hashes.pop((coll.name, field), None)
+
+    async def inc_coll_hashes_getdel(self, coll, *fields):
+        """Get and delete the hash storage items.
+        """
+        return [self.inc_hashes.pop((coll.name, f), None) for f in fields]
+
+    async def inc_coll_hashes_get(self, coll, *fields):
+        """
+        :ret: return [] if no fields given. Normal structure is the values in
+              the order of the fields, None for the missing items:
+                [value1, value2, ..., valueN]
+        """
+        rv = [self.inc_hashes.get((coll.name, f)) for f in fields]
+        return [dict(r) if r else None for r in rv]
+
+    async def inc_coll_hashes_map(self, coll, fields):
+        """
+        :ret: return {} if no data exists. Normal structure is the dict of
+              <field: value> pair for the fields that exists.
+        """
+        rv = {f: self.inc_hashes.get((coll.name, f)) for f in fields}
+        return {f: dict(r) for f, r in rv.items() if r}
+
+    async def inc_coll_hashes_del(self, coll, *fields):
+        rv = [self.inc_hashes.pop((coll.name, f), None) for f in fields]
+        return len([r for r in rv if r is not None])
+
+    async def uniq_count_coll_cache_set(self, coll, ts, tagging, values):
+        """
+        :param values: should be a iterable object contain members
+        """
+        key = self.unique_count_coll_cache_fmt.format(name=coll.name,
+                                                      tagging=tagging, ts=ts)
+        members = self.uniq_caches.setdefault(key, set())
+        size = len(members)
+        members.update(values)
+        return len(members) - size
+
+    async def uniq_count_coll_caches_set(self, coll, entries):
+        """Batch version of the `uniq_count_coll_cache_set`.
+
+        :param entries: list of `(ts, tagging, values)` tuples
+        """
+        return [await self.uniq_count_coll_cache_set(coll, ts, tagging, values)
+                for ts, tagging, values in entries if values]
+
+    async def uniq_count_coll_cache_get(self, coll, tagging, timestamps, count_only=False):
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_count', timestamps)
+        rv = [self.uniq_caches.get(key, set()) for key in keys]
+        if count_only:
+            return [len(members) for members in rv]
+        return [set(members) for members in rv]
+
+    async def uniq_count_coll_cache_getdel(self, coll, tagging, timestamps,
+                                           count_only=False):
+        """Get all the members, or the counts when `count_only` is True, and
+        delete the caches.
+        """
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_count', timestamps)
+        rv = [self.uniq_caches.pop(key, set()) for key in keys]
+        if count_only:
+            return [len(members) for members in rv]
+        return rv
+
+    async def uniq_count_coll_cache_union_count(self, coll, tagging,
+                                                timestamps):
+        """Count the union of the members of all the items.
+        """
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_count', timestamps)
+        return len(set().union(*[self.uniq_caches.get(key, ())
+                                 for key in keys]))
+
+    async def uniq_count_coll_cache_pop(self, coll, tagging, timestamps, number):
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_count', timestamps)
+        rv = []
+        for key in keys:
+            members = self.uniq_caches.get(key, set())
+            popped = set(random.sample(list(members), min(number, len(members))))
+            members -= popped
+            rv.append(popped)
+        return rv
+
+    async def uniq_count_coll_cache_del(self, coll, tagging, timestamps):
+        return self._del_count_keys(self.uniq_caches, coll.name, tagging,
+                                    'unique_count', timestamps)
+
+    async def uniq_count_coll_hlls_add(self, coll, entries):
+        """Add the members to the HyperLogLog of each item.
+
+        :param entries: list of `(ts, tagging, values)` tuples
+        """
+        rv = []
+        for ts, tagging, values in entries:
+            if not values:
+                continue
+            key = self.unique_count_hll_fmt.format(name=coll.name,
+                                                   tagging=tagging, ts=ts)
+            hll = self.uniq_hlls.setdefault(key, _HyperLogLog())
+            rv.append(int(any([hll.add(v) for v in values])))
+        return rv
+
+    async def uniq_count_coll_hll_count(self, coll, tagging, timestamps,
+                                        merge=False):
+        """Count the approximate cardinalities of the items.
+
+        :param merge: count the union of all the items instead of each of them
+        :ret: list of counts, or one count when `merge` is True
+        """
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_hll', timestamps)
+        hlls = [self.uniq_hlls.get(key) for key in keys]
+        if merge:
+            hlls = [hll for hll in hlls if hll]
+            return reduce(_HyperLogLog.merge, hlls).count() if hlls else 0
+        return [hll.count() if hll else 0 for hll in hlls]
+
+    async def uniq_count_coll_hll_getdel(self, coll, tagging, timestamps):
+        """Count and delete the HyperLogLogs.
+        """
+        rv = await self.uniq_count_coll_hll_count(coll, tagging, timestamps)
+        await self.uniq_count_coll_hll_del(coll, tagging, timestamps)
+        return rv
+
+    async def uniq_count_coll_hll_dump(self, coll, tagging, timestamps):
+        """Get the serialized HyperLogLogs of the items, None for the missing
+        items.
+        """
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'unique_hll', timestamps)
+        hlls = [self.uniq_hlls.get(key) for key in keys]
+        return [bytes(hll.registers) if hll else None for hll in hlls]
+
+    async def uniq_count_coll_hll_restore(self, coll, entries):
+        """Restore the HyperLogLogs that serialized by the
+        `uniq_count_coll_hll_dump` method.
+
+        :param entries: list of `(ts, tagging, value)` tuples
+        """
+        for ts, tagging, value in entries:
+            key = self.unique_count_hll_fmt.format(name=coll.name,
+                                                   tagging=tagging, ts=ts)
+            self.uniq_hlls[key] = _HyperLogLog(bytearray(value))
+
+    async def uniq_count_coll_hll_del(self, coll, tagging, timestamps):
+        return self._del_count_keys(self.uniq_hlls, coll.name, tagging,
+                                    'unique_hll', timestamps)
+
+    async def sorted_count_coll_cache_set(self, coll, ts, tagging, values):
+        """
+        :param values: should be a dict of <member: score> pair
+        """
+        key = self.sorted_count_coll_cache_fmt.format(name=coll.name,
+                                                      tagging=tagging, ts=ts)
+        scores = self.sorted_caches.setdefault(key, {})
+        size = len(scores)
+        scores.update(values)
+        return len(scores) - size
+
+    async def sorted_count_coll_caches_set(self, coll, entries,
+                                           accumulate=False):
+        """Batch version of the `sorted_count_coll_cache_set`.
+
+        :param entries: list of `(ts, tagging, values)` tuples
+        :param accumulate: add the scores to the members instead of
+                           overwriting them
+        """
+        rv = []
+        for ts, tagging, values in entries:
+            if not values:
+                continue
+            if not accumulate:
+                rv.append(await self.sorted_count_coll_cache_set(
+                    coll, ts, tagging, values))
+                continue
+            key = self.sorted_count_coll_cache_fmt.format(
+                name=coll.name, tagging=tagging, ts=ts)
+            scores = self.sorted_caches.setdefault(key, {})
+            for member, score in values.items():
+                scores[member] = scores.get(member, 0) + score
+                rv.append(scores[member])
+        return rv
+
+    async def sorted_count_coll_cache_get(self, coll, tagging, timestamps, topN=None):
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'sorted_count', timestamps)
+        return [self._sorted_members(self.sorted_caches.get(key, {}), topN)
+                for key in keys]
+
+    async def sorted_count_coll_cache_getdel(self, coll, tagging, timestamps,
+                                             topN=None):
+        """Get the members and delete the caches.
+        """
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'sorted_count', timestamps)
+        return [self._sorted_members(self.sorted_caches.pop(key, {}), topN)
+                for key in keys]
+
+    async def sorted_count_coll_cache_union(self, coll, tagging, timestamps,
+                                            topN=None, weights=None):
+        """Merge the items and get the topN members of the union.
+
+        :param weights: the dict of `<ts: weight>` pairs that multiplies the
+                        scores of the items, 1 for the missing ts
+        :ret: list of the `(member, score)` pairs in ascending order
+        """
+        if not timestamps:
+            return []
+
+        keys = self._gen_count_keys(coll.name, tagging,
+                                    'sorted_count', timestamps)
+        weights = weights or {}
+        union = {}
+        for key, ts in zip(keys, timestamps):
+            weight = weights.get(ts, 1)
+            for member, score in self.sorted_caches.get(key, {}).items():
+                union[member] = union.get(member, 0) + score * weight
+        return self._sorted_members(union, topN)
+
+    async def sorted_count_coll_cache_del(self, coll, tagging, timestamps):
+        return self._del_count_keys(self.sorted_caches, coll.name, tagging,
+                                    'sorted_count', timestamps)
+
+    def _sorted_members(self, scores, topN=None):
+        """The `(member, score)` pairs in ascending order, as the ZRANGE of
+        the last topN members.
+        """
+        if topN:
+            rv = heapq.nlargest(topN, scores.items(), key=itemgetter(1))
+            return rv[::-1]
+        return sorted(scores.items(), key=itemgetter(1))
+
+    def _del_count_keys(self, caches, name, tagging, cachetype, timestamps):
+        keys = self._gen_count_keys(name, tagging, cachetype, timestamps)
+        return len([caches.pop(key) for key in keys if key in caches])
+
+    def _gen_count_keys(self, name, tagging, cachetype, timestamps):
+        if cachetype == 'unique_count':
+            key_fmt = self.unique_count_coll_cache_fmt
+        elif cachetype == 'unique_hll':
+            key_fmt = self.unique_count_hll_fmt
+        elif cachetype == 'sorted_count':
+            key_fmt = self.sorted_count_coll_cache_fmt
+
+        return [key_fmt.format(name=name, tagging=tagging, ts=ts)
+                for ts in timestamps]
+
+
 _backends = {
     'redis': RedisBackend(),
     'aioredis': AioRedisBackend(),
+    'inmemory': InMemoryBackend(),
 }
 
 
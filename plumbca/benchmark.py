@@ -0,0 +1,316 @@
+# -*- coding:utf-8 -*-
+"""
+    plumbca.benchmark
+    ~~~~~~~~~~~~~~~~~
+
+    Implements the end-to-end load generation against a plumbca server that
+    started in a subprocess, it reports the throughput, latency percentiles
+    and the server CPU usage as JSON.
+
+    Notice that this module never imports the plumbca config, the server
+    reads the config generated for the run by the `PLUMBCA_CONFIG`
+    environment variable.
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from bisect import bisect
+from itertools import accumulate
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from .helpers import packb, Unpacker
+
+
+collection_types = ('IncreaseCollection', 'SortedCountCollection',
+                    'UniqueCountCollection')
+
+default_mix = {'store': 80, 'query': 15, 'fetch': 5}
+
+
+def parse_mix(text):
+    """Parse the `store=80/query=15/fetch=5` operation mix."""
+    rv = {}
+    for item in text.split('/'):
+        op, weight = item.split('=')
+        if op not in default_mix:
+            raise ValueError('Unknown operation in the mix: {}'.format(op))
+        rv[op] = int(weight)
+    return rv
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * p / 100), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def write_config(fpath, workdir, port, backend='inmemory', workers=1,
+                 redis_host='127.0.0.1', redis_port='6379',
+                 log_sample_rate='1.0'):
+    """Write the server config of the benchmark run, the dumps and the logs
+    go to the workdir.
+    """
+    options = [
+        ('global', [
+            ('bind', '127.0.0.1'),
+            ('port', port),
+            ('transport', 'tcp'),
+            ('keepalive', 'yes'),
+            ('framing', 'msgpack'),
+            ('workers', workers),
+            ('backend', backend),
+            ('dumpdir', workdir),
+            ('write_log', os.path.join(workdir, 'write-opes.log')),
+            ('activity_log', os.path.join(workdir, 'plumbca.log')),
+            ('errors_log', os.path.join(workdir, 'plumbca_errors.log')),
+            ('write_log_sample_rate', log_sample_rate),
+            ('activity_log_sample_rate', log_sample_rate),
+        ]),
+        ('redis', [
+            ('host', redis_host),
+            ('port', redis_port),
+        ]),
+    ]
+    with open(fpath, 'w') as f:
+        for section, items in options:
+            f.write('[{}]\n'.format(section))
+            for key, value in items:
+                f.write('{}={}\n'.format(key, value))
+
+
+def proc_cpu_seconds(pid):
+    """The user and system CPU seconds of the process and its children, read
+    from /proc. Return None if /proc is not available.
+    """
+    if not os.path.isdir('/proc'):
+        return
+
+    ticks = os.sysconf('SC_CLK_TCK')
+    rv = 0.0
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(name)) as f:
+                # the command name may contain spaces, split after it
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        # fields[1] is ppid, fields[11] and fields[12] are utime and stime
+        if int(name) == pid or int(fields[1]) == pid:
+            rv += (int(fields[11]) + int(fields[12])) / ticks
+    return rv
+
+
+class Client:
+    """A keepalive client speaking the msgpack framing."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.unpacker = Unpacker()
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def call(self, command, *args):
+        self.writer.write(packb([command, {'args': list(args)}]))
+        while True:
+            for resp in self.unpacker:
+                return resp
+            data = await self.reader.read(65536)
+            if not data:
+                raise ConnectionError('The server closed the connection.')
+            self.unpacker.feed(data)
+
+    def close(self):
+        self.writer.close()
+
+
+class Workload:
+    """Generate the store/query/fetch operations of a collection type with
+    the realistic arguments: the timestamps move forward with the time, the
+    taggings and the members are picked from the small sets so that the
+    stores hit the existing items.
+    """
+
+    taggings = ['tag{}'.format(i) for i in range(10)]
+    members = ['member{}'.format(i) for i in range(1000)]
+
+    def __init__(self, ctype, mix, expire=60):
+        self.ctype = ctype
+        self.collection = 'bench-' + ctype
+        self.expire = expire
+        self.ops = list(mix)
+        self.cum_weights = list(accumulate(mix[op] for op in self.ops))
+
+    def value(self):
+        if self.ctype == 'IncreaseCollection':
+            return {'f{}'.format(random.randrange(10)): 1 for _ in range(3)}
+        members = random.sample(self.members, 10)
+        if self.ctype == 'SortedCountCollection':
+            return {m: random.randrange(100) for m in members}
+        return members
+
+    def next_op(self):
+        now = int(time.time())
+        tagging = random.choice(self.taggings)
+        op = self.ops[bisect(self.cum_weights,
+                             random.random() * self.cum_weights[-1])]
+        if op == 'store':
+            args = [now - random.randrange(self.expire), tagging, self.value()]
+        elif op == 'query':
+            args = [now - self.expire, now, tagging]
+        else:
+            # delete the items stored before the expire window
+            args = [tagging, True, True, now]
+        return op, [self.collection] + args
+
+
+async def run_clients(host, port, workloads, clients, duration):
+    """Drive the concurrent clients over the workloads for `duration`
+    seconds, return the `{(ctype, op): [latency, ...]}` and the errors.
+    """
+    latencies = {}
+    errors = {}
+
+    setup = await Client.connect(host, port)
+    for w in workloads:
+        await setup.call('ensure_collection', w.collection, w.ctype, w.expire)
+    setup.close()
+
+    async def _client(i):
+        client = await Client.connect(host, port)
+        deadline = time.monotonic() + duration
+        try:
+            while time.monotonic() < deadline:
+                w = workloads[i % len(workloads)]
+                op, args = w.next_op()
+                start = time.monotonic()
+                resp = await client.call(op, *args)
+                key = (w.ctype, op)
+                latencies.setdefault(key, []).append(time.monotonic() - start)
+                if resp['headers']['status'] != 0:
+                    errors[key] = errors.get(key, 0) + 1
+        finally:
+            client.close()
+
+    await asyncio.gather(*[_client(i) for i in range(clients)])
+    return latencies, errors
+
+
+def summarize(latencies, errors, elapsed):
+    rv = {}
+    for (ctype, op), values in sorted(latencies.items()):
+        values.sort()
+        rv.setdefault(ctype, {})[op] = {
+            'ops': len(values),
+            'ops_per_sec': len(values) / elapsed,
+            'errors': errors.get((ctype, op), 0),
+            'p50': percentile(values, 50),
+            'p99': percentile(values, 99),
+            'p999': percentile(values, 99.9),
+        }
+
+    values = sorted(v for vs in latencies.values() for v in vs)
+    rv['total'] = {
+        'ops': len(values),
+        'ops_per_sec': len(values) / elapsed,
+        'errors': sum(errors.values()),
+        'p50': percentile(values, 50),
+        'p99': percentile(values, 99),
+        'p999': percentile(values, 99.9),
+    }
+    return rv
+
+
+def _wait_for_port(port, proc, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('The server exited with status {}.'.format(
+                               proc.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('The server is not listening on {}.'.format(port))
+
+
+def run_benchmark(backend='inmemory', workers=1, clients=50, duration=10,
+                  port=14273, mix=None, ctypes=collection_types,
+                  redis_host='127.0.0.1', redis_port='6379',
+                  log_sample_rate='1.0'):
+    """Start the server with the generated config, drive the workloads and
+    return the results.
+    """
+    mix = mix or default_mix
+    workdir = tempfile.mkdtemp(prefix='plumbca-benchmark-')
+    config = os.path.join(workdir, 'plumbca.conf')
+    write_config(config, workdir, port, backend, workers, redis_host,
+                 redis_port, log_sample_rate)
+
+    env = dict(os.environ, PLUMBCA_CONFIG=config)
+    proc = subprocess.Popen(
+        [sys.executable, '-c',
+         'from plumbca.server import runserver; runserver()'], env=env)
+    try:
+        _wait_for_port(port, proc)
+        cpu_start = proc_cpu_seconds(proc.pid)
+        start = time.monotonic()
+
+        loop = asyncio.get_event_loop()
+        workloads = [Workload(ctype, mix) for ctype in ctypes]
+        latencies, errors = loop.run_until_complete(run_clients(
+            '127.0.0.1', port, workloads, clients, duration))
+
+        elapsed = time.monotonic() - start
+        cpu_end = proc_cpu_seconds(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    server_cpu = None
+    if cpu_start is not None and cpu_end is not None:
+        server_cpu = {
+            'seconds': cpu_end - cpu_start,
+            'percent': (cpu_end - cpu_start) / elapsed * 100,
+        }
+
+    return {
+        'params': {
+            'backend': backend,
+            'workers': workers,
+            'clients': clients,
+            'duration': duration,
+            'mix': mix,
+            'collections': list(ctypes),
+        },
+        'elapsed': elapsed,
+        'results': summarize(latencies, errors, elapsed),
+        'server_cpu': server_cpu,
+    }
+
+
+def dump_results(results, fpath=None):
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if fpath:
+        with open(fpath, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
@@ -15,22 +15,32 @@ import re
 import os
 
 from .config import DefaultConf
-from .collection import IncreaseCollection
+from .collection import (IncreaseCollection, SortedCountCollection,
+                         UniqueCountCollection)
 from .backend import BackendFactory
+from .snapshot import SnapshotReader, list_snapshots, snapshot_path
 
 
 actlog = logging.getLogger('activity')
 err_logger = logging.getLogger('errors')
 
+# ctype: the collection class
+collection_types = {
+    klass.__name__: klass for klass in (IncreaseCollection,
+                                        SortedCountCollection,
+                                        UniqueCountCollection)
+}
+
 
 class CacheCtl(object):
 
     def __init__(self):
         self.collmap = {}
         self.info = {}
+        # the backend connections are opened by the process serving with
+        # them, never at import, so the forked workers open their own
         self.bk = BackendFactory(DefaultConf['backend'])
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.bk.init_connection())
+        self._dump_task = None
 
     def get_collection(self, name):
         if name not in self.collmap:
@@ -39,13 +49,37 @@ class CacheCtl(object):
 
         return self.collmap[name]
 
+    async def lookup_collection(self, name):
+        """Get the collection by name, the collection which ensured by the
+        other worker processes or before restarting will be rebuilt from the
+        parameters stored in the backend.
+        """
+        if name in self.collmap:
+            return self.collmap[name]
+
+        params = await self.bk.get_collection_params(name)
+        if not params:
+            actlog.info("Collection %s not exists.", name)
+            return
+
+        ctype, expire, kwargs = params
+        # it may be rebuilt by other coroutine when waiting for the backend
+        if name not in self.collmap:
+            self.collmap[name] = collection_types[ctype](name, expire=expire,
+                                                         **kwargs)
+            actlog.info("Lookup collection - rebuild it from backend, `%s`.",
+                        self.collmap[name])
+        return self.collmap[name]
+
     async def ensure_collection(self, name, ctype, expire, **kwargs):
         rv = await self.bk.get_collection_index(name)
 
         if name not in self.collmap and not rv:
             actlog.info("Ensure collection - not exists in plumbca and redis")
-            self.collmap[name] = globals()[ctype](name, expire=expire, **kwargs)
+            self.collmap[name] = collection_types[ctype](name, expire=expire,
+                                                         **kwargs)
             await self.bk.set_collection_index(name, self.collmap[name])
+            await self.bk.set_collection_params(name, [ctype, expire, kwargs])
             actlog.info("Ensure collection - not exists in plumbca and redis, "
                         "create it, `%s`.", self.collmap[name])
 
@@ -53,14 +87,19 @@ class CacheCtl(object):
             actlog.info("Ensure collection - not exists in plumbca")
             rv_name, rv_instance_name = rv
             assert name == rv_name
-            assert rv_instance_name == globals()[ctype].__class__.__name__
-            self.collmap[name] = globals()[ctype](name, expire=expire, **kwargs)
+            assert rv_instance_name == collection_types[ctype].__name__
+            self.collmap[name] = collection_types[ctype](name, expire=expire,
+                                                         **kwargs)
+            await self.bk.set_collection_params(name, [ctype, expire, kwargs])
+            # the metadata may be written before the expire index existing
+            await self.bk.rebuild_collection_expire_index(self.collmap[name])
             actlog.info("Ensure collection - not exists in plumbca, "
                         "create it, `%s`.", self.collmap[name])
 
         elif name in self.collmap and not rv:
             actlog.info("Ensure collection - not exists in redis")
             await self.bk.set_collection_index(name, self.collmap[name])
+            await self.bk.set_collection_params(name, [ctype, expire, kwargs])
             actlog.info("Ensure collection - not exists in redis, "
                         "create it, `%s`.", self.collmap[name])
 
@@ -68,6 +107,57 @@ class CacheCtl(object):
             actlog.info("Ensure collection already exists, `%s`.",
                         self.collmap[name])
 
+    async def flush(self):
+        """Flush the write-behind buffers of all the collections."""
+        for coll in list(self.collmap.values()):
+            await coll.flush()
+
+    async def dump(self):
+        """Dump all the collections, including the ones ensured by the other
+        worker processes, to the snapshot files in the dumpdir.
+        """
+        names = set(self.collmap)
+        names.update(await self.bk.get_collection_indexes() or {})
+        for name in sorted(names):
+            coll = await self.lookup_collection(name)
+            if coll is None:
+                continue
+            params = await self.bk.get_collection_params(name)
+            rv = await coll.dump(snapshot_path(name), params)
+            actlog.info("Dump collection `%s`, %d timestamps.", coll, rv)
+
+    def bgdump(self):
+        """Run the dump in the background, return False if a dump is
+        still in progress.
+        """
+        if self._dump_task and not self._dump_task.done():
+            return False
+
+        self._dump_task = asyncio.ensure_future(self.dump())
+        self._dump_task.add_done_callback(self._dump_done)
+        return True
+
+    def _dump_done(self, task):
+        if not task.cancelled() and task.exception():
+            err_logger.error("Background dump failed: %r", task.exception())
+
+    async def load(self):
+        """Ensure and load the collections from the snapshot files in the
+        dumpdir.
+        """
+        for name, fpath in list_snapshots():
+            reader = SnapshotReader(fpath)
+            try:
+                header = await reader.read()
+            finally:
+                reader.close()
+
+            ctype, expire, kwargs = header['params']
+            await self.ensure_collection(name, ctype, expire, **kwargs)
+            await self.collmap[name].load(fpath)
+            actlog.info("Load collection `%s` from %s.", self.collmap[name],
+                        fpath)
+
     def info(self):
         pass
 
@@ -9,12 +9,17 @@
     :license: BSD, see LICENSE for more details.
 """
 
-from itertools import chain
 from threading import Lock
+import asyncio
+import logging
 import time
 
 from .config import DefaultConf
 from .backend import BackendFactory
+from .snapshot import SnapshotReader, SnapshotWriter
+
+
+errlog = logging.getLogger('errors')
 
 
 class Collection(object):
@@ -39,6 +44,19 @@ class Collection(object):
             expire = ts + self._expire
         return ts, expire
 
+    def _check_value(self, value):
+        pass
+
+    def prepare_store(self, ts, tagging, value, abselute_expire=None,
+                       expire_from_now=False):
+        """Check the store arguments and figure the `(ts, tagging, expire,
+        value)` entry for the `mstore` method.
+        """
+        self._check_value(value)
+        ts, expire = self._figure_ts_and_expire(ts, abselute_expire,
+                                                expire_from_now)
+        return ts, tagging, expire, value
+
     def _figure_expired_sentinel(self, d=True, e=True, expired=None):
         if e and expired:
             rv = expired
@@ -63,35 +81,37 @@ class Collection(object):
         # return (ts-list, parameter-list) 2-tuple
         return [ts for ts, _ in rv], (info[1:] for _, info in rv)
 
-    def _figure_fetch_exipired_items(self, mds, sentinel, tagging):
-        """fetch the expired items of specific tagging.
-
-        To get the expire_time and ts values, must be konwn that show below:
-            mds.keys() => timestamps of current handling metadata
-            mds[ts] => the specified tagging info
-            mds[ts][tagging][0] => the specified tagging expire_time
-            mds[ts][tagging][1] => the other tagging parameters
+    async def _fetch(self, tagging, d, e, expired, *args):
+        await self.flush(tagging)
+        sentinel = self._figure_expired_sentinel(d, e, expired)
+        # figure the expired items of the taggings by the expire index, the
+        # deleting fetch claims them and takes away their values atomically,
+        # so that the parallel consumers never receive the same item twice
+        # and the stores of the same item meanwhile are never lost
+        rv = []
+        if d:
+            expired_items = await self.bk.claim_collection_expired(
+                self, tagging, sentinel, *self._claim_value_type(*args))
+            for t, items in expired_items.items():
+                rv += list(self._format_fetched(t, *zip(*items)))
+            return rv
 
-            item[0][tagging][0] => the specified tagging expire_time
-            item[0][tagging][1:] => the other tagging parameters
-            item[1] => timestamp of current handling metadata
+        expired_items = await self.bk.query_collection_expired(
+            self, tagging, sentinel)
+        for t, items in expired_items.items():
+            tslist = [ts for ts, _ in items]
+            parameters = [params for _, params in items]
+            rv += list(await self._fetch_expired(t, tslist, parameters, *args))
+        return rv
 
-        :param mds: the metadata items query from metadata, structure should be
-                    equal to the format of the metadata query that specified __all__.
+    def _claim_value_type(self, *args):
+        """The `(value_type, option)` of the backend claim that takes away
+        the values of the expired items.
         """
-        # filter the mds of the specifi tagging
-        tagging_mds = [(info, ts) for ts, info in mds.items() if tagging in info]
-
-        # figure and sort the expired items
-        expire_items = [item for item in tagging_mds
-                            if int(item[0][tagging][0]) < sentinel]
-        expire_items = sorted(expire_items, key=lambda x: x[1])
-        parameters = [item[0][tagging][1:] for item in expire_items]
-        tslist = [int(item[1]) for item in expire_items]
+        raise NotImplementedError
 
-        # Notice! - `(member, score) pair`
-        # there is need to build the suitable construction of the expire_items
-        return list(chain(*expire_items)), tslist, parameters
+    def _format_fetched(self, tagging, tslist, parameters, values):
+        return zip(tslist, values, parameters)
 
     def query(self, stime, etime, tagging):
         """Provide query API with time ranges parameter.
@@ -105,9 +125,32 @@ class Collection(object):
         """
         raise NotImplementedError
 
-    def store(self, ts, tagging, value):
+    async def store(self, ts, tagging, value, abselute_expire=None,
+                    expire_from_now=False):
+        entry = self.prepare_store(ts, tagging, value, abselute_expire,
+                                    expire_from_now)
+        await self.mstore([entry])
+
+    async def mstore(self, entries):
+        """Store a batch of entries in one pass, the metadata and the values
+        are written to the backend with pipelined round trips.
+
+        :param entries: list of the `(ts, tagging, expire, value)` entries
+                        that figured by `prepare_store`.
+        """
+        for _, tagging, _, _ in entries:
+            self.taggings.add(tagging)
+        await self.bk.mset_collection_metadata(
+            self, [(tagging, expire, ts) for ts, tagging, expire, _ in entries])
+        await self._mstore_values(entries)
+
+    async def _mstore_values(self, entries):
         raise NotImplementedError
 
+    async def flush(self, tagging='__all__'):
+        """Write the values buffered in the process to the backend."""
+        pass
+
     def fetch(self, tagging='__all__', d=True, e=True, expired=None):
         """Fetch the expired data from the store, there will delete the returned
         items by default.
@@ -134,14 +177,96 @@ class Collection(object):
         """
         raise NotImplementedError
 
-    def dump(self, fpath):
-        raise NotImplementedError
+    async def dump(self, fpath, params=None):
+        """Dump the metadata and the caches of the collection to the msgpack
+        snapshot file. The items are read and written by chunks of
+        `dump_chunksize` timestamps, so the stores continue in the meantime.
 
-    def load(self, fpath):
+        :param params: the arguments that construct the collection, which
+                       are saved in the header for loading.
+        """
+        await self.flush()
+        chunksize = int(DefaultConf['dump_chunksize'])
+        dumped = 0
+
+        writer = SnapshotWriter(fpath)
+        try:
+            await writer.write({
+                'name': self.name,
+                'ctype': self.__class__.__name__,
+                'version': DefaultConf['mark_version'],
+                'backend': DefaultConf['backend'],
+                'params': params,
+            })
+            # page on from the last dumped timestamp instead of the offset, so
+            # the items fetched in the meantime never shift the next chunk
+            start = float('-inf')
+            while True:
+                mds = await self.bk.query_collection_metadata_all(
+                    self, start, float('inf'), 0, chunksize)
+                if not mds:
+                    break
+                chunk = sorted(mds)
+                start = int(chunk[-1]) + 1
+                dumped += len(chunk)
+                items = [(int(ts), tagging) for ts in chunk
+                         for tagging in mds[ts]]
+                values = await self._dump_values(items)
+                await writer.write([
+                    [[int(ts), mds[ts]] for ts in chunk],
+                    [[ts, tagging, value] for (ts, tagging), value
+                     in zip(items, values) if value],
+                ])
+            await writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+        return dumped
+
+    async def load(self, fpath):
+        """Load the metadata and the caches from the snapshot file that
+        written by the `dump` method.
+        """
+        reader = SnapshotReader(fpath)
+        try:
+            header = await reader.read()
+            if not header or header.get('ctype') != self.__class__.__name__:
+                raise ValueError('The snapshot {} is not dumped by {}.'.format(
+                                 fpath, self.__class__.__name__))
+
+            while True:
+                record = await reader.read()
+                if record is None:
+                    break
+                mds, values = record
+                await self.bk.mset_collection_metadata(self, [
+                    (tagging, tinfo[0], ts) + tuple(tinfo[1:])
+                    for ts, info in mds for tagging, tinfo in info.items()
+                ])
+                for ts, info in mds:
+                    self.taggings.update(info)
+                await self._load_values(values)
+        finally:
+            reader.close()
+
+    async def _dump_values(self, items):
+        """Read the values of the `(ts, tagging)` items for dumping."""
         raise NotImplementedError
 
+    async def _load_values(self, values):
+        """Restore the `[ts, tagging, value]` values that dumped, the values
+        overwrite the existing ones so that loading again changes nothing.
+        """
+        await self._mstore_values([(ts, tagging, None, value)
+                                   for ts, tagging, value in values])
+
     def info(self):
-        raise NotImplementedError
+        """Return the parameters of the collection."""
+        return {
+            'name': self.name,
+            'ctype': self.__class__.__name__,
+            'expire': self._expire,
+        }
 
 
 class IncreaseCollection(Collection):
@@ -156,7 +281,10 @@ class IncreaseCollection(Collection):
         'min': lambda x, y: min(x, y),
     }
 
-    def __init__(self, name, itype='inc', expire=3600):
+    storages = ('blob', 'hash')
+
+    def __init__(self, name, itype='inc', expire=3600, write_behind=None,
+                 storage=None):
         super().__init__(name)
         self.caching = {}
         self.taggings = set()
@@ -165,6 +293,27 @@ class IncreaseCollection(Collection):
         self.itype = itype
         self.ifunc = self.opes[itype]
 
+        # `blob` storage packs the value of each item in a field of the
+        # collection hash, and the script unpacks and repacks it on update.
+        # `hash` storage keeps one redis hash per item and updates the fields
+        # in place, so the write cost scales with the fields of the delta.
+        # Both are updated server-side atomically.
+        self.storage = storage or DefaultConf.get('inc_storage', 'blob')
+        if self.storage not in self.storages:
+            raise ValueError('Unknown IncreaseCollection storage: {}'.format(
+                             self.storage))
+
+        # the write-behind buffer merges the increments of the same key in
+        # memory, and flushes them on the interval or the size threshold.
+        if write_behind is None:
+            write_behind = DefaultConf.get('write_behind') == 'yes'
+        self.write_behind = write_behind
+        self.flush_interval = float(DefaultConf.get('write_behind_interval', 1))
+        self.flush_size = int(DefaultConf.get('write_behind_size', 1000))
+        self._pending = {}
+        self._flush_lock = None
+        self._flush_handle = None
+
     def __repl__(self):
         return '<{} - {}> . {}'.format(self.__class__.__name__,
                                        self.name, self.itype)
@@ -172,91 +321,201 @@ class IncreaseCollection(Collection):
     def __str__(self):
         return self.__repl__()
 
+    def info(self):
+        rv = super().info()
+        rv.update(itype=self.itype, storage=self.storage,
+                  write_behind=self.write_behind)
+        return rv
+
     def gen_key_name(self, ts, tagging):
         return '{}:{}'.format(str(ts), tagging)
 
     async def query(self, stime, etime, tagging):
+        await self.flush(tagging)
         rv = await self._figure_range_timestamps(stime, etime, tagging)
         if not rv:
             return []
 
         tslist, parameters = rv
         keys = [self.gen_key_name(ts, tagging) for ts in tslist]
-        return zip(keys,
-                   await self.bk.inc_coll_caches_get(self, *keys),
-                   parameters)
+        return zip(keys, await self._get_values(*keys), parameters)
 
-    async def store(self, ts, tagging, value, abselute_expire=None, expire_from_now=False):
+    def _check_value(self, value):
         if not isinstance(value, dict):
             raise ValueError('The IncreaseCollection only accept Dict type value.')
-        self.taggings.add(tagging)
-        ts, expire = self._figure_ts_and_expire(ts, abselute_expire,
-                                                expire_from_now)
-        keyname = self.gen_key_name(ts, tagging)
-        await self.bk.set_collection_metadata(self, tagging, expire, ts)
-        await self._update_value(keyname, value)
 
-    async def _update_value(self, keyname, inc_value):
-        """Using increase method to handle items between value and
-        self.caching[key].
+    async def mstore(self, entries):
+        if not self.write_behind:
+            return await super().mstore(entries)
+
+        for entry in entries:
+            self.taggings.add(entry[1])
+            self._buffer_entry(list(entry))
+
+        if len(self._pending) >= self.flush_size:
+            # the entries are accepted by the buffer whatever the flushing
+            # result, the failed ones will be retried later.
+            await self._safe_flush()
+        else:
+            self._ensure_flush_timer()
+
+    def _buffer_entry(self, entry):
+        """Merge the `[ts, tagging, expire, value]` entry to the pending one
+        of the same key, the expire of the earlier entry is kept.
+        """
+        key = self.gen_key_name(entry[0], entry[1])
+        pending = self._pending.get(key)
+        if pending:
+            pending[3] = self._update_value(pending[3], entry[3])
+        else:
+            # the later increments are merged into the copy in place
+            entry[3] = dict(entry[3])
+            self._pending[key] = entry
+
+    def _ensure_flush_timer(self):
+        if self._pending and self._flush_handle is None:
+            loop = asyncio.get_event_loop()
+            self._flush_handle = loop.call_later(self.flush_interval,
+                                                 self._timed_flush)
+
+    def _timed_flush(self):
+        self._flush_handle = None
+        asyncio.ensure_future(self._safe_flush())
+
+    async def _safe_flush(self):
+        try:
+            await self.flush()
+        except Exception:
+            errlog.exception('Failed to flush the write-behind buffer of %s',
+                             self)
+            self._ensure_flush_timer()
+
+    async def flush(self, tagging='__all__'):
+        if not self.write_behind:
+            return
+
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        # waiting for the flushing in progress, so that the caller never
+        # misses the increments that taken out of the buffer by it.
+        async with self._flush_lock:
+            if tagging == '__all__':
+                entries = list(self._pending.values())
+                self._pending = {}
+            else:
+                keys = [k for k, e in self._pending.items() if e[1] == tagging]
+                entries = [self._pending.pop(k) for k in keys]
+
+            if not self._pending and self._flush_handle:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            if not entries:
+                return
+
+            try:
+                # the metadata upsert is idempotent, and the values are
+                # written in one transaction, so the retry never applies
+                # the increments twice.
+                await self.bk.mset_collection_metadata(
+                    self, [(tagging, expire, ts)
+                           for ts, tagging, expire, _ in entries])
+                rv = await self._mstore_values(entries, atomic=True)
+            except Exception:
+                # put back the increments in front of the newer ones, they
+                # will be retried by the next flushing.
+                pending, self._pending = self._pending, {}
+                for entry in entries + list(pending.values()):
+                    self._buffer_entry(entry)
+                raise
+
+            # the failed updates are applied with the others or never
+            errors = [r for r in rv if isinstance(r, Exception)]
+            if errors:
+                errlog.error('Dropped %d failed updates of %s while '
+                             'flushing: %r', len(errors), self, errors[0])
+
+    async def _get_values(self, *keys):
+        if self.storage == 'hash':
+            return await self.bk.inc_coll_hashes_get(self, *keys)
+        return await self.bk.inc_coll_caches_get(self, *keys)
+
+    async def _dump_values(self, items):
+        keys = [self.gen_key_name(ts, tagging) for ts, tagging in items]
+        if self.storage == 'hash':
+            values = await self.bk.inc_coll_hashes_map(self, keys)
+        else:
+            values = await self.bk.inc_coll_caches_map(self, keys)
+        return [values.get(key) for key in keys]
+
+    async def _load_values(self, values):
+        mapping = {self.gen_key_name(ts, tagging): value
+                   for ts, tagging, value in values}
+        if self.storage == 'hash':
+            await self.bk.inc_coll_hashes_set(self, mapping)
+        else:
+            await self.bk.inc_coll_caches_set(self, mapping)
+
+    async def _del_values(self, *keys):
+        if self.storage == 'hash':
+            return await self.bk.inc_coll_hashes_del(self, *keys)
+        return await self.bk.inc_coll_caches_del(self, *keys)
+
+    async def _mstore_values(self, entries, atomic=False):
+        # the values are updated server-side, so the concurrent stores of
+        # the worker processes never lose increments
+        values = [(self.gen_key_name(ts, tagging), value)
+                  for ts, tagging, _, value in entries]
+        if self.storage == 'hash':
+            return await self.bk.inc_coll_hashes_update(self, self.itype,
+                                                        values, atomic)
+        return await self.bk.inc_coll_caches_update(self, self.itype,
+                                                    values, atomic)
+
+    def _update_value(self, base, inc_value):
+        """Using increase method to handle items between base value and
+        the increase value.
         """
-        base = await self.bk.inc_coll_caches_get(self, keyname)
-        # print('Store Before `{}` - Origin: {}, Inc: {}'.format(keyname, base,
-        #                                                        inc_value))
+        # print('Store Before - Origin: {}, Inc: {}'.format(base, inc_value))
         if base:
-            base = base[0]
             for k, v in inc_value.items():
                 if k in base:
                     base[k] = self.ifunc(base[k], int(v))
                 else:
                     base[k] = int(v)
         else:
-            base = inc_value
+            base = dict(inc_value)
 
-        # print('Store After `{}` - {}'.format(keyname, base))
-        await self.bk.inc_coll_cache_set(self, keyname, base)
+        # print('Store After - {}'.format(base))
+        return base
 
     async def fetch(self, tagging='__all__', d=True, e=True, expired=None):
-        sentinel = self._figure_expired_sentinel(d, e, expired)
-        # figure whole metadatas for all taggings
-        mds = await self.bk.query_collection_metadata(self, '__all__',
-                                                      0, sentinel)
-        if not mds:
-            return []
+        return await self._fetch(tagging, d, e, expired)
 
-        if tagging == '__all__':
-            rv = []
-            for t in self.taggings:
-                rv += list(await self._fetch_expired(mds, sentinel, t, d))
-            return rv
-        else:
-            return list(await self._fetch_expired(mds, sentinel, tagging, d))
+    def _claim_value_type(self):
+        return 'inc_' + self.storage, None
 
-    async def _fetch_expired(self, mds, sentinel, tagging, d):
-        result = self._figure_fetch_exipired_items(mds, sentinel, tagging)
-        expire_items, tslist, parameters = result
+    def _format_fetched(self, tagging, tslist, parameters, values):
+        keys = [self.gen_key_name(t, tagging) for t in tslist]
+        return zip(keys, values, parameters)
 
+    async def _fetch_expired(self, tagging, tslist, parameters):
         # construct the keys and fetch the values
         keys = [self.gen_key_name(t, tagging) for t in tslist]
-        rv = await self.bk.inc_coll_caches_get(self, *keys)
-
-        # remove all the expired metadata and the cache items
-        if d and rv:
-            await self.bk.del_collection_metadata_by_items(self, tagging,
-                                                           expire_items)
-            await self.bk.inc_coll_caches_del(self, *keys)
-
-        return zip(keys, rv, parameters)
+        return zip(keys, await self._get_values(*keys), parameters)
 
 
 class SortedCountCollection(Collection):
 
-    def __init__(self, name, expire=3600):
+    def __init__(self, name, expire=3600, accumulate=False):
         super().__init__(name)
         self.caching = {}
         self.taggings = set()
         # the expire should be unchangable in the instance live time
         self._expire = int(expire)
+        # the accumulate mode adds the stored scores to the members, so the
+        # producers can store the partial counts of an item.
+        self.accumulate = accumulate
 
     def __repl__(self):
         return '<{} - {}>'.format(self.__class__.__name__, self.name)
@@ -264,63 +523,83 @@ class SortedCountCollection(Collection):
     def __str__(self):
         return self.__repl__()
 
-    async def query(self, stime, etime, tagging, topN=None):
+    def info(self):
+        rv = super().info()
+        rv.update(accumulate=self.accumulate)
+        return rv
+
+    async def query(self, stime, etime, tagging, topN=None, merge=False,
+                    weights=None):
+        """Query the topN members of each item in the range. The `merge`
+        query sums the scores of the range server-side, or weighted by the
+        `<ts: weight>` dict of `weights`, and returns the global topN as a
+        `(first_ts, last_ts, members)` tuple.
+        """
         rv = await self._figure_range_timestamps(stime, etime, tagging)
         if not rv:
             return []
 
         tslist, parameters = rv
+        if merge:
+            if weights:
+                weights = {int(ts): w for ts, w in weights.items()}
+            members = await self.bk.sorted_count_coll_cache_union(
+                self, tagging, tslist, topN, weights)
+            return [(tslist[0], tslist[-1], members)]
+
         return zip(tslist,
                    await self.bk.sorted_count_coll_cache_get(self, tagging, tslist, topN),
                    parameters)
 
-    async def store(self, ts, tagging, value, abselute_expire=None, expire_from_now=False):
+    def _check_value(self, value):
         if not isinstance(value, dict):
-            raise ValueError('The IncreaseCollection only accept Dict type value.')
-
-        self.taggings.add(tagging)
-        ts, expire = self._figure_ts_and_expire(ts, abselute_expire,
-                                                expire_from_now)
-        await self.bk.set_collection_metadata(self, tagging, expire, ts)
-        await self.bk.sorted_count_coll_cache_set(self, ts, tagging, value)
+            raise ValueError('The SortedCountCollection only accept Dict type value.')
+
+    async def _mstore_values(self, entries):
+        await self.bk.sorted_count_coll_caches_set(
+            self, [(ts, tagging, value) for ts, tagging, _, value in entries],
+            accumulate=self.accumulate)
+
+    async def _load_values(self, values):
+        # never accumulate the restored scores to the existing ones
+        await self.bk.sorted_count_coll_caches_set(
+            self, [(ts, tagging, value) for ts, tagging, value in values])
+
+    async def _dump_values(self, items):
+        rv = {}
+        for tagging, tslist in _group_by_tagging(items).items():
+            values = await self.bk.sorted_count_coll_cache_get(self, tagging,
+                                                               tslist)
+            for ts, members in zip(tslist, values):
+                rv[ts, tagging] = dict(members)
+        return [rv.get(item) for item in items]
 
     async def fetch(self, tagging='__all__', d=True, e=True, expired=None, topN=None):
-        sentinel = self._figure_expired_sentinel(d, e, expired)
-        # figure whole metadatas for all taggings
-        mds = await self.bk.query_collection_metadata(self, '__all__',
-                                                      0, sentinel)
-        if not mds:
-            return []
+        return await self._fetch(tagging, d, e, expired, topN)
 
-        if tagging == '__all__':
-            rv = []
-            for t in self.taggings:
-                rv += list(await self._fetch_expired(mds, sentinel, t, d, topN))
-            return rv
-        else:
-            return await self._fetch_expired(mds, sentinel, tagging, d, topN)
+    def _claim_value_type(self, topN):
+        return 'sorted_count', topN
 
-    async def _fetch_expired(self, mds, sentinel, tagging, d, topN):
-        result = self._figure_fetch_exipired_items(mds, sentinel, tagging)
-        expire_items, tslist, parameters = result
+    async def _fetch_expired(self, tagging, tslist, parameters, topN):
         rv = await self.bk.sorted_count_coll_cache_get(self, tagging,
                                                        tslist, topN)
-        if d and rv:
-            await self.bk.del_collection_metadata_by_items(self, tagging,
-                                                           expire_items)
-            await self.bk.sorted_count_coll_cache_del(self, tagging, tslist)
-
         return zip(tslist, rv, parameters)
 
 
 class UniqueCountCollection(Collection):
 
-    def __init__(self, name, expire=3600):
+    # the standard error of the counts in approximate mode
+    std_error = 0.0081
+
+    def __init__(self, name, expire=3600, approximate=False):
         super().__init__(name)
         self.caching = {}
         self.taggings = set()
         # the expire should be unchangable in the instance live time
         self._expire = int(expire)
+        # the approximate mode keeps a fixed-size HyperLogLog per item instead
+        # of the members, and only the counts within `std_error` are returned.
+        self.approximate = approximate
 
     def __repl__(self):
         return '<{} - {}>'.format(self.__class__.__name__, self.name)
@@ -328,46 +607,91 @@ class UniqueCountCollection(Collection):
     def __str__(self):
         return self.__repl__()
 
-    async def query(self, stime, etime, tagging):
+    def info(self):
+        # the clients take the error bound of the approximate counts here
+        rv = super().info()
+        rv.update(approximate=self.approximate,
+                  std_error=self.std_error if self.approximate else 0)
+        return rv
+
+    async def query(self, stime, etime, tagging, merge=False,
+                    count_only=False):
+        """Query the members of the items in the range, or only the counts
+        with `count_only` and in approximate mode. The `merge` query returns
+        the count of the union of the range as a `(first_ts, last_ts, count)`
+        tuple, which is computed server-side.
+        """
         rv = await self._figure_range_timestamps(stime, etime, tagging)
         if not rv:
             return []
 
         tslist, parameters = rv
-        return zip(tslist,
-                   await self.bk.uniq_count_coll_cache_get(self, tagging, tslist),
-                   parameters)
+        if merge:
+            if self.approximate:
+                count = await self.bk.uniq_count_coll_hll_count(
+                    self, tagging, tslist, merge=True)
+            else:
+                count = await self.bk.uniq_count_coll_cache_union_count(
+                    self, tagging, tslist)
+            return [(tslist[0], tslist[-1], count)]
+
+        if self.approximate:
+            values = await self.bk.uniq_count_coll_hll_count(self, tagging,
+                                                             tslist)
+        else:
+            values = await self.bk.uniq_count_coll_cache_get(
+                self, tagging, tslist, count_only=count_only)
+        return zip(tslist, values, parameters)
+
+    async def _mstore_values(self, entries):
+        entries = [(ts, tagging, value) for ts, tagging, _, value in entries]
+        if self.approximate:
+            await self.bk.uniq_count_coll_hlls_add(self, entries)
+        else:
+            await self.bk.uniq_count_coll_caches_set(self, entries)
+
+    async def _dump_values(self, items):
+        rv = {}
+        for tagging, tslist in _group_by_tagging(items).items():
+            if self.approximate:
+                values = await self.bk.uniq_count_coll_hll_dump(self, tagging,
+                                                                tslist)
+            else:
+                values = [list(members) for members in
+                          await self.bk.uniq_count_coll_cache_get(self, tagging,
+                                                                  tslist)]
+            for ts, value in zip(tslist, values):
+                rv[ts, tagging] = value
+        return [rv.get(item) for item in items]
+
+    async def _load_values(self, values):
+        if self.approximate:
+            # the HyperLogLogs are restored as they were dumped
+            await self.bk.uniq_count_coll_hll_restore(self, values)
+        else:
+            await super()._load_values(values)
 
-    async def store(self, ts, tagging, value, abselute_expire=None, expire_from_now=False):
-        self.taggings.add(tagging)
-        ts, expire = self._figure_ts_and_expire(ts, abselute_expire,
-                                                expire_from_now)
-        await self.bk.set_collection_metadata(self, tagging, expire, ts)
-        await self.bk.uniq_count_coll_cache_set(self, ts, tagging, value)
+    async def fetch(self, tagging='__all__', d=True, e=True, expired=None,
+                    count_only=False):
+        return await self._fetch(tagging, d, e, expired, count_only)
 
-    async def fetch(self, tagging='__all__', d=True, e=True, expired=None):
-        sentinel = self._figure_expired_sentinel(d, e, expired)
-        # figure whole metadatas for all taggings
-        mds = await self.bk.query_collection_metadata(self, '__all__', 0, sentinel)
-        if not mds:
-            return []
+    def _claim_value_type(self, count_only):
+        if self.approximate:
+            return 'unique_hll', None
+        return 'unique_count', count_only
 
-        if tagging == '__all__':
-            rv = []
-            for t in self.taggings:
-                rv += list(await self._fetch_expired(mds, sentinel, t, d))
-            return rv
+    async def _fetch_expired(self, tagging, tslist, parameters, count_only):
+        if self.approximate:
+            rv = await self.bk.uniq_count_coll_hll_count(self, tagging, tslist)
         else:
-            return await self._fetch_expired(mds, sentinel, tagging, d)
+            rv = await self.bk.uniq_count_coll_cache_get(
+                self, tagging, tslist, count_only=count_only)
 
-    async def _fetch_expired(self, mds, sentinel, tagging, d):
-        result = self._figure_fetch_exipired_items(mds, sentinel, tagging)
-        expire_items, tslist, parameters = result
-        rv = await self.bk.uniq_count_coll_cache_get(self, tagging, tslist)
+        return zip(tslist, rv, parameters)
 
-        if d and rv:
-            await self.bk.del_collection_metadata_by_items(self, tagging,
-                                                           expire_items)
-            await self.bk.uniq_count_coll_cache_del(self, tagging, tslist)
 
-        return zip(tslist, rv, parameters)
+def _group_by_tagging(items):
+    rv = {}
+    for ts, tagging in items:
+        rv.setdefault(tagging, []).append(ts)
+    return rv
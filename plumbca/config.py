@@ -10,6 +10,7 @@
 """
 
 from configparser import ConfigParser
+import os
 
 from .exceptions import PlumbcaConfigNotFound
 
@@ -22,19 +23,43 @@ defaults = {
         'bind': '127.0.0.1',
         'port': '4273',
         'transport': 'tcp',
+        'keepalive': 'no',
+        'framing': 'line',
         'unixsocket': '',
+        'unixsocketperm': '700',
+        'workers': '1',
+        'metrics_bind': '127.0.0.1',
+        'metrics_port': '',
+        'slowlog_slower_than': '10000',
+        'slowlog_max_len': '128',
         'dumpdir': '/var/lib/plumbca/',
+        'dump_chunksize': '1000',
+        'loaddump': 'no',
+        'dumponexit': 'no',
+        'journal': 'no',
+        'journaldir': '',
+        'journal_commit_interval': '0.01',
+        'journal_segment_size': '67108864',
         'write_log': '/var/log/plumbca/write-opes.log',
         'activity_log': '/var/log/plumbca/plumbca.log',
         'errors_log': '/var/log/plumbca/plumbca_errors.log',
+        'write_log_sample_rate': '1.0',
+        'activity_log_sample_rate': '1.0',
         'mark_version': '1.0',
         'backend': 'aioredis',
+        'inc_storage': 'blob',
+        'write_behind': 'no',
+        'write_behind_interval': '1',
+        'write_behind_size': '1000',
         'test_level': 'debug',
     },
     'redis': {
         'host': '127.0.0.1',
         'port': '',
         'db': '0',
+        'poolsize': '10',
+        'read_poolsize': '10',
+        'pipeline_chunksize': '1000',
     },
 }
 
@@ -58,7 +83,7 @@ class Config(dict):
         self['debug'] = bool(self.get('debug'))
 
 
-CONFIG_PATH = '/etc/plumbca.conf'
+CONFIG_PATH = os.environ.get('PLUMBCA_CONFIG', '/etc/plumbca.conf')
 DefaultConf = Config('global')
 DefaultConf.readFrom(CONFIG_PATH)
 RedisConf = Config('redis')
@@ -9,5 +9,9 @@ class PlumbcaConfigNotFound(Exception):
     "Raised when the plumbca program not found the configure file."
 
 
+class PlumbcaConfigError(Exception):
+    "Raised when the plumbca configure contains invalid options."
+
+
 class MessageFormatError(Exception):
     """hello world."""
@@ -12,11 +12,12 @@
 from bisect import bisect_left
 from functools import partial
 
-from msgpack import packb, unpackb
+from msgpack import packb, unpackb, Unpacker
 
 
 packb = partial(packb)
 unpackb = partial(unpackb, encoding='utf-8')
+Unpacker = partial(Unpacker, encoding='utf-8')
 
 
 def decode(obj, encoding='utf-8'):
@@ -28,8 +29,19 @@ def decode(obj, encoding='utf-8'):
     return obj
 
 
+def str2num(s):
+    """Convert the number string reply by redis to int or float."""
+    s = decode(s)
+    try:
+        return int(s)
+    except ValueError:
+        return float(s)
+
+
 def frame2str(frame):
-    return frame.decode('utf8').lower()
+    if isinstance(frame, bytes):
+        frame = frame.decode('utf8')
+    return frame.lower()
 
 
 def find_eq(a, x, ret_index=False):
@@ -0,0 +1,215 @@
+# -*- coding:utf-8 -*-
+"""
+    plumbca.journal
+    ~~~~~~~~~~~~~~~
+
+    Implements the append-only journal of the mutating commands, and the
+    replaying of it for rebuilding the collections.
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import time
+from operator import itemgetter
+
+from .config import DefaultConf
+from .helpers import packb, Unpacker
+
+
+actlog = logging.getLogger('activity')
+errlog = logging.getLogger('errors')
+
+journal_suffix = '.plumbca.journal'
+
+
+def journal_dir():
+    return DefaultConf['journaldir'] or DefaultConf['dumpdir']
+
+
+def list_segments(dirpath=None):
+    """List the paths of the journal segment files in the journal dir."""
+    dirpath = dirpath or journal_dir()
+    if not os.path.isdir(dirpath):
+        return []
+
+    return [os.path.join(dirpath, fname) for fname in sorted(os.listdir(dirpath))
+            if fname.endswith(journal_suffix)]
+
+
+def read_segment(fpath):
+    """Iterate the records of the journal segment, the torn record at the tail
+    that left by a crash is ignored.
+    """
+    unpacker = Unpacker()
+    with open(fpath, 'rb') as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            unpacker.feed(data)
+            yield from unpacker
+
+
+class Journal:
+    """Append the mutating commands to the journal segment files.
+
+    The records appended in `commit_interval` seconds are written and fsynced
+    in one batch by the executor, and the appending coroutines are waked up
+    together after the batch is durable (group commit). A new segment is
+    started when the current one grows over `segment_size` bytes.
+
+    Each record is a msgpack list of `[time, command, *args]`, the commands
+    are normalized so that the replay is deterministic:
+
+        ['ensure_collection', name, ctype, expire, options]
+        ['mstore', name, [[ts, tagging, expire, value], ...]]
+        ['fetch', name, tagging, expired_sentinel]
+
+    The journal is apply-then-log: a record is appended after its command
+    is applied, so a crash between the two loses the record of a mutation
+    that is stored already. The worker reports a failed append with the
+    `message_journal_failure` status rather than a failure of the command.
+    """
+
+    def __init__(self):
+        self.file = None
+        self.buffer = []
+        self.waiter = None
+
+    @property
+    def enabled(self):
+        return self.file is not None
+
+    def open(self, dirpath=None, commit_interval=None, segment_size=None,
+             loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.dirpath = dirpath or journal_dir()
+        if commit_interval is None:
+            commit_interval = DefaultConf['journal_commit_interval']
+        if segment_size is None:
+            segment_size = DefaultConf['journal_segment_size']
+        self.commit_interval = float(commit_interval)
+        self.segment_size = int(segment_size)
+        self._lock = asyncio.Lock()
+
+        os.makedirs(self.dirpath, exist_ok=True)
+        self._rotate()
+
+    async def close(self):
+        if not self.enabled:
+            return
+
+        await self.commit()
+        self.file.close()
+        self.file = None
+
+    def pack(self, *record):
+        """Pack the record before the command is applied, the applying may
+        merge the values in place. Return None if the journal is disabled.
+        """
+        if self.enabled:
+            return packb([time.time()] + list(record), use_bin_type=True)
+
+    async def append(self, *record):
+        """Append the record and wait until it is durable, return at once if
+        the journal is disabled.
+        """
+        await self.append_packed(self.pack(*record))
+
+    async def append_packed(self, data):
+        """Append the record packed by the `pack` method."""
+        if data is None or not self.enabled:
+            return
+
+        self.buffer.append(data)
+        if self.waiter is None:
+            self.waiter = self.loop.create_future()
+            self.loop.call_later(self.commit_interval, self._schedule_commit)
+        # the waiter is shared by the whole batch, never cancel it
+        await asyncio.shield(self.waiter)
+
+    def _schedule_commit(self):
+        asyncio.ensure_future(self.commit(), loop=self.loop)
+
+    async def commit(self):
+        """Write and fsync the buffered records in one batch."""
+        buffer, waiter = self.buffer, self.waiter
+        self.buffer, self.waiter = [], None
+        if waiter is None:
+            return
+
+        # the batches are written one by one in the appending order
+        async with self._lock:
+            try:
+                await self.loop.run_in_executor(None, self._write,
+                                                b''.join(buffer))
+            except Exception as err:
+                errlog.error('Failed to write the journal: %s', err)
+                waiter.set_exception(err)
+            else:
+                waiter.set_result(len(buffer))
+
+    def _write(self, data):
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if self.file.tell() >= self.segment_size:
+            self._rotate()
+
+    def _rotate(self):
+        if self.file:
+            self.file.close()
+        fname = '{:013d}.{}{}'.format(int(time.time() * 1000), os.getpid(),
+                                      journal_suffix)
+        self.file = open(os.path.join(self.dirpath, fname), 'ab')
+        actlog.info('Journal segment %s started.', fname)
+
+
+async def _replay_ensure_collection(ctl, name, ctype, expire, options):
+    await ctl.ensure_collection(name, ctype, expire, **options)
+
+
+async def _replay_mstore(ctl, name, entries):
+    coll = await ctl.lookup_collection(name)
+    await coll.mstore([tuple(entry) for entry in entries])
+
+
+async def _replay_fetch(ctl, name, tagging, sentinel):
+    coll = await ctl.lookup_collection(name)
+    await coll.fetch(tagging, d=True, e=True, expired=sentinel)
+
+
+_replay_commands = {
+    'ensure_collection': _replay_ensure_collection,
+    'mstore': _replay_mstore,
+    'fetch': _replay_fetch,
+}
+
+
+async def replay(ctl, paths, until=None):
+    """Replay the records of the journal segments in time order, the segments
+    written by several worker processes are merged.
+
+    :param ctl: the CacheCtl that the collections rebuilt in
+    :param until: stop at the records that appended after this time
+    :ret: the number of the replayed records
+    """
+    records = heapq.merge(*[read_segment(path) for path in paths],
+                          key=itemgetter(0))
+    rv = 0
+    for record in records:
+        if until is not None and record[0] > until:
+            break
+        await _replay_commands[record[1]](ctl, *record[2:])
+        rv += 1
+
+    await ctl.flush()
+    return rv
+
+
+journal = Journal()
@@ -9,8 +9,12 @@
     :license: BSD, see LICENSE for more details.
 """
 
+from logging.handlers import QueueHandler, QueueListener
 import logging.config
 import logging
+import atexit
+import random
+import queue
 
 from .config import DefaultConf
 
@@ -80,6 +84,65 @@ LOGGING = {
     }
 }
 
+# the sampling rates of the high-volume loggers
+SAMPLE_RATES = {
+    'write-opes': DefaultConf['write_log_sample_rate'],
+    'activity': DefaultConf['activity_log_sample_rate'],
+}
+
+
+class SamplingFilter(logging.Filter):
+    """Pass the records below WARNING level by the sampling rate, the
+    warnings and errors are always passed.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+# logger name: the handlers configured by LOGGING
+_handlers = {}
+_listeners = []
+
+
+def start_queue_listeners():
+    """Move the handlers of the loggers behind a QueueHandler, so that the
+    records are written by the QueueListener threads instead of the event
+    loop. The forked worker process should call it again for the threads
+    are not inherited.
+    """
+    for listener in _listeners:
+        # the threads started before forking are not alive in the child
+        if listener._thread and listener._thread.is_alive():
+            listener.stop()
+    _listeners.clear()
+
+    for name in LOGGING['loggers']:
+        logger = logging.getLogger(name)
+        handlers = _handlers.setdefault(name, list(logger.handlers))
+        q = queue.Queue()
+        listener = QueueListener(q, *handlers, respect_handler_level=True)
+        logger.handlers = [QueueHandler(q)]
+        listener.start()
+        _listeners.append(listener)
+
+
+def stop_queue_listeners():
+    """Write the queued records and stop the listener threads."""
+    for listener in _listeners:
+        listener.stop()
+    _listeners.clear()
+
+
 logging.config.dictConfig(LOGGING)
+for name, rate in SAMPLE_RATES.items():
+    if float(rate) < 1:
+        logging.getLogger(name).addFilter(SamplingFilter(rate))
+start_queue_listeners()
+atexit.register(stop_queue_listeners)
 # activity_logger = logging.getLogger('activity')
 # errors_logger = logging.getLogger('errors')
@@ -21,13 +21,16 @@ errlog = logging.getLogger('errors')
 
 message_process_success = 0
 message_process_failure = 1
+# the command is applied, but its journal record is not durable
+message_journal_failure = 2
 
 
 class Request(object):
     """Handler objects for client requests messages
 
     Frame Format:
-        'command Message'
+        'command Message'            (line framing)
+        ['command', Message]         (msgpack framing)
 
     Message:
     {
@@ -38,19 +41,51 @@ class Request(object):
         _command, _message = raw_message.strip().split(b' ', 1)
 
         # print(_command, _message)
-        self.command = frame2str(_command)
-        self._message = unpackb(_message)
+        self._parse(_command, unpackb(_message), raw_message)
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Build the request from a `[command, message]` frame which already
+        decoded by the streaming unpacker.
+        """
+        if not isinstance(frame, (list, tuple)) or len(frame) != 2:
+            errlog.error("Invalid request frame : %r", frame)
+            raise MessageFormatError("Invalid request frame : %r" % (frame,))
+
+        req = cls.__new__(cls)
+        req._parse(frame[0], frame[1], frame)
+        return req
+
+    def _parse(self, command, message, raw_message):
+        self.command = frame2str(command)
+        self._message = message
 
         actlog.debug('<Request %s - %s>', self.command, self._message)
+        if not isinstance(self._message, dict):
+            args = None
         # __getitem__ will raise if key not exists
-        if 'args' in self._message:
-            self.args = self._message['args']
+        elif 'args' in self._message:
+            args = self._message['args']
         elif b'args' in self._message:
-            self.args = self._message[b'args']
+            args = self._message[b'args']
         else:
             errlog.exception("Invalid request message : ", raw_message)
             raise MessageFormatError("Invalid request message : %r" % raw_message)
 
+        # the args are unpacked into the command call and summarized by the
+        # slowlog, so they must be a sequence
+        if not isinstance(args, (list, tuple)):
+            errlog.error("Invalid request args : %r", raw_message)
+            raise MessageFormatError("Invalid request args : %r" % (raw_message,))
+        self.args = list(args)
+
+
+def _pack_default(obj):
+    # the members of UniqueCountCollection are returned as the sets
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError('Can not serialize {!r}'.format(obj))
+
 
 class Response(tuple):
     """Handler objects for responses messages
@@ -74,12 +109,12 @@ class Response(tuple):
                 },
                 'datas': kwargs.pop('datas'),
             }
-            actlog.debug('<Response %s - %s> ', response['headers']['status'],
-                         len(response['datas']))
-            errlog.debug('<Response %s - %s> ', response['headers']['status'],
-                         len(response['datas']))
+            if actlog.isEnabledFor(logging.DEBUG):
+                actlog.debug('<Response %s - %s> ',
+                             response['headers']['status'],
+                             len(response['datas']))
             # print('Gen Responses -', response)
-            msg = packb(response)
+            msg = packb(response, default=_pack_default)
         except KeyError:
             errlog.exception("Invalid response message.")
             raise
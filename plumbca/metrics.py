@@ -0,0 +1,185 @@
+# -*- coding:utf-8 -*-
+"""
+    plumbca.metrics
+    ~~~~~~~~~~~~~~~
+
+    Implements the exporter that serves the statistics in the prometheus
+    text format over HTTP.
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+import asyncio
+import logging
+
+from .config import DefaultConf
+from .stats import Histogram, stats
+
+
+actlog = logging.getLogger('activity')
+errlog = logging.getLogger('errors')
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+                     .replace('\n', r'\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v))
+                          for k, v in sorted(labels.items())) + '}'
+
+
+class MetricsWriter:
+    """Write the metric families in the prometheus text format."""
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, mtype, doc):
+        self.lines.append('# HELP {} {}'.format(name, doc))
+        self.lines.append('# TYPE {} {}'.format(name, mtype))
+
+    def sample(self, name, value, **labels):
+        self.lines.append('{}{} {}'.format(name, _labels(labels), value))
+
+    def histogram(self, name, hist, **labels):
+        """Write the cumulative buckets of the Histogram, every other bound
+        is exported so the buckets are 2 times wider.
+        """
+        acc = 0
+        for i, count in enumerate(hist.counts[:-1]):
+            acc += count
+            if i % 2:
+                self.sample(name + '_bucket', acc,
+                            le='{:.6g}'.format(Histogram.bounds[i]), **labels)
+        self.sample(name + '_bucket', hist.count, le='+Inf', **labels)
+        self.sample(name + '_sum', hist.sum, **labels)
+        self.sample(name + '_count', hist.count, **labels)
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+async def render_metrics(ctl):
+    """Render the statistics of the worker process and the sizes of the
+    collections.
+    """
+    w = MetricsWriter()
+
+    w.family('plumbca_command_calls_total', 'counter',
+             'The number of the processed commands.')
+    for name, cmd in sorted(stats.commands.items()):
+        w.sample('plumbca_command_calls_total', cmd.calls, command=name)
+    w.family('plumbca_command_errors_total', 'counter',
+             'The number of the failed commands.')
+    for name, cmd in sorted(stats.commands.items()):
+        w.sample('plumbca_command_errors_total', cmd.errors, command=name)
+    w.family('plumbca_command_backend_round_trips_total', 'counter',
+             'The number of the backend round trips of the commands.')
+    for name, cmd in sorted(stats.commands.items()):
+        w.sample('plumbca_command_backend_round_trips_total',
+                 cmd.round_trips, command=name)
+    w.family('plumbca_command_duration_seconds', 'histogram',
+             'The latency of the commands.')
+    for name, cmd in sorted(stats.commands.items()):
+        w.histogram('plumbca_command_duration_seconds', cmd.latency,
+                    command=name)
+
+    w.family('plumbca_backend_call_duration_seconds', 'histogram',
+             'The latency of the backend methods.')
+    for name, hist in sorted(stats.backend_methods.items()):
+        w.histogram('plumbca_backend_call_duration_seconds', hist,
+                    method=name)
+
+    w.family('plumbca_connections', 'gauge', 'The open client connections.')
+    w.sample('plumbca_connections', stats.connections)
+    w.family('plumbca_connections_total', 'counter',
+             'The accepted client connections.')
+    w.sample('plumbca_connections_total', stats.connections_total)
+    w.family('plumbca_received_bytes_total', 'counter',
+             'The bytes received from the clients.')
+    w.sample('plumbca_received_bytes_total', stats.bytes_in)
+    w.family('plumbca_sent_bytes_total', 'counter',
+             'The bytes sent to the clients.')
+    w.sample('plumbca_sent_bytes_total', stats.bytes_out)
+    w.family('plumbca_event_loop_lag_seconds', 'histogram',
+             'How late the event loop runs the scheduled callbacks.')
+    w.histogram('plumbca_event_loop_lag_seconds', stats.loop_lag)
+
+    names = set(ctl.collmap)
+    names.update(await ctl.bk.get_collection_indexes() or {})
+    sizes = []
+    for name in sorted(names):
+        coll = await ctl.lookup_collection(name)
+        if coll is not None:
+            sizes.append((coll, await ctl.bk.get_collection_length(coll)))
+
+    w.family('plumbca_collection_timestamps', 'gauge',
+             'The number of the timestamps in the collection metadata.')
+    for coll, rv in sizes:
+        w.sample('plumbca_collection_timestamps', rv[0], collection=coll.name,
+                 type=coll.__class__.__name__)
+    w.family('plumbca_collection_cache_items', 'gauge',
+             'The number of the cached items of the IncreaseCollection.')
+    for coll, rv in sizes:
+        if len(rv) > 1:
+            w.sample('plumbca_collection_cache_items', rv[1],
+                     collection=coll.name)
+
+    return w.render()
+
+
+class MetricsServer:
+    """A minimal HTTP listener that serves `GET /metrics` on the event loop
+    of the worker.
+    """
+
+    def __init__(self, ctl):
+        self.ctl = ctl
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # skip the request headers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.split()
+            if len(parts) > 1 and parts[0] == b'GET' and \
+                    parts[1].split(b'?')[0] == b'/metrics':
+                status = '200 OK'
+                body = (await render_metrics(self.ctl)).encode('utf-8')
+            else:
+                status = '404 Not Found'
+                body = b'Not Found\n'
+
+            writer.write('HTTP/1.0 {}\r\nContent-Type: {}\r\n'
+                         'Content-Length: {}\r\n\r\n'.format(
+                             status, content_type, len(body)).encode('ascii'))
+            writer.write(body)
+            await writer.drain()
+        except Exception as err:
+            errlog.error('<Metrics> Failed to serve the metrics: %s', err)
+        finally:
+            writer.close()
+
+
+def start_metrics_server(loop, ctl, port_offset=0):
+    """Start the metrics listener if the `metrics_port` is configured, the
+    worker processes listen on the successive ports.
+    """
+    if not DefaultConf['metrics_port']:
+        return
+
+    port = int(DefaultConf['metrics_port']) + port_offset
+    coro = asyncio.start_server(MetricsServer(ctl).handle,
+                                DefaultConf['metrics_bind'], port, loop=loop)
+    server = loop.run_until_complete(coro)
+    actlog.info('Serving the metrics on %s', server.sockets[0].getsockname())
+    return server
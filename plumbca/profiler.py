@@ -0,0 +1,140 @@
+# -*- coding:utf-8 -*-
+"""
+    plumbca.profiler
+    ~~~~~~~~~~~~~~~~
+
+    Implements the on-demand profiling of the running server.
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from collections import Counter
+import asyncio
+import cProfile
+import logging
+import os
+import signal
+import time
+
+from .config import DefaultConf
+
+
+actlog = logging.getLogger('activity')
+
+
+class Profiler:
+    """Profile the worker process for a time window, nothing is installed
+    until the profiler starts so there is no overhead while it is stopped.
+
+    The `cprofile` mode traces every call by cProfile and writes the pstats
+    file. The `sample` mode samples the stack of the main thread every
+    `sample_interval` seconds of CPU time by SIGPROF, and writes the collapsed
+    stacks that can be rendered by the flamegraph tools. The output is written
+    to the dumpdir and named by the time window and the pid.
+    """
+
+    modes = {
+        'cprofile': 'pstats',
+        'sample': 'collapsed',
+    }
+
+    sample_interval = 0.005
+
+    def __init__(self):
+        self.mode = None
+        self.started = None
+        self._profile = None
+        self._stacks = None
+        self._timer = None
+
+    @property
+    def running(self):
+        return self.mode is not None
+
+    def start(self, seconds, mode='cprofile', loop=None):
+        if self.running:
+            raise RuntimeError('The profiler is already running.')
+        if mode not in self.modes:
+            raise ValueError('Unknown profiler mode: {}'.format(mode))
+
+        self.loop = loop or asyncio.get_event_loop()
+        if mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._stacks = Counter()
+            signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.sample_interval,
+                             self.sample_interval)
+
+        self.mode = mode
+        self.started = time.time()
+        self._timer = self.loop.call_later(float(seconds), self._auto_stop)
+        actlog.info('Profiler started in %s mode for %s seconds.', mode,
+                    seconds)
+
+    def _auto_stop(self):
+        self._timer = None
+        asyncio.ensure_future(self.stop(), loop=self.loop)
+
+    async def stop(self):
+        """Stop the profiler and write the output, return the output path or
+        None if it is not running.
+        """
+        if not self.running:
+            return
+
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        mode, self.mode = self.mode, None
+        if mode == 'cprofile':
+            self._profile.disable()
+            write, data = self._write_pstats, self._profile
+        else:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            # the default action of a pending SIGPROF terminates the process
+            signal.signal(signal.SIGPROF, signal.SIG_IGN)
+            write, data = self._write_collapsed, self._stacks
+        self._profile = self._stacks = None
+
+        fname = 'profile-{}-{}-{}.{}'.format(int(self.started), int(time.time()),
+                                             os.getpid(), self.modes[mode])
+        fpath = os.path.join(DefaultConf['dumpdir'], fname)
+        await self.loop.run_in_executor(None, write, fpath, data)
+        actlog.info('Profiler stopped, the output is written to %s.', fpath)
+        return fpath
+
+    def status(self):
+        return {
+            'running': self.running,
+            'mode': self.mode,
+            'started': self.started if self.running else None,
+            'pid': os.getpid(),
+        }
+
+    def _sample(self, signum, frame):
+        if self._stacks is None:
+            return
+
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(os.path.basename(code.co_filename),
+                                        code.co_name))
+            frame = frame.f_back
+        self._stacks[';'.join(reversed(stack))] += 1
+
+    @staticmethod
+    def _write_pstats(fpath, profile):
+        profile.dump_stats(fpath)
+
+    @staticmethod
+    def _write_collapsed(fpath, stacks):
+        with open(fpath, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+profiler = Profiler()
@@ -13,35 +13,124 @@ import logging
 import struct
 import asyncio
 
-from .message import Request
+from .config import DefaultConf
+from .helpers import Unpacker
+from .message import Request, Response, message_process_failure
 from .worker import Worker
+from .stats import stats
 
 
 actlog = logging.getLogger('activity')
 errlog = logging.getLogger('errors')
 
 
+class LineFrameReader:
+    """Read the `command Message` request frames that delimited by newline.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.broken = False
+
+    async def read_request(self):
+        data = await self.reader.readline()
+        if not data:
+            return
+        stats.bytes_in += len(data)
+        return Request(data)
+
+
+class MsgpackFrameReader:
+    """Read the `['command', Message]` request frames from a msgpack stream.
+
+    The frames are decoded incrementally by a streaming unpacker which is
+    reused over the whole connection, so the payload may contain any bytes and
+    a large frame is parsed as its data arrives without buffering it twice.
+    """
+
+    read_size = 65536
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.unpacker = Unpacker()
+        # once the stream can not be decoded there is no way to find the
+        # beginning of the next frame
+        self.broken = False
+
+    async def read_request(self):
+        while True:
+            try:
+                frame = next(self.unpacker)
+            except StopIteration:
+                data = await self.reader.read(self.read_size)
+                if not data:
+                    return
+                stats.bytes_in += len(data)
+                self.unpacker.feed(data)
+            except Exception:
+                self.broken = True
+                raise
+            else:
+                return Request.from_frame(frame)
+
+
 class PlumbcaCmdProtocol:
 
-    def __init__(self):
+    frame_readers = {
+        'line': LineFrameReader,
+        'msgpack': MsgpackFrameReader,
+    }
+
+    def __init__(self, keepalive=None, framing=None):
         self.handler = Worker()
+        if keepalive is None:
+            keepalive = DefaultConf.get('keepalive') == 'yes'
+        self.keepalive = keepalive
+        self.framing = framing or DefaultConf.get('framing', 'line')
+        if self.framing not in self.frame_readers:
+            raise ValueError('Unknown framing mode: {}'.format(self.framing))
 
     async def plumbca_cmd_handle(self, reader, writer):
         """Simple plumbca command protocol implementation.
 
-        plumbca_cmd_handle handles incoming command request.
+        plumbca_cmd_handle handles incoming command request. Without keepalive
+        the connection is closed after the first response, otherwise it keeps
+        serving requests until the client closes it. A keepalive client can
+        pipeline several requests before reading any response, the responses
+        are written back in the order of the requests, and each of them is a
+        single msgpack object so the client can split them with a streaming
+        unpacker.
         """
-        data = await reader.readline()
-
-        req = Request(data)
         addr = writer.get_extra_info('peername')
-        actlog.info("<Server> Received %r from %r", req.command, addr)
+        frames = self.frame_readers[self.framing](reader)
+        stats.connections += 1
+        stats.connections_total += 1
+        try:
+            await self._serve_connection(addr, frames, writer)
+        finally:
+            stats.connections -= 1
+
+    async def _serve_connection(self, addr, frames, writer):
+        while True:
+            try:
+                req = await frames.read_request()
+            except Exception as err:
+                errlog.error('<Server> Invalid request from %r: %s', addr, err)
+                resp = Response(datas='Invalid request: %s' % err,
+                                status=message_process_failure)
+            else:
+                if req is None:
+                    break
+                actlog.info("<Server> Received %r from %r", req.command, addr)
+                # drive the command process
+                resp = await self.handler.run_command(req)
 
-        # drive the command process
-        resp = await self.handler.run_command(req)
+            writer.write(resp)
+            stats.bytes_out += len(resp)
+            await writer.drain()
 
-        writer.write(resp)
-        await writer.drain()
+            if not self.keepalive or frames.broken:
+                break
 
         # actlog.info("Close the client %r socket", addr)
         writer.close()
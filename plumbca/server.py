@@ -11,21 +11,91 @@
 
 import asyncio
 import logging
+import signal
+import socket
+import stat
+import time
+import os
 
 from .config import DefaultConf
 from .protocol import PlumbcaCmdProtocol
+from .cache import CacheCtl
+from .journal import journal
+from .metrics import start_metrics_server
+from .stats import stats
+from .exceptions import PlumbcaConfigError
+from .log import start_queue_listeners, stop_queue_listeners
 
 
 aclog = logging.getLogger('activity')
 errlog = logging.getLogger('errors')
 
 
-def runserver():
-    loop = asyncio.get_event_loop()
+def _remove_stale_unixsocket(path):
+    """Remove the socket file left by a server which not exit cleanly, refuse
+    to start if the path is in use by a running server or not a socket.
+    """
+    if not os.path.exists(path):
+        return
+
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise PlumbcaConfigError('The unixsocket path {} exists and it is not '
+                                 'a socket file.'.format(path))
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except ConnectionRefusedError:
+        aclog.info('Remove the stale unixsocket %s', path)
+        os.unlink(path)
+    else:
+        raise PlumbcaConfigError('The unixsocket {} is in use by another '
+                                 'server.'.format(path))
+    finally:
+        sock.close()
+
+
+def _bind_unixsocket():
+    path = DefaultConf['unixsocket']
+    if not path:
+        raise PlumbcaConfigError('The unixsocket option must be specified '
+                                 'when transport is unix.')
+    _remove_stale_unixsocket(path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, int(DefaultConf['unixsocketperm'], 8))
+    return sock
+
+
+def _create_server(loop, pcp, sock=None, reuse_port=False):
+    if DefaultConf['transport'] == 'unix':
+        if sock is None:
+            sock = _bind_unixsocket()
+        coro = asyncio.start_unix_server(pcp.plumbca_cmd_handle, sock=sock,
+                                         loop=loop)
+
+    elif DefaultConf['transport'] == 'tcp':
+        coro = asyncio.start_server(pcp.plumbca_cmd_handle, DefaultConf['bind'],
+                                    DefaultConf['port'], loop=loop,
+                                    reuse_port=reuse_port)
+
+    else:
+        raise PlumbcaConfigError('Unknown transport: {}'.format(
+                                 DefaultConf['transport']))
+
+    return loop.run_until_complete(coro)
+
+
+def _serve(loop, sock=None, reuse_port=False, index=0, dump=True):
+    if DefaultConf['journal'] == 'yes':
+        journal.open(loop=loop)
     pcp = PlumbcaCmdProtocol()
-    coro = asyncio.start_server(pcp.plumbca_cmd_handle, DefaultConf['bind'],
-                                DefaultConf['port'], loop=loop)
-    server = loop.run_until_complete(coro)
+    server = _create_server(loop, pcp, sock, reuse_port)
+    stats.monitor_loop_lag(loop)
+    metrics_server = start_metrics_server(loop, CacheCtl, index)
+    # stop gracefully so that the buffered writes are flushed
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
 
     # Serve requests until terminate signal is received
     aclog.info('Serving on %s', server.sockets[0].getsockname())
@@ -37,4 +107,130 @@ def runserver():
     # Close the server
     server.close()
     loop.run_until_complete(server.wait_closed())
+    if metrics_server:
+        metrics_server.close()
+    loop.run_until_complete(CacheCtl.flush())
+    loop.run_until_complete(journal.close())
+    if dump and DefaultConf['dumponexit'] == 'yes':
+        loop.run_until_complete(CacheCtl.dump())
     loop.close()
+
+
+class Supervisor:
+    """Fork and supervise the worker processes. Each worker runs its own event
+    loop, protocol handler and backend connection. The tcp workers accept on
+    the same port through SO_REUSEPORT, and the unix workers share the
+    listening socket bound by the supervisor. The respawned worker takes the
+    index of the dead one, so it listens on the same metrics port.
+
+    The snapshots are loaded once before forking the workers, and dumped once
+    after all the workers flushed their buffers and exited. The supervisor
+    only connects to the backend for them, and keeps no connection while
+    the workers are running.
+    """
+
+    # the worker exits faster than this is throttled before respawning
+    min_uptime = 1
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.children = {}
+        self.stopping = False
+        self.sock = None
+
+    def run(self):
+        if DefaultConf['transport'] == 'unix':
+            self.sock = _bind_unixsocket()
+
+        loop = asyncio.get_event_loop()
+        if DefaultConf['loaddump'] == 'yes':
+            loop.run_until_complete(CacheCtl.bk.init_connection())
+            loop.run_until_complete(CacheCtl.load())
+            CacheCtl.bk.close_connection()
+
+        signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGINT, self.shutdown)
+        for index in range(self.workers):
+            self.spawn(index)
+        aclog.info('Supervising %d worker processes.', self.workers)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            child = self.children.pop(pid, None)
+            if child is None or self.stopping:
+                continue
+
+            started, index = child
+            errlog.error('Worker process %d exited with status %d, '
+                         'restart it.', pid, status)
+            if time.time() - started < self.min_uptime:
+                time.sleep(self.min_uptime)
+            self.spawn(index)
+
+        if self.sock:
+            self.sock.close()
+            os.unlink(DefaultConf['unixsocket'])
+        if self.stopping and DefaultConf['dumponexit'] == 'yes':
+            loop.run_until_complete(CacheCtl.bk.init_connection())
+            loop.run_until_complete(CacheCtl.dump())
+            CacheCtl.bk.close_connection()
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = (time.time(), index)
+            return
+
+        status = 0
+        try:
+            self._run_worker(index)
+        except Exception:
+            errlog.exception('Worker process %d crashed.', os.getpid())
+            status = 1
+        finally:
+            # os._exit skips the atexit handlers
+            stop_queue_listeners()
+            os._exit(status)
+
+    def shutdown(self, signum, frame):
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _run_worker(self, index):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        start_queue_listeners()
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        # the worker opens its own backend connections after forking
+        loop.run_until_complete(CacheCtl.bk.init_connection())
+
+        _serve(loop, self.sock, reuse_port=True, index=index, dump=False)
+
+
+def runserver():
+    workers = int(DefaultConf['workers'])
+    if workers > 1:
+        if DefaultConf['backend'] == 'inmemory':
+            raise PlumbcaConfigError('The inmemory backend can not be shared '
+                                     'by multiple workers.')
+        Supervisor(workers).run()
+        return
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(CacheCtl.bk.init_connection())
+    if DefaultConf['loaddump'] == 'yes':
+        loop.run_until_complete(CacheCtl.load())
+    _serve(loop)
+
+    if DefaultConf['transport'] == 'unix':
+        os.unlink(DefaultConf['unixsocket'])
@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+"""
+    plumbca.slowlog
+    ~~~~~~~~~~~~~~~
+
+    Implements the bounded in-memory log of the slow commands.
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from collections import deque
+import time
+
+from .config import DefaultConf
+
+
+def _summary(arg, width=64):
+    """Summarize the argument for the log, the containers are summarized by
+    their sizes instead of the contents.
+    """
+    if isinstance(arg, (list, tuple, set, dict)):
+        return '<{} of {} items>'.format(type(arg).__name__, len(arg))
+
+    rv = repr(arg)
+    if len(rv) > width:
+        rv = '{}... ({} more chars)'.format(rv[:width], len(rv) - width)
+    return rv
+
+
+class SlowLog:
+    """Record the commands that took longer than `slower_than` microseconds,
+    the oldest entries are dropped when there are `max_len` entries. A
+    negative `slower_than` disables the log.
+
+    Each entry is a list of `[id, timestamp, duration, backend_time,
+    round_trips, command, collection, args]`, the durations are in
+    microseconds.
+    """
+
+    max_args = 8
+
+    def __init__(self, slower_than=None, max_len=None):
+        if slower_than is None:
+            slower_than = DefaultConf['slowlog_slower_than']
+        if max_len is None:
+            max_len = DefaultConf['slowlog_max_len']
+        self.slower_than = int(slower_than)
+        self.entries = deque(maxlen=int(max_len))
+        self.next_id = 0
+
+    def record(self, command, args, elapsed, request_stats):
+        duration = int(elapsed * 1e6)
+        if self.slower_than < 0 or duration < self.slower_than:
+            return
+
+        collection = args[0] if args and isinstance(args[0], str) else None
+        summary = [_summary(arg) for arg in args[:self.max_args]]
+        if len(args) > self.max_args:
+            summary.append('... ({} more arguments)'.format(
+                           len(args) - self.max_args))
+
+        self.entries.appendleft([
+            self.next_id, int(time.time()), duration,
+            int(request_stats.backend_time * 1e6), request_stats.round_trips,
+            command, collection, summary,
+        ])
+        self.next_id += 1
+
+    def get(self, count=10):
+        """The newest `count` entries."""
+        return list(self.entries)[:int(count)]
+
+    def reset(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+slowlog = SlowLog()
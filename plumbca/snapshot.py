@@ -0,0 +1,99 @@
+# -*- coding:utf-8 -*-
+"""
+    plumbca.snapshot
+    ~~~~~~~~~~~~~~~~
+
+    Implements the reading and writing of the collection snapshot files.
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from urllib.parse import quote, unquote
+import asyncio
+import os
+import re
+
+from .config import DefaultConf
+from .helpers import packb, Unpacker
+
+
+snapshot_suffix = '.plumbca.dump'
+snapshot_pattern = re.compile(r'^(.+)' + re.escape(snapshot_suffix) + '$')
+
+
+def snapshot_path(name):
+    """The path of the snapshot file of the collection in the dumpdir."""
+    return os.path.join(DefaultConf['dumpdir'],
+                        quote(name, safe='') + snapshot_suffix)
+
+
+def list_snapshots():
+    """List the `(name, path)` pairs of the snapshot files in the dumpdir."""
+    dumpdir = DefaultConf['dumpdir']
+    if not os.path.isdir(dumpdir):
+        return []
+
+    rv = []
+    for fname in sorted(os.listdir(dumpdir)):
+        m = snapshot_pattern.match(fname)
+        if m:
+            rv.append((unquote(m.group(1)), os.path.join(dumpdir, fname)))
+    return rv
+
+
+class SnapshotWriter:
+    """Write the msgpack records to a temporary file, and rename it to the
+    snapshot path atomically when committing. The file writes run in the
+    executor so that they never block the event loop.
+    """
+
+    def __init__(self, fpath, loop=None):
+        self.fpath = fpath
+        self.tmp_path = '{}.{}.tmp'.format(fpath, os.getpid())
+        self.loop = loop or asyncio.get_event_loop()
+        self.file = open(self.tmp_path, 'wb')
+
+    async def write(self, record):
+        data = packb(record, use_bin_type=True)
+        await self.loop.run_in_executor(None, self.file.write, data)
+
+    async def commit(self):
+        await self.loop.run_in_executor(None, self._sync)
+        self.file.close()
+        os.replace(self.tmp_path, self.fpath)
+
+    def abort(self):
+        self.file.close()
+        os.unlink(self.tmp_path)
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+class SnapshotReader:
+    """Read the msgpack records from the snapshot file chunk by chunk.
+    """
+
+    read_size = 1 << 20
+
+    def __init__(self, fpath, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.file = open(fpath, 'rb')
+        self.unpacker = Unpacker()
+
+    async def read(self):
+        """Return the next record, or None at the end of the file."""
+        while True:
+            try:
+                return next(self.unpacker)
+            except StopIteration:
+                data = await self.loop.run_in_executor(None, self.file.read,
+                                                       self.read_size)
+                if not data:
+                    return
+                self.unpacker.feed(data)
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,173 @@
+# -*- coding:utf-8 -*-
+"""
+    plumbca.stats
+    ~~~~~~~~~~~~~
+
+    Implements the runtime statistics of the commands, connections and the
+    event loop, which are collected in constant memory.
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from bisect import bisect_left
+import asyncio
+import os
+import time
+
+
+_current_task = getattr(asyncio, 'current_task', None) or \
+    asyncio.Task.current_task
+
+
+class Histogram:
+    """Latency histogram with the fixed exponential buckets from 10us to
+    about 4 minutes, each bucket is sqrt(2) times wider than the previous
+    one. The memory is constant whatever how many values are observed, and
+    the percentiles are estimated by the upper bound of the bucket.
+    """
+
+    bounds = tuple(1e-5 * 2 ** (i / 2) for i in range(50))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+
+        rank = self.count * p / 100
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if c and acc >= rank:
+                break
+        if i < len(self.bounds):
+            return min(self.bounds[i], self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class RequestStats:
+    """The backend round trips and the seconds spent in the backend calls of
+    the request that being processed.
+    """
+
+    __slots__ = ('round_trips', 'backend_time')
+
+    def __init__(self):
+        self.round_trips = 0
+        self.backend_time = 0.0
+
+
+class CommandStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.round_trips = 0
+        self.backend_time = 0.0
+        self.latency = Histogram()
+
+    def info(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'round_trips': self.round_trips,
+            'backend_time': self.backend_time,
+            'latency': self.latency.summary(),
+        }
+
+
+class Stats:
+    """The statistics of the worker process. The backend calls are attributed
+    to the request that is being processed by the current task.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.commands = {}
+        self.connections = 0
+        self.connections_total = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.loop_lag = Histogram()
+        # backend method name: Histogram
+        self.backend_methods = {}
+        # task: RequestStats
+        self._requests = {}
+
+    def begin_request(self):
+        rv = RequestStats()
+        self._requests[_current_task()] = rv
+        return rv
+
+    def end_request(self, command, request, elapsed, failed=False):
+        self._requests.pop(_current_task(), None)
+        if command not in self.commands:
+            self.commands[command] = CommandStats()
+        cmd = self.commands[command]
+        cmd.calls += 1
+        cmd.errors += bool(failed)
+        cmd.round_trips += request.round_trips
+        cmd.backend_time += request.backend_time
+        cmd.latency.observe(elapsed)
+
+    def backend_call(self, elapsed):
+        request = self._requests.get(_current_task())
+        if request is not None:
+            request.round_trips += 1
+            request.backend_time += elapsed
+
+    def backend_method(self, name, elapsed):
+        if name not in self.backend_methods:
+            self.backend_methods[name] = Histogram()
+        self.backend_methods[name].observe(elapsed)
+
+    def monitor_loop_lag(self, loop, interval=0.5):
+        """Measure how late the loop runs the callback that scheduled every
+        `interval` seconds.
+        """
+        def _tick(expected):
+            self.loop_lag.observe(max(loop.time() - expected, 0))
+            loop.call_later(interval, _tick, loop.time() + interval)
+        loop.call_later(interval, _tick, loop.time() + interval)
+
+    def info(self):
+        return {
+            'pid': os.getpid(),
+            'uptime': time.time() - self.started,
+            'connections': self.connections,
+            'connections_total': self.connections_total,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'loop_lag': self.loop_lag.summary(),
+            'commands': {name: cmd.info() for name, cmd in self.commands.items()},
+            'backend_methods': {name: hist.summary() for name, hist
+                                in self.backend_methods.items()},
+        }
+
+
+stats = Stats()
@@ -10,12 +10,19 @@
 """
 
 import traceback
+import inspect
 import logging
+import os
 import time
 
 from .collection import IncreaseCollection
 from .cache import CacheCtl
-from .message import Request, Response, message_process_failure
+from .journal import journal
+from .profiler import profiler
+from .slowlog import slowlog
+from .stats import stats
+from .message import (Request, Response, message_process_success,
+                      message_process_failure, message_journal_failure)
 from . import constants
 
 
@@ -24,6 +31,12 @@ actlog = logging.getLogger('activity')
 errlog = logging.getLogger('errors')
 
 
+def _journal_status(err):
+    if err is None:
+        return {}
+    return {'status': message_journal_failure, 'err_msg': err}
+
+
 class Worker:
     """
     Class that handles commands server side.
@@ -33,6 +46,9 @@ class Worker:
         pass
 
     async def run_command(self, req):
+        request_stats = stats.begin_request()
+        start = time.monotonic()
+        failed = False
         try:
             func = getattr(self, req.command)
             response = await func(*req.args)
@@ -44,6 +60,12 @@ class Worker:
 
             response = Response(datas=errmsg,
                                 status=message_process_failure)
+            failed = True
+        # never let the unknown commands grow the statistics
+        command = req.command if hasattr(self, req.command) else 'unknown'
+        elapsed = time.monotonic() - start
+        stats.end_request(command, request_stats, elapsed, failed)
+        slowlog.record(command, req.args, elapsed, request_stats)
         return response
 
     async def wping(self):
@@ -54,13 +76,77 @@ class Worker:
         actlog.info('<WORKER> handling Ping command ...')
         return Response(datas='SERVER OK')
 
+    async def stats(self):
+        """
+        Handles Stats message command.
+        Return the statistics of the worker process, include the calls,
+        errors, latency percentiles and backend round trips per command, the
+        bytes in and out, connections, event loop lag and the backend pools.
+        """
+        actlog.info('<WORKER> handling Stats command ...')
+        rv = stats.info()
+        rv['backend'] = CacheCtl.bk.pool_stats()
+        return Response(datas=rv)
+
+    async def slowlog(self, subcommand='get', count=10):
+        """
+        Handles Slowlog message command.
+
+        subcommand   =>     `get` the newest `count` entries of the slow log,
+                            `len` of the slow log or `reset` it.
+        """
+        actlog.info('<WORKER> handling Slowlog command - %s ...', subcommand)
+        if subcommand == 'get':
+            rv = slowlog.get(count)
+        elif subcommand == 'len':
+            rv = len(slowlog)
+        elif subcommand == 'reset':
+            slowlog.reset()
+            rv = 'OK'
+        else:
+            raise ValueError('Unknown slowlog subcommand: {}'.format(subcommand))
+        return Response(datas=rv)
+
+    async def profile(self, subcommand='status', seconds=30, mode='cprofile'):
+        """
+        Handles Profile message command.
+
+        subcommand   =>     `start` profiling the worker process for
+                            `seconds`, `stop` it before the time is up, or
+                            the `status` of the profiler.
+        mode         =>     `cprofile` writes the pstats file, `sample` writes
+                            the collapsed stacks sampled by SIGPROF.
+
+        The output is written to the dumpdir when the profiler stops, `stop`
+        returns its path. The profiler belongs to the worker process, `start`
+        replies its pid, and `stop` or `status` fails when it reaches another
+        worker whose profiler is not running.
+        """
+        actlog.info('<WORKER> handling Profile command - %s ...', subcommand)
+        if subcommand not in ('start', 'stop', 'status'):
+            raise ValueError('Unknown profile subcommand: {}'.format(subcommand))
+        if subcommand != 'start' and not profiler.running:
+            raise RuntimeError('The profiler of worker {} is not running.'
+                               .format(os.getpid()))
+
+        if subcommand == 'start':
+            profiler.start(seconds, mode)
+            rv = {'status': 'PROFILE STARTED', 'pid': os.getpid()}
+        elif subcommand == 'stop':
+            rv = await profiler.stop()
+        else:
+            rv = profiler.status()
+        return Response(datas=rv)
+
     async def dump(self):
         """
         Handles Dumps message command.
-        Executes dump operation for all of the collections in CacheCtl.
+        Executes dump operation for all of the collections in CacheCtl, the
+        snapshots are written in the background.
         """
         actlog.info('<WORKER> handling Dump command ...')
-        # Nothing todo
+        if not CacheCtl.bgdump():
+            return Response(datas='DUMP IN PROGRESS')
         return Response(datas='DUMP OK')
 
     async def store(self, collection, *args, **kwargs):
@@ -74,11 +160,65 @@ class Worker:
         value        =>     Data value
         expire       =>     Data expiring time
         """
-        coll = CacheCtl.get_collection(collection)
-        await coll.store(*args, **kwargs)
+        coll = await CacheCtl.lookup_collection(collection)
+        entry = coll.prepare_store(*args, **kwargs)
+        record = journal.pack('mstore', collection, [entry])
+        await coll.mstore([entry])
+        err = await self._journal(record)
         wrtlog.info('<WORKER> handling Store command - %s, %s ... %s ...',
                     collection, args[:2], len(args[2]))
-        return Response(datas='Store OK')
+        return Response(datas='Store OK', **_journal_status(err))
+
+    async def mstore(self, items):
+        """
+        Handles MStore message command.
+        Executes a batch of Store operations that may spanning several
+        collections, and the backend writes of each collection are pipelined.
+
+        items        =>     List of the `[collection, timestamp, tagging,
+                            value]` items, an optional dict of the Store
+                            options (abselute_expire, expire_from_now) can
+                            be appended to the item.
+
+        Return the `[status, err_msg]` pair for each item.
+        """
+        status = [None] * len(items)
+        batches = {}
+        for i, item in enumerate(items):
+            try:
+                collection, ts, tagging, value = item[:4]
+                options = item[4] if len(item) > 4 else {}
+                coll = await CacheCtl.lookup_collection(collection)
+                if coll is None:
+                    raise ValueError('Collection {} not exists.'.format(collection))
+                entry = coll.prepare_store(ts, tagging, value, **options)
+            except Exception as err:
+                status[i] = [message_process_failure, str(err)]
+            else:
+                indexes, entries = batches.setdefault(coll, ([], []))
+                indexes.append(i)
+                entries.append(entry)
+
+        for coll, (indexes, entries) in batches.items():
+            record = journal.pack('mstore', coll.name, entries)
+            try:
+                await coll.mstore(entries)
+            except Exception as err:
+                errlog.error('<WORKER> MStore failed over %s: %s\n%s', coll,
+                             err, traceback.format_exc())
+                rv = [message_process_failure, str(err)]
+            else:
+                err = await self._journal(record)
+                if err is None:
+                    rv = [message_process_success, None]
+                else:
+                    rv = [message_journal_failure, err]
+            for i in indexes:
+                status[i] = rv
+
+        wrtlog.info('<WORKER> handling MStore command - %s items over %s '
+                    'collections ...', len(items), len(batches))
+        return Response(datas=status)
 
     async def query(self, collection, *args, **kwargs):
         """
@@ -90,7 +230,7 @@ class Worker:
         end_time     =>     The end time of the query
         tagging      =>     The tagging of the data
         """
-        coll = CacheCtl.get_collection(collection)
+        coll = await CacheCtl.lookup_collection(collection)
         rv = await coll.query(*args, **kwargs)
         rv = list(rv) if rv else []
         actlog.info('<WORKER> handling Query command - %s, %s ...',
@@ -107,27 +247,83 @@ class Worker:
         d            =>      Should be delete the fetching data
         e            =>      whether only contain the expired data
         """
-        coll = CacheCtl.get_collection(collection)
-        rv = await coll.fetch(*args, **kwargs)
+        coll = await CacheCtl.lookup_collection(collection)
+        params = inspect.signature(coll.fetch).bind(*args, **kwargs)
+        params.apply_defaults()
+        d = params.arguments['d']
+        if d:
+            # pin the sentinel so that the journal replays the same deletion
+            params.arguments['expired'] = coll._figure_expired_sentinel(
+                d, params.arguments['e'], params.arguments['expired'])
+            params.arguments['e'] = True
+
+        rv = await coll.fetch(*params.args, **params.kwargs)
         rv = list(rv) if rv else []
+        err = None
+        if d:
+            err = await self._journal(journal.pack(
+                'fetch', collection, params.arguments['tagging'],
+                params.arguments['expired']))
         actlog.info('<WORKER> handling Fetch command - %s, %s ...',
                     collection, args)
-        return Response(datas=rv)
+        return Response(datas=rv, **_journal_status(err))
 
     async def get_collections(self):
         """
         """
-        rv = list(CacheCtl.collmap.keys())
+        # include the collections that ensured by the other worker processes
+        indexes = await CacheCtl.bk.get_collection_indexes()
+        rv = list(set(CacheCtl.collmap) | set(indexes or ()))
         actlog.info('<WORKER> handling Get_collections command ...')
         return Response(datas=rv)
 
+    async def collection_info(self, collection):
+        """
+        Handles Collection_info message command.
+        Returns the parameters of the collection, the approximate
+        UniqueCountCollection reports the standard error of its counts.
+
+        collection   =>     Collection object name
+        """
+        coll = await CacheCtl.lookup_collection(collection)
+        if coll is None:
+            raise ValueError('Collection {} not exists.'.format(collection))
+        actlog.info('<WORKER> handling Collection_info command - %s ...',
+                    collection)
+        return Response(datas=coll.info())
+
     async def ensure_collection(self, name, coll_type='IncreaseCollection',
-                                expired=3600):
-        await CacheCtl.ensure_collection(name, coll_type, expired)
+                                expired=3600, options=None):
+        """
+        Handles Ensure_collection message command.
+
+        name         =>     Collection object name
+        coll_type    =>     Collection class name
+        expired      =>     The expire seconds of the collection data
+        options      =>     Dict of the other collection arguments,
+                            e.g. {'itype': 'max', 'write_behind': True}
+        """
+        await CacheCtl.ensure_collection(name, coll_type, expired,
+                                         **(options or {}))
         assert name in CacheCtl.collmap
+        err = await self._journal(journal.pack(
+            'ensure_collection', name, coll_type, expired, options or {}))
         actlog.info('<WORKER> handling ENSURE_COLLECTION command - %s, %s, %s ...',
                     name, coll_type, expired)
-        return Response(datas='Ensure OK')
+        return Response(datas='Ensure OK', **_journal_status(err))
+
+    async def _journal(self, record):
+        """Append the record of an applied command, return the error message
+        if the journal write fails. The journal is apply-then-log, so the
+        command is not rolled back and the caller reports the distinct
+        `message_journal_failure` status instead of a failure.
+        """
+        try:
+            await journal.append_packed(record)
+        except Exception as err:
+            errlog.error('<WORKER> The journal record of the applied command '
+                         'is lost: %s', err)
+            return str(err)
 
     def _gen_response(self, request, cmd_status, cmd_value):
         if cmd_status == FAILURE_STATUS:
@@ -12,7 +12,8 @@ setup(
         'msgpack-python',
         'asyncio_redis',
     ],
-    scripts=['bin/plumbca-server'],
+    scripts=['bin/plumbca-server', 'bin/plumbca-replay',
+             'bin/plumbca-benchmark'],
     packages=find_packages(exclude=["tests"]),
     license='BSD',
     author='Jason Lai',
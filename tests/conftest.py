@@ -164,6 +164,13 @@ def arb(request):
     return rbackend
 
 
+@pytest.fixture(scope='function')
+def imb(request):
+    backend = BackendFactory('inmemory')
+    request.addfinalizer(backend.flushall)
+    return backend
+
+
 @pytest.fixture(scope='function')
 def cachectl(request):
     def fin():
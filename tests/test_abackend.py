@@ -7,10 +7,17 @@
     :license: BSD, see LICENSE for more details.
 """
 
+import asyncio
+from unittest import mock
+
+import pytest
 from faker import Factory
 
 from functools import partial
 
+from plumbca.collection import (IncreaseCollection, SortedCountCollection,
+                                UniqueCountCollection)
+
 
 fake = Factory.create()
 
@@ -65,6 +72,10 @@ def test_redis_backend_metadata(loop, arb, fake_coll):
             assert len(rv[ts]) == len(taggings)
             for info in rv[ts].values():
                 assert info == [exp] + args
+            # page the timeline by the offset and the count
+            rv = await arb.query_collection_metadata_all(fake_coll, 0, 1000,
+                                                         i - 1, 2)
+            assert list(rv) == [ts]
     loop.run_until_complete(_routine_md_set_query())
 
     # ------------------- check metadata delete operations -------------------
@@ -125,6 +136,224 @@ def test_redis_backend_metadata(loop, arb, fake_coll):
     loop.run_until_complete(_routine_md_final_ope())
 
 
+def test_redis_backend_pool(loop, arb, fake_coll):
+    loop.run_until_complete(arb.init_connection())
+
+    async def _routine_ope():
+        await asyncio.gather(*[
+            arb.set_collection_metadata(fake_coll, 't1', ts + 100, ts)
+            for ts in range(100, 200, 10)
+        ], loop=loop)
+        rv = await asyncio.gather(*[
+            arb.query_collection_metadata_tagging(fake_coll, 100, 190)
+            for _ in range(arb.read_poolsize * 2)
+        ], loop=loop)
+        assert all(len(r) == 10 for r in rv)
+
+        stats = arb.pool_stats()
+        assert stats['write']['size'] == stats['write']['free'] == arb.poolsize
+        assert stats['read']['size'] == stats['read']['free'] == arb.read_poolsize
+        assert stats['read']['waits'] >= arb.read_poolsize * 2
+        assert stats['read']['max_wait_time'] >= 0
+    loop.run_until_complete(_routine_ope())
+
+
+def test_redis_backend_pool_reconnect(loop, arb, fake_coll):
+    loop.run_until_complete(arb.init_connection())
+
+    async def _routine_ope():
+        # the connections closed by the socket errors are replaced
+        for conn in arb.rdb_read._conns:
+            conn.close()
+        for _ in range(arb.read_poolsize * 2):
+            assert await arb.query_collection_metadata_tagging(
+                fake_coll, 100, 190) is None
+        stats = arb.pool_stats()['read']
+        assert stats['reconnects'] == arb.read_poolsize
+        assert stats['free'] == arb.read_poolsize
+        assert not any(conn.closed for conn in arb.rdb_read._conns)
+    loop.run_until_complete(_routine_ope())
+
+
+def test_redis_backend_metadata_upsert(loop, arb, fake_coll):
+    loop.run_until_complete(arb.init_connection())
+    taggings = ['t{}'.format(i) for i in range(20)]
+
+    async def _routine_ope():
+        # the concurrent stores of different taggings at the same ts
+        await asyncio.gather(*[
+            arb.set_collection_metadata(fake_coll, t, 200, 100, 'hello')
+            for t in taggings
+        ], loop=loop)
+        await arb.mset_collection_metadata(fake_coll, [
+            (t, 300, 100) for t in taggings + ['t20']
+        ])
+        rv = await arb.query_collection_metadata_all(fake_coll, 0, 1000)
+        assert list(rv) == [100]
+        info = rv[100]
+        assert sorted(info) == sorted(taggings + ['t20'])
+        # the registered taggings keep their first info
+        assert info['t0'] == [200, 'hello']
+        assert info['t20'] == [300]
+
+        rv = await arb.query_collection_expired(fake_coll, '__all__', 1000)
+        assert sorted(rv) == sorted(taggings + ['t20'])
+    loop.run_until_complete(_routine_ope())
+
+
+def test_redis_backend_expire_index(loop, arb, fake_coll):
+    loop.run_until_complete(arb.init_connection())
+    taggings = ['t1', 't2', 't3']
+    args = ['hello', 42]
+
+    async def _routine_ope():
+        for ts in range(100, 200, 10):
+            for t in taggings:
+                await arb.set_collection_metadata(fake_coll, t, ts + 100, ts, *args)
+        # the duplicate setting should not change the index
+        await arb.set_collection_metadata(fake_coll, 't1', 9999, 100, *args)
+
+        rv = await arb.query_collection_expired(fake_coll, 't1', 250)
+        assert list(rv) == ['t1']
+        assert rv['t1'] == [(ts, args) for ts in range(100, 150, 10)]
+
+        rv = await arb.query_collection_expired(fake_coll, '__all__', 250)
+        assert sorted(rv) == taggings
+        assert await arb.query_collection_expired(fake_coll, '__all__', 200) == {}
+        assert await arb.query_collection_expired(fake_coll, 'not-exists', 300) == {}
+
+        # the deleted items are removed from the index
+        await arb.del_collection_metadata_by_ts(fake_coll, 't1', [100, 110])
+        rv = await arb.query_collection_expired(fake_coll, '__all__', 250)
+        assert [ts for ts, _ in rv['t1']] == [120, 130, 140]
+        assert [ts for ts, _ in rv['t2']] == list(range(100, 150, 10))
+        rv = await arb.query_collection_metadata_tagging(fake_coll, 100, 110)
+        assert sorted(rv[100]) == sorted(rv[110]) == ['t2', 't3']
+
+        await arb.del_collection_metadata_by_range(fake_coll, 't2', 0, 1000)
+        rv = await arb.query_collection_expired(fake_coll, '__all__', 1000)
+        assert 't2' not in rv
+
+        # rebuild the index from the timeline
+        await arb.delete_collection_keys(fake_coll)
+        await arb.set_collection_metadata(fake_coll, 't1', 200, 100, *args)
+        await arb.rdb.delete(arb.expire_index_fmt.format(name=fake_coll.name,
+                                                         tagging='t1'))
+        assert await arb.query_collection_expired(fake_coll, 't1', 300) == {}
+        await arb.rebuild_collection_expire_index(fake_coll)
+        rv = await arb.query_collection_expired(fake_coll, 't1', 300)
+        assert rv == {'t1': [(100, args)]}
+    loop.run_until_complete(_routine_ope())
+
+
+def test_redis_backend_claim_expired(loop, arb, fake_coll):
+    loop.run_until_complete(arb.init_connection())
+    taggings = ['t1', 't2']
+
+    async def _routine_ope():
+        for ts in range(100, 200, 10):
+            for t in taggings:
+                await arb.set_collection_metadata(fake_coll, t, ts + 100, ts)
+                await arb.inc_coll_cache_set(fake_coll,
+                                             _mk_inc_coll_field(t, ts), {'a': ts})
+
+        # the parallel consumers never claim the same item twice, and the
+        # items are claimed by several batches
+        with mock.patch.object(arb, 'chunksize', 2):
+            claims = await asyncio.gather(*[
+                arb.claim_collection_expired(fake_coll, '__all__', 250)
+                for _ in range(5)
+            ], loop=loop)
+        claimed = [(t, ts) for rv in claims for t, items in rv.items()
+                   for ts, _ in items]
+        assert sorted(claimed) == [(t, ts) for t in taggings
+                                   for ts in range(100, 150, 10)]
+        assert await arb.claim_collection_expired(fake_coll, '__all__', 250) == {}
+        assert await arb.query_collection_expired(fake_coll, '__all__', 250) == {}
+
+        # the claimed tagging is removed from the timeline, the others remain
+        await arb.set_collection_metadata(fake_coll, 't3', 500, 150)
+        rv = await arb.claim_collection_expired(fake_coll, 't1', 300)
+        assert [ts for ts, _ in rv['t1']] == list(range(150, 200, 10))
+        rv = await arb.query_collection_metadata_tagging(fake_coll, 150, 150)
+        assert sorted(rv[150]) == ['t2', 't3']
+
+        fields = [_mk_inc_coll_field('t2', ts) for ts in (100, 110)]
+        rv = await arb.inc_coll_caches_getdel(fake_coll, *fields)
+        assert rv == [{'a': 100}, {'a': 110}]
+        assert await arb.inc_coll_caches_get(fake_coll, *fields) == []
+    loop.run_until_complete(_routine_ope())
+
+
+@pytest.mark.parametrize('backend', ['arb', 'imb'])
+def test_backend_claim_expired_values(loop, request, backend):
+    bk = request.getfixturevalue(backend)
+    loop.run_until_complete(bk.init_connection())
+
+    async def _routine_ope():
+        icoll = IncreaseCollection('claim-blob')
+        hcoll = IncreaseCollection('claim-hash', storage='hash')
+        scoll = SortedCountCollection('claim-sorted')
+        ucoll = UniqueCountCollection('claim-uniq')
+        acoll = UniqueCountCollection('claim-hll', approximate=True)
+        for coll in (icoll, hcoll, scoll, ucoll, acoll):
+            await bk.mset_collection_metadata(coll, [('t', 200, 100),
+                                                    ('t', 210, 110)])
+        # only the item of ts 100 has the value
+        await bk.inc_coll_caches_set(icoll, {'100:t': {'a': 1}})
+        await bk.inc_coll_hashes_update(hcoll, 'inc', [('100:t', {'a': 1})])
+        await bk.sorted_count_coll_caches_set(scoll, [(100, 't', {'m1': 1,
+                                                                 'm2': 2})])
+        await bk.uniq_count_coll_caches_set(ucoll, [(100, 't', ['m1', 'm2'])])
+        await bk.uniq_count_coll_hlls_add(acoll, [(100, 't', ['m1', 'm2'])])
+
+        # the values are taken away along with the claimed items
+        expected = [
+            (icoll, 'inc_blob', None, {'a': 1}, None),
+            (hcoll, 'inc_hash', None, {'a': 1}, None),
+            (scoll, 'sorted_count', 1, [('m2', 2)], []),
+            (ucoll, 'unique_count', False, {'m1', 'm2'}, set()),
+            (acoll, 'unique_hll', None, 2, 0),
+        ]
+        for coll, value_type, option, value, missing in expected:
+            rv = await bk.claim_collection_expired(coll, 't', 250, value_type,
+                                                  option)
+            assert rv == {'t': [(100, [], value), (110, [], missing)]}
+            assert await bk.claim_collection_expired(coll, 't', 250,
+                                                    value_type) == {}
+
+        assert await bk.inc_coll_caches_map(icoll, ['100:t']) == {}
+        assert await bk.inc_coll_hashes_get(hcoll, '100:t') == [None]
+        assert await bk.sorted_count_coll_cache_get(scoll, 't', [100]) == [[]]
+        assert await bk.uniq_count_coll_cache_get(ucoll, 't', [100]) == [set()]
+        assert await bk.uniq_count_coll_hll_count(acoll, 't', [100]) == [0]
+    loop.run_until_complete(_routine_ope())
+
+
+@pytest.mark.parametrize('backend', ['arb', 'imb'])
+def test_backend_inc_coll_caches_update(loop, request, backend, fake_coll):
+    bk = request.getfixturevalue(backend)
+    loop.run_until_complete(bk.init_connection())
+
+    async def _routine_ope():
+        # the concurrent updates of the same item never lose increments
+        await asyncio.gather(*[
+            bk.inc_coll_caches_update(fake_coll, 'inc', [('f1', {'a': 1}),
+                                                         ('f2', {'b': i})])
+            for i in range(50)
+        ], loop=loop)
+        await bk.inc_coll_caches_update(fake_coll, 'inc', [('f1', {'c': 2}),
+                                                           ('f2', {})])
+        rv = await bk.inc_coll_caches_map(fake_coll, ['f1', 'f2'])
+        assert rv == {'f1': {'a': 50, 'c': 2}, 'f2': {'b': 1225}}
+
+        await bk.inc_coll_caches_update(fake_coll, 'max', [('f2', {'b': 1})])
+        await bk.inc_coll_caches_update(fake_coll, 'avg', [('f1', {'a': 51})])
+        rv = await bk.inc_coll_caches_map(fake_coll, ['f1', 'f2'])
+        assert rv == {'f1': {'a': 50.5, 'c': 2}, 'f2': {'b': 1225}}
+    loop.run_until_complete(_routine_ope())
+
+
 async def _add_inc_coll_item(rb, coll, tagging, ts, value):
     await rb.set_collection_metadata(coll, tagging, ts+100, ts)
     await rb.inc_coll_cache_set(coll, _mk_inc_coll_field(tagging, ts), value)
@@ -189,6 +418,33 @@ def test_redis_backend_inc_coll(loop, arb, fake_coll):
     loop.run_until_complete(_routine_del_ope())
 
 
+def test_redis_backend_inc_coll_hashes(loop, arb, fake_coll):
+    loop.run_until_complete(arb.init_connection())
+
+    async def _routine_ope():
+        await arb.inc_coll_hashes_update(fake_coll, 'inc', [
+            ('h1', {'a': 1}), ('h1', {'a': 2, 'b': 1}), ('h2', {})])
+        # the results are aligned with the fields, the item that stored an
+        # empty dict has no hash
+        assert await arb.inc_coll_hashes_get(fake_coll, 'h1', 'h2', 'h3') == \
+            [{'a': 3, 'b': 1}, None, None]
+        assert await arb.inc_coll_hashes_getdel(fake_coll, 'h2', 'h1') == \
+            [None, {'a': 3, 'b': 1}]
+        assert await arb.inc_coll_hashes_get(fake_coll, 'h1') == [None]
+
+        # the scripts are loaded again after they are flushed
+        await arb.rdb.script_flush()
+        await arb.inc_coll_hashes_update(fake_coll, 'max', [
+            ('h1', {'a': 3}), ('h1', {'a': 2})])
+        assert await arb.inc_coll_hashes_get(fake_coll, 'h1') == [{'a': 3}]
+        await arb.rdb.script_flush()
+        await arb.set_collection_metadata(fake_coll, 'day', 200, 100)
+        assert await arb.query_collection_metadata(fake_coll, 'day', 0, 1000) \
+            == [([200], 100)]
+        await arb.inc_coll_hashes_del(fake_coll, 'h1')
+    loop.run_until_complete(_routine_ope())
+
+
 def test_redis_backend_unique_count_coll(loop, arb, fake_coll):
     loop.run_until_complete(arb.init_connection())
     items_num = 200
@@ -294,3 +550,37 @@ def test_redis_backend_sorted_count_coll(loop, arb, fake_coll):
                                                    timestamps)
         assert rv == [[], [], []]
     loop.run_until_complete(_routine_del_ope())
+
+
+def test_redis_backend_count_coll_chunked_reads(loop, arb, fake_coll):
+    loop.run_until_complete(arb.init_connection())
+    origin, arb.chunksize = arb.chunksize, 2
+    tagging = 'day'
+    v = {fake.uuid4(): i for i in range(20)}
+    timestamps = list(range(100, 600, 100))
+
+    async def _routine_ope():
+        for ts in timestamps:
+            await arb.uniq_count_coll_cache_set(fake_coll, ts, tagging, set(v))
+            await arb.sorted_count_coll_cache_set(fake_coll, ts, tagging, v)
+
+        rv = await arb.uniq_count_coll_cache_get(fake_coll, tagging, timestamps)
+        assert rv == [set(v)] * len(timestamps)
+        rv = await arb.uniq_count_coll_cache_get(fake_coll, tagging,
+                                                 timestamps, count_only=True)
+        assert rv == [len(v)] * len(timestamps)
+        rv = await arb.sorted_count_coll_cache_get(fake_coll, tagging,
+                                                   timestamps, topN=5)
+        assert [[m for m, _ in item] for item in rv] == \
+            [sorted(v, key=v.get)[-5:]] * len(timestamps)
+
+        rv = await arb.uniq_count_coll_cache_pop(fake_coll, tagging,
+                                                 timestamps, 5)
+        assert [len(item) for item in rv] == [5] * len(timestamps)
+        rv = await arb.uniq_count_coll_cache_get(fake_coll, tagging,
+                                                 timestamps, count_only=True)
+        assert rv == [len(v) - 5] * len(timestamps)
+    try:
+        loop.run_until_complete(_routine_ope())
+    finally:
+        arb.chunksize = origin
@@ -0,0 +1,54 @@
+# -*- coding:utf-8 -*-
+"""
+    tests.benchmark
+    ~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from configparser import ConfigParser
+import os
+
+import pytest
+
+from plumbca.benchmark import (Workload, parse_mix, percentile,
+                               proc_cpu_seconds, summarize, write_config)
+
+
+def test_benchmark_helpers(tmpdir):
+    assert parse_mix('store=70/query=20/fetch=10') == \
+        {'store': 70, 'query': 20, 'fetch': 10}
+    with pytest.raises(ValueError):
+        parse_mix('delete=10')
+
+    values = [i / 1000 for i in range(1, 1001)]
+    assert percentile(values, 50) == 0.501
+    assert percentile(values, 99.9) == 1.0
+    assert percentile([], 99) == 0.0
+
+    fpath = str(tmpdir.join('plumbca.conf'))
+    write_config(fpath, str(tmpdir), 14273, workers=2)
+    config = ConfigParser()
+    config.read(fpath)
+    assert config['global']['backend'] == 'inmemory'
+    assert config['global']['workers'] == '2'
+    assert config['global']['dumpdir'] == str(tmpdir)
+
+    if os.path.isdir('/proc'):
+        assert proc_cpu_seconds(os.getpid()) >= 0
+
+
+def test_benchmark_workload():
+    for ctype in ('IncreaseCollection', 'SortedCountCollection',
+                  'UniqueCountCollection'):
+        w = Workload(ctype, {'store': 1, 'query': 0, 'fetch': 1})
+        ops = [w.next_op() for _ in range(100)]
+        assert {op for op, _ in ops} == {'store', 'fetch'}
+        assert all(args[0] == 'bench-' + ctype for _, args in ops)
+
+    rv = summarize({('IncreaseCollection', 'store'): [0.2, 0.1]},
+                   {('IncreaseCollection', 'store'): 1}, 2)
+    assert rv['IncreaseCollection']['store']['ops_per_sec'] == 1
+    assert rv['IncreaseCollection']['store']['p50'] == 0.2
+    assert rv['total']['errors'] == 1
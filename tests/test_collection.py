@@ -7,9 +7,15 @@
     :license: BSD, see LICENSE for more details.
 """
 
+from unittest import mock
+
 import pytest
 from faker import Factory
 
+from plumbca.collection import (IncreaseCollection, UniqueCountCollection,
+                                SortedCountCollection)
+from plumbca.snapshot import snapshot_path
+
 
 fake = Factory.create()
 
@@ -209,6 +215,91 @@ def test_increse_collection_batch_opes(loop, arb, icoll, icoll2):
     loop.run_until_complete(_routine_ope())
 
 
+@pytest.mark.incremental
+def test_increse_collection_write_behind(loop, arb):
+    loop.run_until_complete(arb.init_connection())
+    async def _routine_ope():
+        coll = IncreaseCollection('wb', write_behind=True)
+        coll.flush_interval = 3600
+        for i in range(10):
+            await coll.store(128, 'foo', {'bar': 1})
+            await coll.store(256, 'foo', {'bar': 1, 'apple': i})
+
+        # nothing written to the backend before flushing
+        _md_len, _cache_len = await arb.get_collection_length(coll)
+        assert _md_len == 0 and _cache_len == 0
+        assert len(coll._pending) == 2
+
+        # query flushes the merged increments first
+        res = list(await coll.query(10, 1000, 'foo'))
+        assert len(res) == 2
+        assert res[0][1] == {'bar': 10}
+        assert res[1][1] == {'bar': 10, 'apple': 45}
+        assert coll._pending == {} and coll._flush_handle is None
+
+        # reaching the size threshold flushes the buffer
+        coll.flush_size = 3
+        for ts in (300, 400, 500):
+            await coll.store(ts, 'foo', {'bar': 1})
+        assert coll._pending == {}
+        _md_len, _cache_len = await arb.get_collection_length(coll)
+        assert _md_len == 5 and _cache_len == 5
+    loop.run_until_complete(_routine_ope())
+
+
+def test_increse_collection_write_behind_retry(loop, arb):
+    loop.run_until_complete(arb.init_connection())
+
+    async def _routine_ope():
+        coll = IncreaseCollection('wb-retry', storage='hash', write_behind=True)
+        coll.flush_interval = 3600
+        for ts in (100, 200):
+            await coll.store(ts, 'foo', {'bar': 1})
+
+        # nothing is applied by the failed transaction, the increments are
+        # put back and applied once by the retry
+        with mock.patch.object(arb.rdb, 'multi_exec',
+                               side_effect=ConnectionError):
+            with pytest.raises(ConnectionError):
+                await coll.flush()
+        assert len(coll._pending) == 2
+        await coll.flush()
+        assert coll._pending == {}
+
+        # the update that fails in the transaction never retries the others
+        key = arb.inc_coll_hash_fmt.format(name=coll.name, field='200:foo')
+        await arb.rdb.delete(key)
+        await arb.rdb.set(key, 'not-a-hash')
+        for ts in (100, 200):
+            await coll.store(ts, 'foo', {'bar': 1})
+        await coll.flush()
+        assert coll._pending == {}
+        res = list(await coll.query(0, 150, 'foo'))
+        assert res[0][1] == {'bar': 2}
+    loop.run_until_complete(_routine_ope())
+
+
+@pytest.mark.incremental
+def test_increse_collection_hash_storage(loop, arb):
+    loop.run_until_complete(arb.init_connection())
+    async def _routine_ope():
+        icoll = IncreaseCollection('hs', storage='hash')
+        mcoll = IncreaseCollection('hs-max', 'max', storage='hash')
+        for coll in (icoll, mcoll):
+            tslist, tagging = await CollOpeHelper.icoll_insert_data(coll)
+            res = list(await coll.query(100, 150, tagging))
+            assert len(res) == 3
+            assert res[1][0].split(':')[0] == '128'
+        assert res[1][1] == {'bar': 1, 'apple': 1}
+        res = list(await icoll.query(100, 150, tagging))
+        assert res[1][1] == {'bar': 1, 'apple': 2}
+
+        rv = list(await icoll.fetch(e=False))
+        assert len(rv) == 5
+        assert list(await icoll.query(10, 1000, tagging)) == []
+    loop.run_until_complete(_routine_ope())
+
+
 @pytest.mark.incremental
 def test_uniq_count_collection_batch_opes(loop, arb, uc_coll):
     loop.run_until_complete(arb.init_connection())
@@ -289,6 +380,67 @@ def test_uniq_count_collection_batch_opes(loop, arb, uc_coll):
 
 
 @pytest.mark.incremental
+def test_uniq_count_collection_counts(loop, arb, uc_coll):
+    loop.run_until_complete(arb.init_connection())
+    tslist = [100, 200, 300]
+    tagging = 'test'
+    common = {fake.uuid4() for i in range(10)}
+    values = [common | {fake.uuid4() for i in range(20)} for _ in tslist]
+
+    async def _routine_ope():
+        for ts, value in zip(tslist, values):
+            await uc_coll.store(ts, tagging, value)
+
+        rv = list(await uc_coll.query(100, 300, tagging, count_only=True))
+        assert [(ts, count) for ts, count, _ in rv] == \
+            [(ts, 30) for ts in tslist]
+        rv = await uc_coll.query(100, 300, tagging, merge=True)
+        assert rv == [(100, 300, 10 + 20 * len(tslist))]
+        assert await uc_coll.query(500, 600, tagging, merge=True) == []
+
+        # the items expire at ts + 3600, the sentinel passes 100 and 200
+        rv = list(await uc_coll.fetch(tagging, expired=3850, count_only=True))
+        assert [(ts, count) for ts, count, _ in rv] == [(100, 30), (200, 30)]
+        rv = await uc_coll.query(0, 1000, tagging, merge=True)
+        assert rv == [(300, 300, 30)]
+    loop.run_until_complete(_routine_ope())
+
+
+def test_uniq_count_collection_approximate(loop, arb):
+    loop.run_until_complete(arb.init_connection())
+    coll = UniqueCountCollection('foo', approximate=True)
+    items_num = 1000
+    tslist = [100, 200, 300]
+    tagging = 'test'
+    values = [{fake.uuid4() for i in range(items_num)} for _ in tslist]
+
+    def _assert_approx(count, expected):
+        assert abs(count - expected) <= expected * coll.std_error * 3
+
+    async def _routine_ope():
+        for ts, value in zip(tslist, values):
+            await coll.store(ts, tagging, value)
+            # the duplicate members are not counted again
+            await coll.store(ts, tagging, list(value)[:10])
+
+        rv = list(await coll.query(100, 300, tagging))
+        assert [ts for ts, _, _ in rv] == tslist
+        for _, count, _ in rv:
+            _assert_approx(count, items_num)
+
+        rv = await coll.query(100, 300, tagging, merge=True)
+        assert len(rv) == 1
+        assert rv[0][:2] == (100, 300)
+        _assert_approx(rv[0][2], items_num * len(tslist))
+
+        # the items expire at ts + 3600, the sentinel passes 100 and 200
+        rv = list(await coll.fetch(tagging, expired=3850))
+        assert [ts for ts, _, _ in rv] == [100, 200]
+        assert list(await coll.fetch(tagging, expired=3850)) == []
+        assert [ts for ts, _, _ in await coll.query(0, 1000, tagging)] == [300]
+    loop.run_until_complete(_routine_ope())
+
+
 def test_sorted_count_collection_batch_opes(loop, arb, sc_coll):
     loop.run_until_complete(arb.init_connection())
     items_num = 30
@@ -379,3 +531,64 @@ def test_sorted_count_collection_batch_opes(loop, arb, sc_coll):
         assert rv_num == 0
         assert len(rv) == 0
     loop.run_until_complete(_routine_query_fetch_ope())
+
+
+def test_sorted_count_collection_merge(loop, arb, sc_coll):
+    loop.run_until_complete(arb.init_connection())
+    tslist = [100, 200, 300]
+    tagging = 'test'
+
+    async def _routine_ope():
+        for i, ts in enumerate(tslist):
+            await sc_coll.store(ts, tagging, {'a': 1, 'b': 10 - i, 'c': i * 10})
+
+        rv = await sc_coll.query(100, 300, tagging, topN=2, merge=True)
+        assert rv == [(100, 300, [('b', 27), ('c', 30)])]
+        rv = await sc_coll.query(100, 300, tagging, merge=True,
+                                 weights={300: 0, 200: 2})
+        assert rv == [(100, 300, [('a', 3), ('c', 20), ('b', 28)])]
+        assert await sc_coll.query(500, 600, tagging, merge=True) == []
+    loop.run_until_complete(_routine_ope())
+
+
+def test_sorted_count_collection_accumulate(loop, arb):
+    loop.run_until_complete(arb.init_connection())
+    coll = SortedCountCollection('acc', accumulate=True)
+    tagging = 'test'
+
+    async def _routine_ope():
+        await coll.store(100, tagging, {'a': 1, 'b': 2})
+        await coll.store(100, tagging, {'a': 5})
+        await coll.mstore([coll.prepare_store(100, tagging, {'b': 1, 'c': 1}),
+                           coll.prepare_store(100, tagging, {'c': 1})])
+
+        rv = list(await coll.query(0, 1000, tagging))
+        assert [(ts, members) for ts, members, _ in rv] == \
+            [(100, [('c', 2), ('b', 3), ('a', 6)])]
+    loop.run_until_complete(_routine_ope())
+
+
+def test_collection_load_twice(loop, arb):
+    loop.run_until_complete(arb.init_connection())
+    colls = [IncreaseCollection('blob'),
+             IncreaseCollection('hash', storage='hash'),
+             SortedCountCollection('acc', accumulate=True),
+             UniqueCountCollection('uniq')]
+    values = [{'a': 1}, {'a': 1}, {'m1': 2, 'm2': 1}, ['m1', 'm2']]
+
+    async def _routine_ope():
+        for coll, value in zip(colls, values):
+            for ts in (100, 200):
+                await coll.store(ts, 'foo', value)
+                await coll.store(ts, 'foo', value)
+        origin = [list(await coll.query(0, 1000, 'foo')) for coll in colls]
+
+        for coll in colls:
+            await coll.dump(snapshot_path(coll.name))
+        # restoring over the values that still exist overwrites them
+        for _ in range(2):
+            for coll in colls:
+                await coll.load(snapshot_path(coll.name))
+            assert [list(await coll.query(0, 1000, 'foo'))
+                    for coll in colls] == origin
+    loop.run_until_complete(_routine_ope())
@@ -33,3 +33,22 @@ def test_cachectl_basic(loop, arb, cachectl, coll_list):
 
         assert cachectl.get_collection('not_exists') is None
     loop.run_until_complete(_routine_ope())
+
+
+def test_cachectl_lookup(loop, arb, cachectl, coll_list):
+    loop.run_until_complete(arb.init_connection())
+
+    async def _routine_ope():
+        for cname in coll_list:
+            await cachectl.ensure_collection(cname, 'SortedCountCollection', 600)
+
+        # mimic the collections ensured by the other worker process
+        cachectl.collmap = {}
+        for cname in coll_list:
+            coll = await cachectl.lookup_collection(cname)
+            assert coll.__class__.__name__ == 'SortedCountCollection'
+            assert coll._expire == 600
+            assert cachectl.get_collection(cname) is coll
+
+        assert await cachectl.lookup_collection('not_exists') is None
+    loop.run_until_complete(_routine_ope())
@@ -0,0 +1,239 @@
+# -*- coding:utf-8 -*-
+"""
+    tests.imbackend
+    ~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from unittest import mock
+
+from faker import Factory
+
+from plumbca.collection import (IncreaseCollection, SortedCountCollection,
+                                UniqueCountCollection)
+from plumbca.config import DefaultConf
+from plumbca.snapshot import snapshot_path
+
+
+fake = Factory.create()
+
+
+def test_inmemory_backend_basic(loop, imb, fake_manager, fake_coll):
+    fake_manager.collmap = {'t1': fake_coll, 't2': fake_coll}
+
+    async def _routine_ope():
+        assert await imb.get_collection_indexes() is None
+        for name, coll in fake_manager.collmap.items():
+            await imb.set_collection_index(name, coll)
+            await imb.set_collection_params(name, ['_t', 100, {'a': 1}])
+        assert await imb.get_collection_index('t1') == ['t1', '_t']
+        assert await imb.get_collection_index('not-exists') is None
+        assert await imb.get_collection_indexes() == {'t1': '_t', 't2': '_t'}
+        assert await imb.get_collection_params('t2') == ['_t', 100, {'a': 1}]
+        assert await imb.get_collection_params('not-exists') is None
+    loop.run_until_complete(_routine_ope())
+
+
+def test_inmemory_backend_metadata(loop, imb, fake_coll):
+    taggings = ['t1', 't2', 't3']
+    args = ['hello', 42]
+
+    async def _routine_ope():
+        for ts in range(100, 200, 10):
+            for t in taggings:
+                await imb.set_collection_metadata(fake_coll, t, ts + 100, ts, *args)
+        # the duplicate setting should not change the metadata
+        await imb.set_collection_metadata(fake_coll, 't1', 9999, 100, *args)
+        await imb.mset_collection_metadata(fake_coll, [('t1', 9999, 100),
+                                                       ('t4', 300, 100)])
+        assert await imb.get_collection_length(fake_coll) == [10]
+
+        rv = await imb.query_collection_metadata(fake_coll, 't1', 100, 120)
+        assert rv == [([200] + args, 100), ([210] + args, 110),
+                      ([220] + args, 120)]
+        rv = await imb.query_collection_metadata_tagging(fake_coll, 100, 110)
+        assert sorted(rv[100]) == ['t1', 't2', 't3', 't4']
+        assert sorted(rv[110]) == taggings
+        assert await imb.query_collection_metadata_all(fake_coll, 500, 600) is None
+
+        rv = await imb.query_collection_expired(fake_coll, 't1', 250)
+        assert rv == {'t1': [(ts, args) for ts in range(100, 150, 10)]}
+        rv = await imb.query_collection_expired(fake_coll, '__all__', 250)
+        assert sorted(rv) == taggings
+        assert await imb.query_collection_expired(fake_coll, 'not-exists', 300) == {}
+
+        await imb.del_collection_metadata_by_ts(fake_coll, 't1', [100, 110])
+        rv = await imb.query_collection_expired(fake_coll, 't1', 250)
+        assert [ts for ts, _ in rv['t1']] == [120, 130, 140]
+        await imb.del_collection_metadata_by_range(fake_coll, 't2', 0, 1000)
+        assert 't2' not in await imb.query_collection_expired(fake_coll,
+                                                              '__all__', 1000)
+
+        # the claimed items are removed from the index and the timeline
+        rv = await imb.claim_collection_expired(fake_coll, '__all__', 250)
+        assert [ts for ts, _ in rv['t3']] == list(range(100, 150, 10))
+        assert await imb.claim_collection_expired(fake_coll, '__all__', 250) == {}
+        rv = await imb.query_collection_metadata_all(fake_coll, 0, 1000)
+        assert sorted(rv) == [100] + list(range(150, 200, 10))
+        assert list(rv[100]) == ['t4']
+
+        # rebuild the index from the timeline
+        imb.expire_indexes.clear()
+        await imb.rebuild_collection_expire_index(fake_coll)
+        rv = await imb.query_collection_expired(fake_coll, '__all__', 1000)
+        assert sorted(rv) == ['t1', 't3', 't4']
+
+        await imb.delete_collection_keys(fake_coll)
+        assert await imb.get_collection_length(fake_coll) == [0]
+    loop.run_until_complete(_routine_ope())
+
+
+def test_inmemory_backend_inc_coll(loop, imb, fake_coll):
+
+    async def _routine_ope():
+        await imb.inc_coll_caches_set(fake_coll, {'f1': {'a': 1}, 'f2': {'b': 2}})
+        await imb.inc_coll_cache_set(fake_coll, 'f3', {'c': 3})
+        assert await imb.inc_coll_caches_get(fake_coll, 'f1', 'f3', 'f4') == \
+            [{'a': 1}, {'c': 3}]
+        assert await imb.inc_coll_caches_map(fake_coll, ['f2', 'f4']) == \
+            {'f2': {'b': 2}}
+        assert await imb.get_collection_length(fake_coll,
+                                               'IncreaseCollection') == [0, 3]
+        assert await imb.inc_coll_caches_getdel(fake_coll, 'f1', 'f4') == [{'a': 1}]
+        assert await imb.inc_coll_caches_del(fake_coll, 'f1', 'f2') == 1
+        assert await imb.inc_coll_caches_get(fake_coll, 'f1', 'f2') == []
+
+        await imb.inc_coll_hashes_update(fake_coll, 'inc', [
+            ('h1', {'a': 1}), ('h1', {'a': 2, 'b': 1}), ('h2', {})])
+        await imb.inc_coll_hashes_update(fake_coll, 'max', [
+            ('h2', {'a': 3}), ('h2', {'a': 2})])
+        assert await imb.inc_coll_hashes_get(fake_coll, 'h1', 'h2', 'h3') == \
+            [{'a': 3, 'b': 1}, {'a': 3}, None]
+        assert await imb.inc_coll_hashes_getdel(fake_coll, 'h3', 'h1') == \
+            [None, {'a': 3, 'b': 1}]
+        assert await imb.inc_coll_hashes_del(fake_coll, 'h1', 'h2') == 1
+    loop.run_until_complete(_routine_ope())
+
+
+def test_inmemory_backend_count_coll(loop, imb, fake_coll):
+    tagging = 'day'
+    timestamps = [100, 200, 300]
+    v = {fake.uuid4() for i in range(200)}
+    scores = {fake.uuid4(): i for i in range(200)}
+    ordered = sorted(scores.items(), key=lambda x: x[1])
+
+    async def _routine_ope():
+        for ts in timestamps:
+            assert await imb.uniq_count_coll_cache_set(fake_coll, ts, tagging, v) == 200
+            assert await imb.uniq_count_coll_cache_set(fake_coll, ts, tagging, v) == 0
+            assert await imb.sorted_count_coll_cache_set(fake_coll, ts, tagging,
+                                                         scores) == 200
+
+        assert await imb.uniq_count_coll_cache_get(fake_coll, tagging,
+                                                   timestamps) == [v] * 3
+        assert await imb.uniq_count_coll_cache_union_count(fake_coll, tagging,
+                                                           timestamps) == 200
+        rv = await imb.uniq_count_coll_cache_pop(fake_coll, tagging,
+                                                 timestamps[1:], 50)
+        assert [len(item) for item in rv] == [50, 50]
+        rv = await imb.uniq_count_coll_cache_getdel(fake_coll, tagging,
+                                                    timestamps, count_only=True)
+        assert rv == [200, 150, 150]
+        assert await imb.uniq_count_coll_cache_del(fake_coll, tagging,
+                                                   timestamps) == 0
+
+        assert await imb.sorted_count_coll_cache_get(fake_coll, tagging,
+                                                     timestamps) == [ordered] * 3
+        rv = await imb.sorted_count_coll_cache_get(fake_coll, tagging,
+                                                   timestamps[:1], topN=10)
+        assert rv == [ordered[-10:]]
+        rv = await imb.sorted_count_coll_cache_union(fake_coll, tagging,
+                                                     timestamps, topN=1,
+                                                     weights={100: 0})
+        assert rv == [(ordered[-1][0], ordered[-1][1] * 2)]
+        await imb.sorted_count_coll_caches_set(
+            fake_coll, [(100, tagging, {ordered[0][0]: 1000})], accumulate=True)
+        rv = await imb.sorted_count_coll_cache_getdel(fake_coll, tagging,
+                                                      timestamps[:1], topN=1)
+        assert rv == [[(ordered[0][0], 1000)]]
+        assert await imb.sorted_count_coll_cache_del(fake_coll, tagging,
+                                                     timestamps) == 2
+    loop.run_until_complete(_routine_ope())
+
+
+def test_inmemory_backend_hll(loop, imb, fake_coll):
+    tagging = 'day'
+    members = [fake.uuid4() for i in range(3000)]
+
+    def _assert_approx(count, expected):
+        assert abs(count - expected) <= expected * 0.0081 * 3
+
+    async def _routine_ope():
+        await imb.uniq_count_coll_hlls_add(fake_coll, [
+            (100, tagging, members[:2000]), (200, tagging, members[1000:])])
+        c1, c2 = await imb.uniq_count_coll_hll_count(fake_coll, tagging,
+                                                     [100, 200])
+        _assert_approx(c1, 2000)
+        _assert_approx(c2, 2000)
+        rv = await imb.uniq_count_coll_hll_count(fake_coll, tagging,
+                                                 [100, 200], merge=True)
+        _assert_approx(rv, 3000)
+        # the registers are fixed-size whatever how many members are added
+        assert all(len(hll.registers) == 16384 for hll in imb.uniq_hlls.values())
+
+        assert len(await imb.uniq_count_coll_hll_getdel(fake_coll, tagging,
+                                                        [100])) == 1
+        assert await imb.uniq_count_coll_hll_count(fake_coll, tagging,
+                                                   [100]) == [0]
+    loop.run_until_complete(_routine_ope())
+
+
+def test_inmemory_backend_collection(loop, imb):
+    coll = IncreaseCollection('foo')
+    coll.bk = imb
+
+    async def _routine_ope():
+        for ts in (100, 200, 300):
+            await coll.store(ts, 'bar', {'a': 1})
+            await coll.store(ts, 'bar', {'a': 2, 'b': 1})
+
+        rv = list(await coll.query(0, 1000, 'bar'))
+        assert [value for _, value, _ in rv] == [{'a': 3, 'b': 1}] * 3
+        rv = list(await coll.fetch(expired=3850))
+        assert [key for key, _, _ in rv] == ['100:bar', '200:bar']
+        assert list(await coll.fetch(expired=3850)) == []
+        assert await imb.get_collection_length(coll) == [1, 1]
+    loop.run_until_complete(_routine_ope())
+
+
+def test_inmemory_backend_dump_load(loop, imb):
+    colls = [IncreaseCollection('inc'), SortedCountCollection('sorted'),
+             UniqueCountCollection('uniq'),
+             UniqueCountCollection('hll', approximate=True)]
+    values = [{'a': 1}, {'m1': 2, 'm2': 1}, ['m1', 'm2'], ['m1', 'm2']]
+    for coll in colls:
+        coll.bk = imb
+
+    async def _routine_ope():
+        for coll, value in zip(colls, values):
+            for ts in range(100, 200, 10):
+                await coll.store(ts, 't1', value)
+                await coll.store(ts, 't2', value)
+        origin = [list(await coll.query(0, 1000, 't1')) for coll in colls]
+
+        # the timeline is read by pages of 3 timestamps
+        with mock.patch.dict(DefaultConf, {'dump_chunksize': '3'}):
+            for coll in colls:
+                assert await coll.dump(snapshot_path(coll.name)) == 10
+        imb.flushall()
+        for coll in colls:
+            coll.taggings = set()
+            await coll.load(snapshot_path(coll.name))
+            assert coll.taggings == {'t1', 't2'}
+
+        assert [list(await coll.query(0, 1000, 't1')) for coll in colls] == origin
+        rv = await imb.query_collection_expired(colls[0], '__all__', 3850)
+        assert sorted(rv) == ['t1', 't2']
+    loop.run_until_complete(_routine_ope())
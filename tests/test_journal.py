@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+"""
+    tests.journal
+    ~~~~~~~~~~~~~
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+import asyncio
+
+from plumbca.journal import Journal, list_segments, read_segment, replay
+
+
+def test_journal_group_commit(loop, tmpdir):
+    journal = Journal()
+    journal.open(str(tmpdir), commit_interval=0.01, segment_size=1 << 20)
+
+    async def _routine_ope():
+        await asyncio.gather(*[journal.append('mstore', 'foo', [[i, 'bar', 3600, {}]])
+                               for i in range(100)])
+        assert journal.buffer == [] and journal.waiter is None
+        await journal.close()
+        assert not journal.enabled
+        # appending to the disabled journal is a no-op
+        await journal.append('fetch', 'foo', '__all__', 100)
+    loop.run_until_complete(_routine_ope())
+
+    segments = list_segments(str(tmpdir))
+    assert len(segments) == 1
+    records = list(read_segment(segments[0]))
+    assert [r[1:3] for r in records] == [['mstore', 'foo']] * 100
+    # the gathered appends run in any order
+    assert sorted(r[3][0][0] for r in records) == list(range(100))
+
+
+def test_journal_rotation(loop, tmpdir):
+    journal = Journal()
+    journal.open(str(tmpdir), commit_interval=0, segment_size=64)
+
+    async def _routine_ope():
+        for i in range(3):
+            await journal.append('mstore', 'foo', [[i, 'bar', 3600, 'x' * 64]])
+            # the segments are named by the milliseconds
+            await asyncio.sleep(0.002)
+        await journal.close()
+    loop.run_until_complete(_routine_ope())
+
+    segments = list_segments(str(tmpdir))
+    assert len(segments) == 4
+    assert sum(len(list(read_segment(path))) for path in segments) == 3
+
+    # the torn record at the tail is ignored
+    with open(segments[0], 'ab') as f:
+        f.write(b'\x94\xcb')
+    assert len(list(read_segment(segments[0]))) == 1
+
+
+def test_journal_replay(loop, arb, cachectl, tmpdir):
+    loop.run_until_complete(arb.init_connection())
+    journal = Journal()
+    journal.open(str(tmpdir), commit_interval=0.01)
+
+    async def _routine_ope():
+        await journal.append('ensure_collection', 'foo', 'IncreaseCollection',
+                             3600, {})
+        await journal.append('mstore', 'foo', [[ts, 'bar', ts + 100, {'a': 1}]
+                                               for ts in range(10)])
+        await journal.append('fetch', 'foo', '__all__', 105)
+        await journal.close()
+
+        assert await replay(cachectl, list_segments(str(tmpdir))) == 3
+        coll = cachectl.get_collection('foo')
+        rv = list(await coll.query(0, 100, 'bar'))
+        assert [key for key, _, _ in rv] == ['{}:bar'.format(ts)
+                                             for ts in range(5, 10)]
+    loop.run_until_complete(_routine_ope())
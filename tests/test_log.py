@@ -0,0 +1,35 @@
+# -*- coding:utf-8 -*-
+"""
+    tests.log
+    ~~~~~~~~~
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from logging.handlers import QueueHandler
+import logging
+
+from plumbca.log import SamplingFilter, _listeners
+
+
+def _record(level):
+    return logging.LogRecord('activity', level, __file__, 1, 'msg', None, None)
+
+
+def test_sampling_filter():
+    assert not any(SamplingFilter(0).filter(_record(logging.INFO))
+                   for i in range(100))
+    assert all(SamplingFilter(1).filter(_record(logging.INFO))
+               for i in range(100))
+    # the warnings and errors are never dropped
+    assert SamplingFilter(0).filter(_record(logging.WARNING))
+    assert SamplingFilter(0).filter(_record(logging.ERROR))
+
+
+def test_queue_listeners():
+    for name in ('write-opes', 'activity', 'errors'):
+        handlers = logging.getLogger(name).handlers
+        assert isinstance(handlers[0], QueueHandler)
+    assert len(_listeners) == 3
+    assert all(listener._thread.is_alive() for listener in _listeners)
@@ -0,0 +1,50 @@
+# -*- coding:utf-8 -*-
+"""
+    tests.metrics
+    ~~~~~~~~~~~~~
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from plumbca.metrics import MetricsWriter, render_metrics
+from plumbca.stats import Histogram
+
+
+def test_metrics_writer():
+    hist = Histogram()
+    for v in (0.001, 0.002, 0.5, 1000):
+        hist.observe(v)
+
+    w = MetricsWriter()
+    w.family('foo_seconds', 'histogram', 'The foo latency.')
+    w.histogram('foo_seconds', hist, command='a"b')
+    lines = w.render().splitlines()
+    assert lines[:2] == ['# HELP foo_seconds The foo latency.',
+                         '# TYPE foo_seconds histogram']
+
+    buckets = [line for line in lines if line.startswith('foo_seconds_bucket')]
+    assert len(buckets) == len(Histogram.bounds) // 2 + 1
+    assert buckets[-1] == 'foo_seconds_bucket{command="a\\"b",le="+Inf"} 4'
+    counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+    assert counts == sorted(counts) and counts[-2] == 3
+    assert lines[-1] == 'foo_seconds_count{command="a\\"b"} 4'
+
+
+def test_render_metrics(loop, arb, cachectl):
+    loop.run_until_complete(arb.init_connection())
+
+    async def _routine_ope():
+        await cachectl.ensure_collection('foo', 'IncreaseCollection', 3600)
+        coll = cachectl.get_collection('foo')
+        for ts in range(10):
+            await coll.store(ts, 'bar', {'a': 1})
+
+        lines = (await render_metrics(cachectl)).splitlines()
+        assert 'plumbca_collection_timestamps{collection="foo",' \
+               'type="IncreaseCollection"} 10' in lines
+        assert 'plumbca_collection_cache_items{collection="foo"} 10' in lines
+        assert any(line.startswith('plumbca_backend_call_duration_seconds_count'
+                                   '{method="set_collection_index"}')
+                   for line in lines)
+    loop.run_until_complete(_routine_ope())
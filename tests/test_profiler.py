@@ -0,0 +1,63 @@
+# -*- coding:utf-8 -*-
+"""
+    tests.profiler
+    ~~~~~~~~~~~~~~
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+import asyncio
+import os
+import pstats
+import time
+
+import pytest
+
+from plumbca.profiler import Profiler
+
+
+def _busy(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        sum(range(1000))
+
+
+def test_profiler_cprofile(loop, tmpdir):
+    profiler = Profiler()
+
+    async def _routine_ope():
+        profiler.start(0.05, loop=loop)
+        assert profiler.status()['mode'] == 'cprofile'
+        with pytest.raises(RuntimeError):
+            profiler.start(0.05, loop=loop)
+        _busy(0.01)
+        # stopped by the timer
+        await asyncio.sleep(0.2)
+        assert not profiler.running
+        assert await profiler.stop() is None
+    loop.run_until_complete(_routine_ope())
+
+    fnames = [f for f in os.listdir(str(tmpdir)) if f.endswith('.pstats')]
+    assert len(fnames) == 1
+    st = pstats.Stats(os.path.join(str(tmpdir), fnames[0]))
+    assert any(func[2] == '_busy' for func in st.stats)
+
+
+def test_profiler_sample(loop, tmpdir):
+    profiler = Profiler()
+
+    async def _routine_ope():
+        profiler.start(60, mode='sample', loop=loop)
+        _busy(0.2)
+        return await profiler.stop()
+    fpath = loop.run_until_complete(_routine_ope())
+
+    assert fpath.startswith(str(tmpdir)) and fpath.endswith('.collapsed')
+    with open(fpath) as f:
+        lines = f.read().splitlines()
+    assert lines and all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
+    assert any('test_profiler.py:_busy' in line for line in lines)
+
+    with pytest.raises(ValueError):
+        profiler.start(1, mode='unknown', loop=loop)
@@ -11,8 +11,10 @@ from unittest import mock
 
 import pytest
 from plumbca.protocol import PlumbcaCmdProtocol
+from plumbca.helpers import unpackb
+from plumbca.message import message_process_failure
 
-from utils import CoroWraps, req, call_first_args
+from utils import CoroWraps, CoroSeqWraps, req, req_frame, call_first_args
 
 
 @pytest.mark.incremental
@@ -29,3 +31,66 @@ def test_worker_basic(loop, reader, writer):
 
     assert call_first_args(writer.write) == 'OK'
     assert writer.get_extra_info.called
+
+
+@pytest.mark.incremental
+def test_worker_keepalive(loop, reader, writer):
+    m = mock.MagicMock()
+    m.run_command = CoroSeqWraps(['OK1', 'OK2', 'OK3'])
+
+    pcp = PlumbcaCmdProtocol(keepalive=True)
+    pcp.handler = m
+    # pipelined requests, then the client close the connection
+    reader.readline = CoroSeqWraps([req('command', 'test.test')] * 3 + [b''])
+    coro = pcp.plumbca_cmd_handle(reader, writer)
+    loop.run_until_complete(coro)
+
+    assert [c[0][0] for c in writer.write.call_args_list] == ['OK1', 'OK2', 'OK3']
+    assert writer.close.call_count == 1
+
+
+@pytest.mark.incremental
+def test_worker_msgpack_framing(loop, reader, writer):
+    received = []
+
+    class _handler:
+        async def run_command(self, req):
+            received.append((req.command, req.args))
+            return 'OK'
+
+    pcp = PlumbcaCmdProtocol(keepalive=True, framing='msgpack')
+    pcp.handler = _handler()
+    # the payload contains newline bytes and the frames arrive in pieces
+    args = ['foo', 1, 'bar\n', {'a\nb': 1}]
+    data = req_frame('STORE', args) * 2
+    chunks = [data[:5], data[5:len(data) - 3], data[len(data) - 3:], b'']
+    reader.read = CoroSeqWraps(chunks)
+    coro = pcp.plumbca_cmd_handle(reader, writer)
+    loop.run_until_complete(coro)
+
+    assert received == [('store', args), ('store', args)]
+    assert writer.write.call_count == 2
+    assert writer.close.call_count == 1
+
+
+@pytest.mark.incremental
+def test_worker_invalid_args(loop, reader, writer):
+    received = []
+
+    class _handler:
+        async def run_command(self, req):
+            received.append((req.command, req.args))
+            return 'OK'
+
+    pcp = PlumbcaCmdProtocol(keepalive=True, framing='msgpack')
+    pcp.handler = _handler()
+    # the non-sequence args are rejected before running the command
+    data = req_frame('STORE', 1) + req_frame('STORE', ('foo', 1))
+    reader.read = CoroSeqWraps([data, b''])
+    coro = pcp.plumbca_cmd_handle(reader, writer)
+    loop.run_until_complete(coro)
+
+    assert received == [('store', ['foo', 1])]
+    resp = unpackb(writer.write.call_args_list[0][0][0])
+    assert resp['headers']['status'] == message_process_failure
+    assert writer.write.call_args_list[1][0][0] == 'OK'
@@ -0,0 +1,161 @@
+# -*- coding:utf-8 -*-
+"""
+    tests.server
+    ~~~~~~~~~~~~
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+import asyncio
+import os
+import signal
+import socket
+from unittest import mock
+
+import pytest
+from plumbca.cache import CacheCtl
+from plumbca.config import DefaultConf
+from plumbca.exceptions import PlumbcaConfigError
+from plumbca.helpers import Unpacker
+from plumbca.protocol import PlumbcaCmdProtocol
+from plumbca.server import (Supervisor, _create_server,
+                            _remove_stale_unixsocket)
+
+from utils import req_frame
+
+
+def test_serve_unixsocket(loop, tmpdir):
+    path = str(tmpdir.join('plumbca.sock'))
+    conf = {'transport': 'unix', 'unixsocket': path, 'unixsocketperm': '700'}
+    # the stale socket file is replaced when serving
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    with mock.patch.dict(DefaultConf, conf):
+        pcp = PlumbcaCmdProtocol(keepalive=True, framing='msgpack')
+        server = _create_server(loop, pcp)
+    assert oct(os.stat(path).st_mode & 0o777) == '0o700'
+
+    async def _routine_ope():
+        reader, writer = await asyncio.open_unix_connection(path, loop=loop)
+        # the pipelined requests over the unix socket
+        writer.write(req_frame('ping', []) * 2)
+        unpacker = Unpacker()
+        rv = []
+        while len(rv) < 2:
+            data = await reader.read(1024)
+            assert data
+            unpacker.feed(data)
+            rv += list(unpacker)
+        writer.close()
+        return rv
+    rv = loop.run_until_complete(_routine_ope())
+    assert [r['datas'] for r in rv] == ['SERVER OK'] * 2
+
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+
+
+def test_remove_stale_unixsocket(tmpdir):
+    path = str(tmpdir.join('plumbca.sock'))
+    # the socket file is left after the server exits without cleaning up
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.close()
+    assert os.path.exists(path)
+    _remove_stale_unixsocket(path)
+    assert not os.path.exists(path)
+    # nothing to remove
+    _remove_stale_unixsocket(path)
+
+    # refuse to remove the socket of a running server
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(1)
+    try:
+        with pytest.raises(PlumbcaConfigError):
+            _remove_stale_unixsocket(path)
+        assert os.path.exists(path)
+    finally:
+        sock.close()
+        os.unlink(path)
+
+    # refuse to remove the file that is not a socket
+    tmpdir.join('plumbca.sock').write('foo')
+    with pytest.raises(PlumbcaConfigError):
+        _remove_stale_unixsocket(path)
+    assert os.path.exists(path)
+
+
+def test_supervisor_respawn():
+    class _Supervisor(Supervisor):
+        min_uptime = 0
+
+        def __init__(self, workers):
+            super().__init__(workers)
+            self.spawned = []
+
+        def spawn(self, index):
+            self.spawned.append(index)
+            # stop respawning after each worker died once
+            if len(self.spawned) == 2 * self.workers:
+                self.stopping = True
+            super().spawn(index)
+
+    def _crash(self, index):
+        raise RuntimeError('worker {} crashed'.format(index))
+
+    handlers = {s: signal.getsignal(s) for s in (signal.SIGTERM, signal.SIGINT)}
+    supervisor = _Supervisor(2)
+    try:
+        with mock.patch.dict(DefaultConf, {'transport': 'tcp'}), \
+                mock.patch.object(Supervisor, '_run_worker', _crash):
+            supervisor.run()
+    finally:
+        for s, handler in handlers.items():
+            signal.signal(s, handler)
+
+    # the respawned workers take the indexes of the dead ones
+    assert supervisor.spawned[:2] == [0, 1]
+    assert sorted(supervisor.spawned[2:]) == [0, 1]
+    assert supervisor.children == {}
+
+
+def test_supervisor_load_and_dump_once():
+    calls = []
+
+    async def _load():
+        calls.append('load')
+
+    async def _dump():
+        calls.append('dump')
+
+    class _Supervisor(Supervisor):
+        min_uptime = 0
+
+        def spawn(self, index):
+            # stop respawning after every worker was spawned once
+            if len(calls) == 1 + self.workers:
+                self.stopping = True
+            calls.append(index)
+            super().spawn(index)
+
+    def _exit(self, index):
+        pass
+
+    conf = {'transport': 'tcp', 'loaddump': 'yes', 'dumponexit': 'yes'}
+    handlers = {s: signal.getsignal(s) for s in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        with mock.patch.dict(DefaultConf, conf), \
+                mock.patch.object(Supervisor, '_run_worker', _exit), \
+                mock.patch.object(CacheCtl, 'load', _load), \
+                mock.patch.object(CacheCtl, 'dump', _dump):
+            _Supervisor(2).run()
+    finally:
+        for s, handler in handlers.items():
+            signal.signal(s, handler)
+
+    # the workers never load or dump by themselves
+    assert calls[:3] == ['load', 0, 1]
+    assert calls[-1] == 'dump' and calls.count('dump') == 1
@@ -0,0 +1,42 @@
+# -*- coding:utf-8 -*-
+"""
+    tests.slowlog
+    ~~~~~~~~~~~~~
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from plumbca.slowlog import SlowLog
+from plumbca.stats import RequestStats
+
+
+def test_slowlog():
+    request_stats = RequestStats()
+    request_stats.round_trips = 3
+    request_stats.backend_time = 0.02
+
+    slowlog = SlowLog(slower_than=10000, max_len=3)
+    slowlog.record('store', ['foo', 1, 'bar', {'a': 1}], 0.001, request_stats)
+    assert len(slowlog) == 0
+
+    for i in range(5):
+        slowlog.record('fetch', ['foo', 'x' * 100] + list(range(10)), 0.05,
+                       request_stats)
+    assert len(slowlog) == 3
+
+    entries = slowlog.get(2)
+    assert [entry[0] for entry in entries] == [4, 3]
+    _, _, duration, backend_time, round_trips, command, collection, args = entries[0]
+    assert (duration, backend_time, round_trips) == (50000, 20000, 3)
+    assert (command, collection) == ('fetch', 'foo')
+    assert len(args) == 9 and args[-1] == '... (4 more arguments)'
+    assert args[1].endswith('(38 more chars)')
+
+    slowlog.reset()
+    assert slowlog.get() == []
+
+    # the negative threshold disables the log
+    slowlog = SlowLog(slower_than=-1, max_len=3)
+    slowlog.record('fetch', [], 100, request_stats)
+    assert len(slowlog) == 0
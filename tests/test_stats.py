@@ -0,0 +1,61 @@
+# -*- coding:utf-8 -*-
+"""
+    tests.stats
+    ~~~~~~~~~~~
+
+    :copyright: (c) 2015 by Jason Lai.
+    :license: BSD, see LICENSE for more details.
+"""
+
+import asyncio
+
+from plumbca.stats import Histogram, Stats
+
+
+def test_histogram():
+    hist = Histogram()
+    assert hist.summary()['p99'] == 0.0
+
+    for i in range(1, 1001):
+        hist.observe(i / 1000)
+    assert hist.count == 1000
+    assert len(hist.counts) == len(Histogram.bounds) + 1
+    # the estimation is the bucket upper bound, at most sqrt(2) times larger
+    for p in (50, 90, 99):
+        assert p / 100 <= hist.percentile(p) <= p / 100 * 2 ** 0.5
+    assert hist.percentile(100) == hist.max == 1.0
+
+    hist.observe(1e6)
+    assert hist.percentile(100) == 1e6
+
+
+def test_stats_requests(loop):
+    stats = Stats()
+
+    async def _request(command, round_trips, failed=False):
+        request = stats.begin_request()
+        for _ in range(round_trips):
+            await asyncio.sleep(0)
+            stats.backend_call(0.001)
+        stats.end_request(command, request, 0.01, failed)
+
+    async def _outside():
+        stats.backend_call(0.001)
+
+    loop.run_until_complete(asyncio.gather(
+        _request('store', 2), _request('store', 3), _request('fetch', 1, True),
+        # the backend calls outside of the requests are not attributed
+        _outside()))
+
+    rv = stats.info()
+    assert rv['commands']['store']['calls'] == 2
+    assert rv['commands']['store']['round_trips'] == 5
+    assert rv['commands']['fetch']['errors'] == 1
+    assert rv['commands']['fetch']['latency']['count'] == 1
+
+
+def test_stats_loop_lag(loop):
+    stats = Stats()
+    stats.monitor_loop_lag(loop, interval=0.01)
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert stats.loop_lag.count > 0
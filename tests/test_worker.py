@@ -7,11 +7,16 @@
     :license: BSD, see LICENSE for more details.
 """
 
+import os
+from unittest import mock
+
 import pytest
 
 from plumbca.worker import Worker
-from plumbca.message import message_process_success
+from plumbca.message import (message_process_success, message_process_failure,
+                             message_journal_failure)
 from plumbca.helpers import unpackb
+from plumbca.journal import journal, list_segments, replay
 
 
 @pytest.mark.incremental
@@ -69,3 +74,134 @@ def test_worker_fetch(loop, arb, coll_list):
             rv = unpackb(await worker.fetch(coll))['datas']
             assert len(rv) == 0
     loop.run_until_complete(_routine_ope())
+
+
+@pytest.mark.incremental
+def test_worker_mstore(loop, arb, coll_list):
+    loop.run_until_complete(arb.init_connection())
+
+    async def _routine_ope():
+        worker = Worker()
+        tag, val = 'www.cdnzz.com', {'test': 1}
+        for coll in coll_list:
+            await worker.ensure_collection(coll, expired=7200)
+
+        items = [[coll, 123 + i, tag, val] for coll in coll_list
+                                            for i in range(10)]
+        items.append(['not-exists', 123, tag, val])
+        items.append([coll_list[0], 123, tag, 'not-a-dict'])
+        r = unpackb(await worker.mstore(items))
+        assert r['headers']['status'] == message_process_success
+        status = r['datas']
+        assert len(status) == len(items)
+        assert [s[0] for s in status[:-2]] == [message_process_success] * (len(items) - 2)
+        assert status[-2][0] == message_process_failure
+        assert status[-1][0] == message_process_failure
+
+        # storing to the existing key again should increase the value
+        await worker.mstore([[coll_list[0], 123, tag, val]])
+        for coll in coll_list:
+            rv = unpackb(await worker.query(coll, 10, 1000, tag))['datas']
+            assert len(rv) == 10
+            assert rv[0][1] == ({'test': 2} if coll == coll_list[0] else val)
+    loop.run_until_complete(_routine_ope())
+
+
+def test_worker_mstore_journal(loop, arb, cachectl, tmpdir):
+    loop.run_until_complete(arb.init_connection())
+    journal.open(str(tmpdir), commit_interval=0.01, loop=loop)
+
+    async def _routine_ope():
+        worker = Worker()
+        await worker.ensure_collection('foo', expired=7200)
+        # the increments of the same key are merged while storing
+        await worker.mstore([['foo', 100, 'bar', {'a': 1}],
+                             ['foo', 100, 'bar', {'a': 2}]])
+        await worker.store('foo', 100, 'bar', {'a': 1})
+        await journal.close()
+        live = unpackb(await worker.query('foo', 0, 1000, 'bar'))['datas']
+        assert live[0][1] == {'a': 4}
+
+        # the replay rebuilds the same values
+        await arb.rdb.flushdb()
+        cachectl.collmap = {}
+        assert await replay(cachectl, list_segments(str(tmpdir))) == 3
+        rv = unpackb(await worker.query('foo', 0, 1000, 'bar'))['datas']
+        assert rv == live
+    loop.run_until_complete(_routine_ope())
+
+
+def test_worker_journal_failure(loop, arb, cachectl):
+    loop.run_until_complete(arb.init_connection())
+
+    async def _failed_append(record):
+        raise OSError('disk full')
+
+    async def _routine_ope():
+        worker = Worker()
+        await worker.ensure_collection('foo', expired=7200)
+        with mock.patch.object(journal, 'append_packed', _failed_append):
+            r = unpackb(await worker.store('foo', 100, 'bar', {'a': 1}))
+            assert r['headers']['status'] == message_journal_failure
+            assert r['headers']['err_msg'] == 'disk full'
+            r = unpackb(await worker.mstore([['foo', 100, 'bar', {'a': 2}]]))
+            assert r['datas'] == [[message_journal_failure, 'disk full']]
+        # the commands are applied even though their records are lost
+        rv = unpackb(await worker.query('foo', 0, 1000, 'bar'))['datas']
+        assert rv[0][1] == {'a': 3}
+    loop.run_until_complete(_routine_ope())
+
+
+@pytest.mark.incremental
+def test_worker_uniq_count_query(loop, arb):
+    loop.run_until_complete(arb.init_connection())
+
+    async def _routine_ope():
+        worker = Worker()
+        await worker.ensure_collection('uc', 'UniqueCountCollection', 7200)
+        await worker.store('uc', 123, 'tag', ['a', 'b'])
+        await worker.store('uc', 123, 'tag', ['b', 'c'])
+
+        # the sets of the members are packed as the lists
+        r = unpackb(await worker.query('uc', 10, 1000, 'tag'))
+        assert r['headers']['status'] == message_process_success
+        assert sorted(r['datas'][0][1]) == ['a', 'b', 'c']
+        r = unpackb(await worker.fetch('uc', 'tag', True, False))
+        assert sorted(r['datas'][0][1]) == ['a', 'b', 'c']
+    loop.run_until_complete(_routine_ope())
+
+
+def test_worker_collection_info(loop, arb):
+    loop.run_until_complete(arb.init_connection())
+
+    async def _routine_ope():
+        worker = Worker()
+        await worker.ensure_collection('hll', 'UniqueCountCollection', 7200,
+                                       {'approximate': True})
+        await worker.ensure_collection('uc', 'UniqueCountCollection', 7200)
+
+        r = unpackb(await worker.collection_info('hll'))
+        assert r['datas'] == {'name': 'hll', 'ctype': 'UniqueCountCollection',
+                              'expire': 7200, 'approximate': True,
+                              'std_error': 0.0081}
+        r = unpackb(await worker.collection_info('uc'))
+        assert r['datas']['std_error'] == 0
+    loop.run_until_complete(_routine_ope())
+
+
+def test_worker_profile(loop, tmpdir):
+    async def _routine_ope():
+        worker = Worker()
+        # this worker's profiler is not the one started by another worker
+        with pytest.raises(RuntimeError):
+            await worker.profile('stop')
+        with pytest.raises(RuntimeError):
+            await worker.profile('status')
+
+        r = unpackb(await worker.profile('start', 60))
+        assert r['datas'] == {'status': 'PROFILE STARTED', 'pid': os.getpid()}
+        r = unpackb(await worker.profile('status'))
+        assert r['datas']['running'] and r['datas']['pid'] == os.getpid()
+        r = unpackb(await worker.profile('stop'))
+        assert r['datas'].startswith(str(tmpdir))
+    loop.run_until_complete(_routine_ope())
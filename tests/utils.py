@@ -21,6 +21,19 @@ class CoroWraps:
             h.cancel()
 
 
+class CoroSeqWraps(CoroWraps):
+    """Return the items of `seq` one by one in the successive calls."""
+
+    def __init__(self, seq):
+        super().__init__()
+        self.seq = list(seq)
+
+    @coroutine
+    def __call__(self, *args):
+        self.s = self.seq.pop(0)
+        return (yield from super().__call__(*args))
+
+
 def req(command, args):
     command = command.encode('utf8')
     args = {
@@ -30,6 +43,10 @@ def req(command, args):
     return b' '.join([command, args])
 
 
+def req_frame(command, args):
+    return packb([command, {'args': args}])
+
+
 def call_first_args(call):
     """The call objects in Mock.call_args and Mock.call_args_list are
     two-tuples of (positional args, keyword args)"""